@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import time
+
 from django.conf import settings
+from django.core.cache import cache
 from django.db import connection
 
 
@@ -220,3 +223,70 @@ def get_system_config_label(key, name, schema_name=None):
         if ele.get("value") == str(name):
             return ele.get("label")
     return ""
+
+
+# ================================================= #
+# ******************** 缓存版本 ******************** #
+# ================================================= #
+# 仅当前进程可见的缓存后端
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def is_shared_cache():
+    """
+    settings.CACHES 的 default 是否为多进程共享的缓存(如redis)
+    :return:
+    """
+    return settings.CACHES.get("default", {}).get("BACKEND") not in LOCAL_CACHE_BACKENDS
+
+
+def is_process_cache_enabled():
+    """
+    是否启用进程内缓存(如接口权限索引、数据权限范围、部门完整名称、按角色缓存的路由):
+    缓存版本号须存放在共享缓存中, 数据变化时才能通知所有进程失效; 否则各缓存回退为开销较小的查询
+    (如只查询当前角色的接口权限, 或同一请求内只查询一次, 见 request_util.get_request_cache).
+    单进程部署(如 runserver)可设置 settings.LOCAL_CACHE_SINGLE_PROCESS = True 启用
+    :return:
+    """
+    return is_shared_cache() or getattr(settings, "LOCAL_CACHE_SINGLE_PROCESS", False)
+
+
+def _get_cache_version_key(name, schema_name=None):
+    if is_tenants_mode():
+        return f"dvadmin:version:{schema_name or connection.tenant.schema_name}:{name}"
+    return f"dvadmin:version:{name}"
+
+
+def get_cache_version(name, schema_name=None):
+    """
+    获取缓存版本号(如权限、部门),各进程内的缓存以此判断是否失效
+    缓存不是共享缓存时进程内缓存不启用, 见 is_process_cache_enabled
+    :param name: 缓存名称
+    :param schema_name: 对应租户schema_name值
+    :return:
+    """
+    key = _get_cache_version_key(name, schema_name)
+    version = cache.get(key)
+    if version is None:
+        # 缓存重启或淘汰后版本号不能从固定值重新开始, 否则旧版本号(如token中的权限版本号)会再次生效
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def refresh_cache_version(name, schema_name=None):
+    """
+    刷新缓存版本号,使所有进程内对应的缓存失效
+    :param name: 缓存名称
+    :param schema_name: 对应租户schema_name值
+    :return:
+    """
+    key = _get_cache_version_key(name, schema_name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.incr(key)
@@ -109,6 +109,14 @@ DATABASES = {
         "PORT": DATABASE_PORT,
     }
 }
+# 独立日志数据库: 配置后操作日志、登录日志读写该数据库, 与业务表分离, 需执行 python manage.py migrate --database logs
+# 例如: LOG_DATABASE = {"ENGINE": "django.db.backends.mysql", "NAME": "django-vue3-admin-logs", ...}
+LOG_DATABASE = locals().get("LOG_DATABASE", None)
+LOG_DATABASE_ALIAS = "logs"
+LOG_DATABASE_MODELS = ["system.OperationLog", "system.LoginLog"]
+if LOG_DATABASE:
+    DATABASES[LOG_DATABASE_ALIAS] = LOG_DATABASE
+    DATABASE_ROUTERS = ["dvadmin.utils.log_sinks.LogDatabaseRouter"]
 AUTH_USER_MODEL = "system.Users"
 USERNAME_FIELD = "username"
 
@@ -191,6 +199,21 @@ CHANNEL_LAYERS = {
 #     },
 # }
 
+# ===================================================== #
+# ********************* 缓存配置 ********************** #
+# ===================================================== #
+# 权限等进程内缓存的版本号存放于此, 需为多进程共享的缓存(如redis, 见 conf/env.example.py);
+# 使用 LocMemCache 时各进程无法感知其他进程的数据变化, 进程内缓存不启用, 回退为按请求查询数据库:
+# 接口权限索引、数据权限范围、部门完整名称、按角色缓存的路由等缓存优化仅在配置 redis
+# 或 LOCAL_CACHE_SINGLE_PROCESS = True 时生效
+CACHES = locals().get("CACHES", {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+})
+# 单进程部署(如开发环境 runserver)使用 LocMemCache 时, 可开启进程内缓存
+LOCAL_CACHE_SINGLE_PROCESS = locals().get("LOCAL_CACHE_SINGLE_PROCESS", False)
+
 
 # ================================================= #
 # ********************* 日志配置 ******************* #
@@ -290,12 +313,12 @@ REST_FRAMEWORK = {
     "DEFAULT_FILTER_BACKENDS": (
         # 'django_filters.rest_framework.DjangoFilterBackend',
         "dvadmin.utils.filters.CustomDjangoFilterBackend",
-        "rest_framework.filters.SearchFilter",
+        "dvadmin.utils.filters.CustomSearchFilter",
         "rest_framework.filters.OrderingFilter",
     ),
     "DEFAULT_PAGINATION_CLASS": "dvadmin.utils.pagination.CustomPagination",  # 自定义分页
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "dvadmin.utils.authentication.CustomJWTAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
@@ -320,6 +343,34 @@ SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("JWT",),
     "ROTATE_REFRESH_TOKENS": True,
 }
+# 是否在token中写入用户角色及权限版本号,开启后每次请求不再查询用户角色(角色变化后旧token自动回退为查询),
+# 需配置共享缓存(CACHES 为 redis 等), 否则不生效
+PERMISSION_JWT_SNAPSHOT = locals().get("PERMISSION_JWT_SNAPSHOT", False)
+# 数据权限范围进程内缓存的最大条数
+DATA_SCOPE_CACHE_SIZE = locals().get("DATA_SCOPE_CACHE_SIZE", 10000)
+# 按角色缓存的前端路由、按钮权限的过期时间(秒),菜单或权限变化时自动失效
+ROLE_CACHE_TIMEOUT = locals().get("ROLE_CACHE_TIMEOUT", 60 * 60)
+# 是否开启部门用户数计数缓存(部门信息统计),用户变更部门时增量更新,过期后重新统计
+DEPT_USER_COUNTER_CACHE = locals().get("DEPT_USER_COUNTER_CACHE", False)
+DEPT_USER_COUNTER_CACHE_TIMEOUT = locals().get("DEPT_USER_COUNTER_CACHE_TIMEOUT", 60 * 60)
+# 是否在响应头X-Query-Plan中输出视图集自动生成的查询计划(select_related/prefetch_related/only),默认随DEBUG
+QUERY_PLAN_DEBUG_HEADER = locals().get("QUERY_PLAN_DEBUG_HEADER", DEBUG)
+# 分页总数统计策略: exact(精确COUNT)|cached(按查询条件缓存)|estimated(无查询条件时按数据库统计信息估算, 否则按查询条件缓存), 视图集可通过count_strategy覆盖
+PAGINATION_COUNT_STRATEGY = locals().get("PAGINATION_COUNT_STRATEGY", "exact")
+PAGINATION_COUNT_CACHE_TIMEOUT = locals().get("PAGINATION_COUNT_CACHE_TIMEOUT", 60)
+# 估算总数小于该值时改用精确统计
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = locals().get("PAGINATION_COUNT_ESTIMATE_THRESHOLD", 10000)
+# 是否使用全文搜索索引(MySQL FULLTEXT / SQLite FTS5 影子表), 需先执行 python manage.py rebuild_search_index
+SEARCH_INDEX_ENABLED = locals().get("SEARCH_INDEX_ENABLED", True)
+# 未启用进程内缓存时, 每隔多少秒重新检查全文搜索影子表是否存在(其他进程重建索引后生效)
+SEARCH_INDEX_TABLE_CHECK_INTERVAL = locals().get("SEARCH_INDEX_TABLE_CHECK_INTERVAL", 60)
+# 日志保留天数, 超期的操作日志、登录日志归档至 LOG_ARCHIVE_DIR 后从数据库删除: python manage.py archive_logs
+LOG_RETENTION_DAYS = locals().get("LOG_RETENTION_DAYS", 180)
+# 日志归档目录, 含用户名、IP等数据, 不能位于 MEDIA_ROOT 等对外提供访问的目录下
+LOG_ARCHIVE_DIR = locals().get("LOG_ARCHIVE_DIR", os.path.join(BASE_DIR, "logs", "archive"))
+LOG_ARCHIVE_CHUNK_SIZE = locals().get("LOG_ARCHIVE_CHUNK_SIZE", 5000)
+# MySQL 日志分区表预建的未来月份分区数
+LOG_PARTITION_MONTHS_AHEAD = locals().get("LOG_PARTITION_MONTHS_AHEAD", 3)
 
 # ====================================#
 # ****************swagger************#
@@ -371,6 +422,33 @@ DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 API_LOG_ENABLE = True
 # API_LOG_METHODS = 'ALL' # ['POST', 'DELETE']
 API_LOG_METHODS = ["POST", "UPDATE", "DELETE", "PUT"]  # ['POST', 'DELETE']
+# 操作日志异步批量写入: 关闭时每个请求同步写入(如测试环境)
+API_LOG_ASYNC = locals().get("API_LOG_ASYNC", True)
+# 日志队列最大长度, 队列满时最多等待 API_LOG_QUEUE_TIMEOUT 秒, 仍无法放入则丢弃
+API_LOG_QUEUE_SIZE = locals().get("API_LOG_QUEUE_SIZE", 10000)
+API_LOG_QUEUE_TIMEOUT = locals().get("API_LOG_QUEUE_TIMEOUT", 0.01)
+# 每批写入条数及最长写入间隔(秒)
+API_LOG_BATCH_SIZE = locals().get("API_LOG_BATCH_SIZE", 200)
+API_LOG_FLUSH_INTERVAL = locals().get("API_LOG_FLUSH_INTERVAL", 1.0)
+# 操作日志、登录日志输出目标, 可同时配置多个: database(数据库, 配置了 LOG_DATABASE 时为日志数据库) |
+# logs_database(日志数据库) | file(NDJSON 文件, 日志管理页面不显示) | 自定义 LogSink 导入路径
+LOG_SINKS = locals().get("LOG_SINKS", ["database"])
+# NDJSON 文件输出目录(每个进程单独一个文件), 单个文件超过 LOG_FILE_SINK_MAX_BYTES 字节或每 LOG_FILE_SINK_INTERVAL 秒滚动
+LOG_FILE_SINK_DIR = locals().get("LOG_FILE_SINK_DIR", os.path.join(BASE_DIR, "logs", "sink"))
+LOG_FILE_SINK_MAX_BYTES = locals().get("LOG_FILE_SINK_MAX_BYTES", 1024 * 1024 * 100)
+LOG_FILE_SINK_INTERVAL = locals().get("LOG_FILE_SINK_INTERVAL", 24 * 60 * 60)
+# 日志记录时 UA 解析结果的进程内缓存最大条数
+USER_AGENT_CACHE_SIZE = locals().get("USER_AGENT_CACHE_SIZE", 1000)
+# 登录日志IP地理位置解析方式: local(本地离线库, 由 python manage.py build_ip_database 生成) | remote(远程接口),
+# 默认已生成本地库时使用 local, 否则使用 remote(登录日志先写入, 由后台线程解析后补充地理位置)
+IP_GEOLOCATION_DB = locals().get("IP_GEOLOCATION_DB", os.path.join(BASE_DIR, "conf", "ip_geolocation.db"))
+IP_GEOLOCATION_PROVIDER = locals().get("IP_GEOLOCATION_PROVIDER",
+                                       "local" if os.path.exists(IP_GEOLOCATION_DB) else "remote")
+# 远程接口超时时间(秒), 请求失败后 IP_GEOLOCATION_RETRY_INTERVAL 秒内不再请求
+IP_GEOLOCATION_TIMEOUT = locals().get("IP_GEOLOCATION_TIMEOUT", 1)
+IP_GEOLOCATION_RETRY_INTERVAL = locals().get("IP_GEOLOCATION_RETRY_INTERVAL", 60)
+# IP地理位置查询结果的进程内缓存最大条数
+IP_GEOLOCATION_CACHE_SIZE = locals().get("IP_GEOLOCATION_CACHE_SIZE", 10000)
 API_MODEL_MAP = {
     "/token/": "登录模块",
     "/api/login/": "登录模块",
@@ -379,6 +457,10 @@ API_MODEL_MAP = {
 
 DJANGO_CELERY_BEAT_TZ_AWARE = False
 CELERY_TIMEZONE = "Asia/Shanghai"  # celery 时区问题
+# celery 定时任务: 每天归档超期日志
+CELERYBEAT_SCHEDULE = locals().get("CELERYBEAT_SCHEDULE", {
+    "archive_logs": {"task": "dvadmin.system.tasks.archive_logs", "schedule": timedelta(days=1)},
+})
 # 静态页面压缩
 STATICFILES_STORAGE = "whitenoise.storage.CompressedStaticFilesStorage"
 
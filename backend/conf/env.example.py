@@ -22,6 +22,15 @@ DATABASE_PORT = 3306
 DATABASE_USER = "root"
 # # 数据库密码
 DATABASE_PASSWORD = "DVADMIN3"
+# 独立日志数据库(可选), 配置后操作日志、登录日志写入该数据库, 需执行 python manage.py migrate --database logs
+# LOG_DATABASE = {
+#     "ENGINE": "django.db.backends.mysql",
+#     "NAME": "django-vue3-admin-logs",
+#     "USER": DATABASE_USER,
+#     "PASSWORD": DATABASE_PASSWORD,
+#     "HOST": DATABASE_HOST,
+#     "PORT": DATABASE_PORT,
+# }
 
 # 表前缀
 TABLE_PREFIX = "dvadmin_"
@@ -31,12 +40,22 @@ TABLE_PREFIX = "dvadmin_"
 REDIS_PASSWORD = 'DVADMIN3'
 REDIS_HOST = '127.0.0.1'
 REDIS_URL = f'redis://:{REDIS_PASSWORD or ""}@{REDIS_HOST}:6379'
+# 缓存: 权限、数据权限等进程内缓存通过共享缓存中的版本号在多进程间失效, 未配置 redis 时可删除此项(进程内缓存不启用)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"{REDIS_URL}/1",
+    }
+}
 # ================================================= #
 # ****************** 功能 启停  ******************* #
 # ================================================= #
 DEBUG = True
 # 启动登录详细概略获取(通过调用api获取ip详细地址。如果是内网，关闭即可)
 ENABLE_LOGIN_ANALYSIS_LOG = True
+# 登录IP地理位置解析方式: local(本地离线库, 需执行 python manage.py build_ip_database 生成) | remote(调用api),
+# 不配置时已生成本地库则使用 local, 否则使用 remote
+# IP_GEOLOCATION_PROVIDER = 'local'
 # 登录接口 /api/token/ 是否需要验证码认证，用于测试，正式环境建议取消
 LOGIN_NO_CAPTCHA_AUTH = True
 # ================================================= #
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.core.checks import register, Tags
+from django.db.models.signals import post_migrate
 
 
 class SystemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dvadmin.system'
+
+    def ready(self):
+        from dvadmin.system import signals
+        post_migrate.connect(signals.backfill_dept_closure, sender=self)
+        from dvadmin.system import search_indexes  # noqa: F401
+        from dvadmin.utils.permission import check_api_permission_index
+        register(check_api_permission_index, Tags.urls)
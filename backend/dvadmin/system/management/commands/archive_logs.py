@@ -0,0 +1,74 @@
+# 日志归档
+"""
+归档超过保留天数(settings.LOG_RETENTION_DAYS)的操作日志、登录日志, 归档文件位于 settings.LOG_ARCHIVE_DIR
+使用方法: python manage.py archive_logs [--days 180] [--models operation_log login_log] [--partition --confirm-schema-drift]
+--partition: MySQL 下将日志表改为按月分区表(首次执行一次即可, 大表耗时较长), 其他数据库忽略;
+    分区通过 DDL 将主键改为 (id, create_datetime)、create_datetime 改为非空, 模型及迁移不体现该变化,
+    须同时传 --confirm-schema-drift 确认, 详见 dvadmin.utils.log_retention.partition_table
+"""
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from application import dispatch
+from dvadmin.utils.log_retention import get_archive_models, get_connection, get_cutoff, archive_expired_logs, \
+    partition_table, maintain_partitions
+
+
+PARTITION_SCHEMA_DRIFT_HELP = (
+    "MySQL 下将日志表改为按月分区表: 通过 DDL 将主键改为 (id, create_datetime)、create_datetime 改为非空, "
+    "模型(主键 id, create_datetime 可为空)及迁移文件不体现该变化, 之后修改这两个字段的迁移须人工核对; "
+    "须同时传 --confirm-schema-drift"
+)
+
+
+def main(days=None, names=None, chunk_size=None, partition=False):
+    cutoff = get_cutoff(days)
+    for name, model in get_archive_models().items():
+        if names and name not in names:
+            continue
+        if partition:
+            if partition_table(model):
+                print(f"{model._meta.verbose_name}: 已改为按月分区表")
+            elif get_connection(model).vendor != "mysql":
+                print(f"{model._meta.verbose_name}: 当前数据库({get_connection(model).vendor})不支持分区, 保持普通表")
+        count = archive_expired_logs(model, cutoff, chunk_size)
+        added, dropped = maintain_partitions(model, cutoff)
+        print(f"{model._meta.verbose_name}: 归档 {cutoff:%Y-%m-%d} 之前的日志 {count} 条"
+              + (f", 新增分区 {added} 个, 删除分区 {dropped} 个" if added or dropped else ""))
+
+
+class Command(BaseCommand):
+    """
+    日志归档命令: python manage.py archive_logs
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="保留天数, 默认 settings.LOG_RETENTION_DAYS")
+        parser.add_argument("--models", nargs="*", default=None, help="operation_log login_log")
+        parser.add_argument("--chunk-size", type=int, default=None, help="每批归档条数")
+        parser.add_argument("--partition", action="store_true", help=PARTITION_SCHEMA_DRIFT_HELP)
+        parser.add_argument("--confirm-schema-drift", action="store_true",
+                            help="确认分区后数据库表结构与模型不一致(与 --partition 同时使用)")
+
+    def handle(self, *args, **options):
+        if options["partition"] and not options["confirm_schema_drift"]:
+            raise CommandError(PARTITION_SCHEMA_DRIFT_HELP)
+        kwargs = {
+            "days": options["days"],
+            "names": options["models"],
+            "chunk_size": options["chunk_size"],
+            "partition": options["partition"],
+        }
+        print(f"正在归档日志...")
+
+        if dispatch.is_tenants_mode():
+            from django_tenants.utils import get_tenant_model
+            from django_tenants.utils import tenant_context
+            for tenant in get_tenant_model().objects.exclude(schema_name='public'):
+                with tenant_context(tenant):
+                    print(f"租户[{connection.tenant.schema_name}]日志归档开始...")
+                    main(**kwargs)
+                    print(f"租户[{connection.tenant.schema_name}]日志归档完成！")
+        else:
+            main(**kwargs)
+        print("日志归档完成！")
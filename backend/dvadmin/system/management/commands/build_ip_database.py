@@ -0,0 +1,26 @@
+# IP地理位置离线库
+"""
+由CSV生成本地IP地理位置库(settings.IP_GEOLOCATION_DB), 并设置 IP_GEOLOCATION_PROVIDER = 'local' 后使用
+CSV每行: 起始IP,结束IP,洲,国家,省份,城市,县区,运营商,区域代码,英文全称,简称,经度,纬度
+使用方法: python manage.py build_ip_database ip.csv [--output conf/ip_geolocation.db]
+"""
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from dvadmin.utils.ip_geolocation import LocalIPGeolocationProvider
+
+
+class Command(BaseCommand):
+    """
+    生成IP地理位置离线库命令: python manage.py build_ip_database ip.csv
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="CSV文件路径")
+        parser.add_argument("--output", default=None, help="库文件路径, 默认 settings.IP_GEOLOCATION_DB")
+
+    def handle(self, *args, **options):
+        target = options["output"] or settings.IP_GEOLOCATION_DB
+        print(f"正在生成IP地理位置库...")
+        count = LocalIPGeolocationProvider.build(options["source"], target)
+        print(f"IP地理位置库生成完成: {target}, 共 {count} 个IP段")
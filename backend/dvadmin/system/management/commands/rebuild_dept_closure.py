@@ -0,0 +1,41 @@
+# 部门闭包表
+"""
+根据部门表重建部门闭包表(执行 migrate 时闭包表与部门表不一致会自动重建),部门数据被直接修改(如导入SQL、bulk_update)后执行
+使用方法: python manage.py rebuild_dept_closure
+"""
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+
+from application import dispatch
+from dvadmin.system.models import DeptClosure
+
+
+def main():
+    with transaction.atomic():
+        count = DeptClosure.rebuild()
+    print(f"部门闭包关系写入 {count} 条")
+
+
+class Command(BaseCommand):
+    """
+    重建部门闭包表命令: python manage.py rebuild_dept_closure
+    """
+
+    def add_arguments(self, parser):
+        pass
+
+    def handle(self, *args, **options):
+
+        print(f"正在重建部门闭包表...")
+
+        if dispatch.is_tenants_mode():
+            from django_tenants.utils import get_tenant_model
+            from django_tenants.utils import tenant_context
+            for tenant in get_tenant_model().objects.exclude(schema_name='public'):
+                with tenant_context(tenant):
+                    print(f"租户[{connection.tenant.schema_name}]重建部门闭包表开始...")
+                    main()
+                    print(f"租户[{connection.tenant.schema_name}]重建部门闭包表完成！")
+        else:
+            main()
+        print("部门闭包表重建完成！")
@@ -0,0 +1,41 @@
+# 菜单路径
+"""
+根据菜单表重建菜单的上级id路径及完整名称,首次部署(执行数据库迁移)后或菜单数据被直接修改后执行
+使用方法: python manage.py rebuild_menu_path
+"""
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+
+from application import dispatch
+from dvadmin.system.models import Menu
+
+
+def main():
+    with transaction.atomic():
+        count = Menu.rebuild_path()
+    print(f"菜单路径更新 {count} 条")
+
+
+class Command(BaseCommand):
+    """
+    重建菜单路径命令: python manage.py rebuild_menu_path
+    """
+
+    def add_arguments(self, parser):
+        pass
+
+    def handle(self, *args, **options):
+
+        print(f"正在重建菜单路径...")
+
+        if dispatch.is_tenants_mode():
+            from django_tenants.utils import get_tenant_model
+            from django_tenants.utils import tenant_context
+            for tenant in get_tenant_model().objects.exclude(schema_name='public'):
+                with tenant_context(tenant):
+                    print(f"租户[{connection.tenant.schema_name}]重建菜单路径开始...")
+                    main()
+                    print(f"租户[{connection.tenant.schema_name}]重建菜单路径完成！")
+        else:
+            main()
+        print("菜单路径重建完成！")
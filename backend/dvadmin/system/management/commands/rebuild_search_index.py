@@ -0,0 +1,45 @@
+# 全文搜索索引
+"""
+重建全文搜索索引影子表(MySQL FULLTEXT / SQLite FTS5),首次部署或修改索引字段后执行
+使用方法: python manage.py rebuild_search_index
+"""
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+
+from application import dispatch
+from dvadmin.utils.search_index import search_index_registry
+
+
+def main():
+    for model, search_index in search_index_registry.items():
+        if not search_index.is_supported():
+            print(f"{model._meta.verbose_name}: 当前数据库({connection.vendor})不支持全文搜索索引,将使用模糊查询")
+            continue
+        with transaction.atomic():
+            count = search_index.rebuild()
+        print(f"{model._meta.verbose_name}: 搜索索引写入 {count} 条")
+
+
+class Command(BaseCommand):
+    """
+    重建全文搜索索引命令: python manage.py rebuild_search_index
+    """
+
+    def add_arguments(self, parser):
+        pass
+
+    def handle(self, *args, **options):
+
+        print(f"正在重建全文搜索索引...")
+
+        if dispatch.is_tenants_mode():
+            from django_tenants.utils import get_tenant_model
+            from django_tenants.utils import tenant_context
+            for tenant in get_tenant_model().objects.exclude(schema_name='public'):
+                with tenant_context(tenant):
+                    print(f"租户[{connection.tenant.schema_name}]重建全文搜索索引开始...")
+                    main()
+                    print(f"租户[{connection.tenant.schema_name}]重建全文搜索索引完成！")
+        else:
+            main()
+        print("全文搜索索引重建完成！")
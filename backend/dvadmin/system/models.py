@@ -1,11 +1,12 @@
 import hashlib
 import os
+from functools import partial
 
 from django.contrib.auth.models import AbstractUser, UserManager
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from application import dispatch
-from dvadmin.utils.models import CoreModel, table_prefix, get_custom_app_models
+from dvadmin.utils.models import CoreModel, CreateDateTimeField, table_prefix, get_custom_app_models
 
 
 class Role(CoreModel):
@@ -99,6 +100,29 @@ class Post(CoreModel):
         ordering = ("sort",)
 
 
+class DeptQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """
+        批量修改上级部门(不触发 post_save 信号)时同步部门闭包表并刷新部门缓存;
+        bulk_update 修改上级部门不会同步, 之后需执行 python manage.py rebuild_dept_closure
+        """
+        if "parent" not in kwargs and "parent_id" not in kwargs:
+            return super().update(**kwargs)
+        parent = kwargs.get("parent", kwargs.get("parent_id"))
+        parent_id = parent.pk if isinstance(parent, models.Model) else parent
+        with transaction.atomic(using=self.db):
+            dept_ids = list(self.values_list("id", flat=True))
+            rows = super().update(**kwargs)
+            if parent_id is None or isinstance(parent_id, int):
+                for dept_id in dept_ids:
+                    DeptClosure.move_node(dept_id, parent_id)
+            else:
+                # 上级部门为表达式(如 F())时无法逐个移动, 全量重建
+                DeptClosure.rebuild()
+        transaction.on_commit(partial(dispatch.refresh_cache_version, "dept"), using=self.db)
+        return rows
+
+
 class Dept(CoreModel):
     name = models.CharField(max_length=64, verbose_name="部门名称", help_text="部门名称")
     key = models.CharField(max_length=64, unique=True, null=True, blank=True, verbose_name="关联字符", help_text="关联字符")
@@ -117,25 +141,27 @@ class Dept(CoreModel):
         blank=True,
         help_text="上级部门",
     )
+    objects = DeptQuerySet.as_manager()
 
     @classmethod
     def recursion_all_dept(cls, dept_id: int, dept_all_list=None, dept_list=None):
         """
-        递归获取部门的所有下级部门
+        获取部门的所有下级部门(含自身),通过部门闭包表一次查询
         :param dept_id: 需要获取的id
-        :param dept_all_list: 所有列表
-        :param dept_list: 递归list
+        :param dept_all_list: 兼容旧版本参数,已不再使用
+        :param dept_list: 兼容旧版本参数,已不再使用
         :return:
         """
-        if not dept_all_list:
-            dept_all_list = Dept.objects.values("id", "parent")
-        if dept_list is None:
-            dept_list = [dept_id]
-        for ele in dept_all_list:
-            if ele.get("parent") == dept_id:
-                dept_list.append(ele.get("id"))
-                cls.recursion_all_dept(ele.get("id"), dept_all_list, dept_list)
-        return list(set(dept_list))
+        return list(DeptClosure.objects.filter(ancestor_id=dept_id).values_list("descendant_id", flat=True))
+
+    @classmethod
+    def get_descendant_ids(cls, dept_id: int):
+        """
+        获取部门的所有下级部门id(含自身)的子查询,用于 xxx__in 过滤
+        :param dept_id: 部门id
+        :return: QuerySet
+        """
+        return DeptClosure.objects.filter(ancestor_id=dept_id).values("descendant_id")
 
     class Meta:
         db_table = table_prefix + "system_dept"
@@ -144,6 +170,92 @@ class Dept(CoreModel):
         ordering = ("sort",)
 
 
+class DeptClosure(models.Model):
+    """
+    部门闭包表: 记录每个部门与其所有上级部门(含自身)的关系,用于一次查询获取所有下级部门
+    """
+    ancestor = models.ForeignKey(
+        to="Dept",
+        related_name="descendant_closure",
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        verbose_name="上级部门",
+        help_text="上级部门",
+    )
+    descendant = models.ForeignKey(
+        to="Dept",
+        related_name="ancestor_closure",
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        verbose_name="下级部门",
+        help_text="下级部门",
+    )
+    depth = models.IntegerField(default=0, verbose_name="层级距离", help_text="层级距离")
+
+    @classmethod
+    def insert_node(cls, dept_id: int, parent_id: int = None):
+        """
+        新增部门时写入闭包关系
+        :param dept_id: 部门id
+        :param parent_id: 上级部门id
+        :return:
+        """
+        rows = [cls(ancestor_id=dept_id, descendant_id=dept_id, depth=0)]
+        if parent_id:
+            rows += [
+                cls(ancestor_id=ancestor_id, descendant_id=dept_id, depth=depth + 1)
+                for ancestor_id, depth in cls.objects.filter(descendant_id=parent_id).values_list("ancestor_id", "depth")
+            ]
+        cls.objects.bulk_create(rows)
+
+    @classmethod
+    def move_node(cls, dept_id: int, parent_id: int = None):
+        """
+        移动部门时,将该部门及其下级部门从原上级部门断开,再挂到新的上级部门下
+        :param dept_id: 部门id
+        :param parent_id: 新的上级部门id
+        :return:
+        """
+        subtree = list(cls.objects.filter(ancestor_id=dept_id).values_list("descendant_id", "depth"))
+        subtree_ids = [descendant_id for descendant_id, _ in subtree]
+        cls.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+        if not parent_id:
+            return
+        ancestors = cls.objects.filter(descendant_id=parent_id).exclude(ancestor_id__in=subtree_ids).values_list(
+            "ancestor_id", "depth")
+        cls.objects.bulk_create([
+            cls(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=ancestor_depth + depth + 1)
+            for ancestor_id, ancestor_depth in ancestors
+            for descendant_id, depth in subtree
+        ], batch_size=1000)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        根据部门表全量重建闭包关系
+        :return: 写入的关系数量
+        """
+        parent_map = dict(Dept.objects.values_list("id", "parent_id"))
+        rows = []
+        for dept_id in parent_map:
+            depth, ancestor_id, visited = 0, dept_id, set()
+            while ancestor_id in parent_map and ancestor_id not in visited:
+                visited.add(ancestor_id)
+                rows.append(cls(ancestor_id=ancestor_id, descendant_id=dept_id, depth=depth))
+                ancestor_id = parent_map.get(ancestor_id)
+                depth += 1
+        cls.objects.all().delete()
+        cls.objects.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+    class Meta:
+        db_table = table_prefix + "system_dept_closure"
+        verbose_name = "部门闭包表"
+        verbose_name_plural = verbose_name
+        unique_together = (("ancestor", "descendant"),)
+        indexes = [models.Index(fields=["descendant", "depth"])]
+
+
 class Menu(CoreModel):
     parent = models.ForeignKey(
         to="Menu",
@@ -175,15 +287,96 @@ class Menu(CoreModel):
     is_iframe = models.BooleanField(default=False, blank=True, verbose_name="框架外显示", help_text="框架外显示")
     is_affix = models.BooleanField(default=False, blank=True, verbose_name="是否固定", help_text="是否固定")
 
+    ancestor_ids = models.JSONField(default=list, blank=True, verbose_name="上级菜单id路径",
+                                    help_text="上级菜单id路径(由顶级菜单至直接上级)")
+    full_name = models.CharField(max_length=1024, null=True, blank=True, verbose_name="菜单完整名称",
+                                 help_text="菜单完整名称,如: 系统管理/用户管理")
+
+    PATH_SEPARATOR = "/"
+
+    def set_path(self):
+        """
+        根据上级菜单计算菜单的上级id路径及完整名称
+        :return:
+        """
+        parent = None
+        if self.parent_id:
+            parent = Menu.objects.filter(id=self.parent_id).values("id", "ancestor_ids", "full_name").first()
+        if parent is None:
+            self.ancestor_ids = []
+            self.full_name = self.name
+            return
+        if parent["full_name"] is None:
+            # 上级菜单路径尚未生成(如升级前的数据),递归计算
+            parent_list = Menu.get_all_parent(parent["id"])
+            parent["ancestor_ids"] = [d["id"] for d in parent_list[:-1]]
+            parent["full_name"] = self.PATH_SEPARATOR.join(d["name"] for d in parent_list)
+        self.ancestor_ids = parent["ancestor_ids"] + [parent["id"]]
+        self.full_name = f"{parent['full_name']}{self.PATH_SEPARATOR}{self.name}"
+
+    def refresh_children_path(self):
+        """
+        菜单移动或重命名后,逐层更新所有下级菜单的路径
+        :return:
+        """
+        parents = {self.id: self}
+        while parents:
+            children = list(Menu.objects.filter(parent_id__in=list(parents)).only("id", "name", "parent"))
+            for child in children:
+                parent = parents[child.parent_id]
+                child.ancestor_ids = parent.ancestor_ids + [parent.id]
+                child.full_name = f"{parent.full_name}{self.PATH_SEPARATOR}{child.name}"
+            Menu.objects.bulk_update(children, ["ancestor_ids", "full_name"], batch_size=500)
+            parents = {child.id: child for child in children if child.id not in parents}
+
+    @classmethod
+    def rebuild_path(cls):
+        """
+        根据菜单表全量重建所有菜单的路径
+        :return: 更新的菜单数量
+        """
+        menus = {menu.id: menu for menu in cls.objects.only("id", "name", "parent")}
+        for menu in menus.values():
+            ancestor_ids, parent_id = [], menu.parent_id
+            while parent_id in menus and parent_id not in ancestor_ids and parent_id != menu.id:
+                ancestor_ids.insert(0, parent_id)
+                parent_id = menus[parent_id].parent_id
+            menu.ancestor_ids = ancestor_ids
+            menu.full_name = cls.PATH_SEPARATOR.join([menus[i].name for i in ancestor_ids] + [menu.name])
+        cls.objects.bulk_update(menus.values(), ["ancestor_ids", "full_name"], batch_size=500)
+        return len(menus)
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if update_fields is not None and not {"parent", "parent_id", "name"} & set(update_fields):
+            return super().save(force_insert, force_update, using, update_fields)
+        old = None
+        if self.pk:
+            old = Menu.objects.filter(pk=self.pk).values("parent_id", "name", "full_name").first()
+        self.set_path()
+        if update_fields is not None:
+            update_fields = {*update_fields, "ancestor_ids", "full_name"}
+        super().save(force_insert, force_update, using, update_fields)
+        if old and (old["parent_id"] != self.parent_id or old["full_name"] != self.full_name):
+            self.refresh_children_path()
+
     @classmethod
     def get_all_parent(cls, id: int, all_list=None, nodes=None):
         """
-        递归获取给定ID的所有层级
+        获取给定ID的所有层级(由顶级菜单至自身)
         :param id: 参数ID
         :param all_list: 所有列表
         :param nodes: 递归列表
         :return: nodes
         """
+        if all_list is None and nodes is None:
+            menu = Menu.objects.filter(id=id).values("ancestor_ids", "full_name").first()
+            if menu is None:
+                return []
+            if menu["full_name"] is not None:
+                # 直接读取菜单中维护的上级id路径
+                ids = menu["ancestor_ids"] + [id]
+                menu_map = {ele["id"]: ele for ele in Menu.objects.filter(id__in=ids).values("id", "name", "parent")}
+                return [menu_map[i] for i in ids if i in menu_map]
         if not all_list:
             all_list = Menu.objects.values("id", "name", "parent")
         if nodes is None:
@@ -195,12 +388,14 @@ class Menu(CoreModel):
                     cls.get_all_parent(parent_id, all_list, nodes)
                 nodes.append(ele)
         return nodes
+
     class Meta:
         db_table = table_prefix + "system_menu"
         verbose_name = "菜单表"
         verbose_name_plural = verbose_name
         ordering = ("sort",)
 
+
 class MenuField(CoreModel):
     model = models.CharField(max_length=64, verbose_name='表名')
     menu = models.ForeignKey(to='Menu', on_delete=models.CASCADE, verbose_name='菜单', db_constraint=False)
@@ -367,6 +562,9 @@ class Dictionary(CoreModel):
 class OperationLog(CoreModel):
     request_modular = models.CharField(max_length=64, verbose_name="请求模块", null=True, blank=True,
                                        help_text="请求模块")
+    # 异步写入时保留请求发生的时间
+    create_datetime = CreateDateTimeField(auto_now_add=True, null=True, blank=True, help_text="创建时间",
+                                          verbose_name="创建时间")
     request_path = models.CharField(max_length=400, verbose_name="请求地址", null=True, blank=True,
                                     help_text="请求地址")
     request_body = models.TextField(verbose_name="请求参数", null=True, blank=True, help_text="请求参数")
@@ -388,6 +586,8 @@ class OperationLog(CoreModel):
         verbose_name = "操作日志"
         verbose_name_plural = verbose_name
         ordering = ("-create_datetime",)
+        # 游标分页按 (create_datetime, id) 定位
+        indexes = [models.Index(fields=["create_datetime", "id"])]
 
 
 def media_file_name(instance, filename):
@@ -537,6 +737,9 @@ class SystemConfig(CoreModel):
 
 class LoginLog(CoreModel):
     LOGIN_TYPE_CHOICES = ((1, "普通登录"), (2, "微信扫码登录"),)
+    # 异步写入时保留请求发生的时间
+    create_datetime = CreateDateTimeField(auto_now_add=True, null=True, blank=True, help_text="创建时间",
+                                          verbose_name="创建时间")
     username = models.CharField(max_length=32, verbose_name="登录用户名", null=True, blank=True, help_text="登录用户名")
     ip = models.CharField(max_length=32, verbose_name="登录ip", null=True, blank=True, help_text="登录ip")
     agent = models.TextField(verbose_name="agent信息", null=True, blank=True, help_text="agent信息")
@@ -562,6 +765,8 @@ class LoginLog(CoreModel):
         verbose_name = "登录日志"
         verbose_name_plural = verbose_name
         ordering = ("-create_datetime",)
+        # 游标分页按 (create_datetime, id) 定位; 补充地理位置时按 (ip, continent) 查找
+        indexes = [models.Index(fields=["create_datetime", "id"]), models.Index(fields=["ip", "continent"])]
 
 
 class MessageCenter(CoreModel):
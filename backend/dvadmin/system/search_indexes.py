@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 全文搜索索引注册, 注册后执行 python manage.py rebuild_search_index 创建影子表
+"""
+from dvadmin.system.models import Users
+from dvadmin.utils.search_index import register_search_index
+
+register_search_index(Users, ["username", "name", "dept__name", "role__name"])
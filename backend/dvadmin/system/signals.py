@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 模型信号,用于刷新权限等进程内缓存
+"""
+import logging
+from functools import partial
+
+from django.db import connections, transaction, router, DEFAULT_DB_ALIAS
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from application import dispatch
+from dvadmin.utils.dept_statistics import is_dept_counter_cache_enabled, update_dept_user_counter
+from dvadmin.system.models import ApiWhiteList, MenuButton, RoleMenuButtonPermission, Users, Role, Dept, \
+    DeptClosure, Menu, RoleMenuPermission
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_cache_version_on_commit(name):
+    """
+    事务提交后刷新缓存版本号,避免其他请求在提交前以旧数据重建缓存
+    :param name: 缓存名称
+    :return:
+    """
+    transaction.on_commit(partial(dispatch.refresh_cache_version, name))
+
+
+@receiver([post_save, post_delete], sender=ApiWhiteList)
+@receiver([post_save, post_delete], sender=MenuButton)
+@receiver([post_save, post_delete], sender=RoleMenuButtonPermission)
+def refresh_permission(sender, **kwargs):
+    """
+    接口白名单、菜单按钮、角色按钮权限变化时刷新权限缓存
+    """
+    refresh_cache_version_on_commit("permission")
+
+
+@receiver(m2m_changed, sender=RoleMenuButtonPermission.dept.through)
+def refresh_permission_on_dept_change(sender, action, **kwargs):
+    """
+    角色自定数据权限关联部门变化时刷新权限缓存
+    """
+    if action in ("post_add", "post_remove", "post_clear"):
+        refresh_cache_version_on_commit("permission")
+
+
+@receiver([post_save, post_delete], sender=Menu)
+@receiver([post_save, post_delete], sender=RoleMenuPermission)
+def refresh_menu(sender, **kwargs):
+    """
+    菜单、角色菜单权限变化时刷新菜单缓存(前端路由等)
+    """
+    refresh_cache_version_on_commit("menu")
+
+
+@receiver([post_save, post_delete], sender=Role)
+def refresh_role(sender, **kwargs):
+    """
+    角色变化(如启用、禁用)时刷新角色缓存
+    """
+    refresh_cache_version_on_commit("role")
+
+
+@receiver([post_save, post_delete], sender=Dept)
+def refresh_dept(sender, **kwargs):
+    """
+    部门变化时刷新部门缓存
+    """
+    refresh_cache_version_on_commit("dept")
+
+
+@receiver(m2m_changed, sender=Users.role.through)
+def refresh_user_role_on_change(sender, action, **kwargs):
+    """
+    用户关联角色变化时刷新用户角色版本号,使token中的角色快照失效
+    """
+    if action in ("post_add", "post_remove", "post_clear"):
+        refresh_cache_version_on_commit("user_role")
+
+
+@receiver(post_delete, sender=Role)
+def refresh_user_role_on_delete(sender, **kwargs):
+    """
+    删除角色时刷新用户角色版本号
+    """
+    refresh_cache_version_on_commit("user_role")
+
+
+@receiver(pre_save, sender=Dept)
+def remember_dept_parent(sender, instance, raw=False, **kwargs):
+    """
+    记录部门修改前的上级部门,用于判断部门是否被移动
+    """
+    if raw or instance.pk is None:
+        return
+    instance._old_parent_id = Dept.objects.filter(pk=instance.pk).values_list("parent_id", flat=True).first()
+
+
+@receiver(post_save, sender=Dept)
+def sync_dept_closure(sender, instance, created, raw=False, **kwargs):
+    """
+    新增、移动部门时同步部门闭包表(删除部门时闭包关系随外键级联删除)
+    """
+    if raw:
+        return
+    with transaction.atomic():
+        if created or not DeptClosure.objects.filter(ancestor_id=instance.pk, descendant_id=instance.pk).exists():
+            DeptClosure.objects.filter(descendant_id=instance.pk).delete()
+            DeptClosure.insert_node(instance.pk, instance.parent_id)
+        elif getattr(instance, "_old_parent_id", instance.parent_id) != instance.parent_id:
+            DeptClosure.move_node(instance.pk, instance.parent_id)
+
+
+def backfill_dept_closure(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    执行数据库迁移后补全部门闭包表: 已有部门数据的项目升级后闭包表为空,
+    或部门数据被直接修改(如导入SQL)导致闭包表与部门表不一致时全量重建
+    (迁移文件由各项目自行生成, 不随代码提供, 故通过 post_migrate 代替数据迁移)
+    """
+    if using != router.db_for_write(DeptClosure) or \
+            DeptClosure._meta.db_table not in connections[using].introspection.table_names():
+        # 非部门所在数据库, 或多租户模式下 public schema 未安装部门表
+        return
+    dept_count = Dept.objects.count()
+    if DeptClosure.objects.filter(depth=0).count() == dept_count:
+        return
+    with transaction.atomic():
+        count = DeptClosure.rebuild()
+    refresh_cache_version_on_commit("dept")
+    logger.info(f"部门闭包表已重建: 部门 {dept_count} 个, 闭包关系 {count} 条")
+
+
+@receiver(pre_save, sender=Users)
+def remember_user_dept(sender, instance, raw=False, **kwargs):
+    """
+    记录用户修改前的部门及性别,用于增量更新部门用户数计数缓存
+    """
+    if raw or instance.pk is None or not is_dept_counter_cache_enabled():
+        return
+    instance._old_dept_gender = Users.objects.filter(pk=instance.pk).values_list("dept_id", "gender").first()
+
+
+@receiver(post_save, sender=Users)
+def update_dept_counter_on_save(sender, instance, created, raw=False, **kwargs):
+    """
+    新增用户或用户变更部门、性别时增量更新部门用户数计数缓存
+    """
+    if raw or not is_dept_counter_cache_enabled():
+        return
+    old = None if created else getattr(instance, "_old_dept_gender", None)
+    new = (instance.dept_id, instance.gender)
+    if old == new:
+        return
+    if old is not None:
+        transaction.on_commit(partial(update_dept_user_counter, old[0], old[1], -1))
+    transaction.on_commit(partial(update_dept_user_counter, new[0], new[1], 1))
+
+
+@receiver(post_delete, sender=Users)
+def update_dept_counter_on_delete(sender, instance, **kwargs):
+    """
+    删除用户时增量更新部门用户数计数缓存
+    """
+    if not is_dept_counter_cache_enabled():
+        return
+    transaction.on_commit(partial(update_dept_user_counter, instance.dept_id, instance.gender, -1))
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: celery 定时任务(需安装 dvadmin_celery 插件), 定时配置见 settings.CELERYBEAT_SCHEDULE
+"""
+from django.core.management import call_command
+
+from application.celery import retry_base_task_error
+
+
+@retry_base_task_error()
+def archive_logs():
+    """
+    归档超过保留天数的操作日志、登录日志
+    :return:
+    """
+    call_command("archive_logs")
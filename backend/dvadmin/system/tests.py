@@ -1,15 +1,71 @@
 from functools import wraps
 
-from django.db.models import Func, F, OuterRef, Exists
-from django.test import TestCase
+from unittest import mock, skipUnless
+
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Func, F, OuterRef, Exists, CharField
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command, CommandError
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, Resolver404
+from django.utils import timezone
+from rest_framework.serializers import ListSerializer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import RefreshToken
 import django
 import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "application.settings")
 django.setup()
-from dvadmin.system.models import Menu, RoleMenuPermission, RoleMenuButtonPermission, MenuButton
+from application import dispatch
+from dvadmin.system.models import ApiWhiteList, Menu, RoleMenuPermission, RoleMenuButtonPermission, MenuButton, Dept, \
+    DeptClosure, Users, Role, MenuField, FieldPermission, OperationLog, LoginLog
+from dvadmin.system.signals import backfill_dept_closure
+from dvadmin.system.views.dept import DeptViewSet, DeptSerializer
+from dvadmin.system.views.login_log import LoginLogViewSet
+from dvadmin.system.views.menu import MenuViewSet
+from dvadmin.system.views.operation_log import OperationLogViewSet, OperationLogSerializer
+from dvadmin.system.views.role import RoleViewSet, RoleSerializer
+from dvadmin.system.views.user import UserViewSet, UserSerializer
+from dvadmin.system.views.role_menu_button_permission import get_role_permission_matrix, apply_role_permission
+from dvadmin.utils.authentication import CustomJWTAuthentication, set_permission_snapshot
+from dvadmin.utils.count_strategies import EstimatedCountStrategy
+from dvadmin.utils.data_scope import DataScopeCache, get_data_scope_filter, DATA_SCOPE_ALL, DATA_SCOPE_DEPT
+from dvadmin.utils import filters
+from dvadmin.utils.dept_path import get_dept_full_name
+from dvadmin.utils.dept_statistics import get_dept_statistics
+from dvadmin.utils.permission import CustomPermission, get_api_permission_index, get_api_route_template, match_api_permission, \
+    check_api_permission_index
+from dvadmin.utils.serializers import CustomListSerializer
+from dvadmin.utils.json_response import DetailResponse
+from dvadmin.utils.role_cache import role_cache_response
+from dvadmin.utils.log_retention import archive_expired_logs, get_cutoff, read_archived_logs, to_days
+from dvadmin.utils.filters import CustomDjangoFilterBackend
+from dvadmin.utils import ip_geolocation
+from dvadmin.utils.ip_geolocation import IPGeolocationProvider, LocalIPGeolocationProvider, get_ip_geolocation, \
+    get_ip_geolocation_cache_info
+from dvadmin.utils import log_sinks
+from dvadmin.utils.log_sinks import FileLogSink, LogDatabaseRouter
+from dvadmin.utils import log_writer
+from dvadmin.utils.log_writer import LogWriter
+from dvadmin.utils.query_planner import build_query_plan
+from dvadmin.utils.request_util import get_browser, get_os, save_login_log, parse_user_agent, get_user_agent_cache_info, \
+    get_request_cache
+from dvadmin.utils.search_index import get_search_index
 
 
+import datetime
+import json
+import queue
+import re
+import shutil
+import tempfile
 import time
+import types
 
 def timing_decorator(func):
     @wraps(func)
@@ -24,33 +80,1381 @@ def timing_decorator(func):
 
 @timing_decorator
 def getMenu():
-    data = []
-    queryset = Menu.objects.filter(status=1, is_catalog=False).values('name', 'id')
-    for item in queryset:
-        parent_list = Menu.get_all_parent(item['id'])
-        names = [d["name"] for d in parent_list]
-        completeName = "/".join(names)
-        isCheck = RoleMenuPermission.objects.filter(
-            menu__id=item['id'],
-            role__id=1,
-        ).exists()
-        mbCheck = RoleMenuButtonPermission.objects.filter(
-        menu_button = OuterRef("pk"),
-        role__id=1,
-        )
-        btns = MenuButton.objects.filter(
-            menu__id=item['id'],
-        ).annotate(isCheck=Exists(mbCheck)).values('id', 'name', 'value', 'isCheck',data_range=F('menu_button_permission__data_range'))
-        # print(b)
-        dicts = {
-            'name': completeName,
-            'id': item['id'],
-            'isCheck': isCheck,
-            'btns':btns
-        }
+    queryset = Menu.objects.filter(status=1, is_catalog=False)
+    data = get_role_permission_matrix(1, queryset)
+    for dicts in data:
         print(dicts)
-        data.append(dicts)
-    # print(data)
+
+
+class RolePermissionMatrixTest(TestCase):
+    """
+    角色授权菜单按钮矩阵: 查询次数与菜单数量无关
+    """
+
+    def setUp(self):
+        self.role = Role.objects.create(name="test", key="test")
+        parent = Menu.objects.create(name="系统管理", is_catalog=True)
+        self.menus = [Menu.objects.create(name=f"菜单{i}", parent=parent) for i in range(20)]
+        for menu in self.menus:
+            for j in range(3):
+                MenuButton.objects.create(menu=menu, name=f"按钮{j}", value=f"{menu.id}:{j}", api="/api/test/",
+                                          method=j)
+        RoleMenuPermission.objects.create(role=self.role, menu=self.menus[0])
+        button = MenuButton.objects.filter(menu=self.menus[0]).first()
+        RoleMenuButtonPermission.objects.create(role=self.role, menu_button=button, data_range=2)
+
+    def test_matrix(self):
+        with self.assertNumQueries(4):
+            data = get_role_permission_matrix(self.role.id, Menu.objects.filter(status=1, is_catalog=False))
+        self.assertEqual(len(data), 20)
+        self.assertEqual(data[0]['name'], "系统管理/菜单0")
+        self.assertTrue(data[0]['isCheck'])
+        self.assertFalse(data[1]['isCheck'])
+        self.assertEqual([btn['isCheck'] for btn in data[0]['btns']], [True, False, False])
+        self.assertEqual([btn['data_range'] for btn in data[0]['btns']], [2, None, None])
+
+
+class ApplyRolePermissionTest(TestCase):
+    """
+    角色授权保存: 按差异批量更新,查询次数与菜单数量无关
+    """
+
+    def setUp(self):
+        self.role = Role.objects.create(name="test", key="test")
+        parent = Menu.objects.create(name="系统管理", is_catalog=True)
+        self.parent = parent
+        self.menus = [Menu.objects.create(name=f"菜单{i}", parent=parent) for i in range(10)]
+        self.buttons = {
+            menu.id: [MenuButton.objects.create(menu=menu, name=f"按钮{j}", value=f"{menu.id}:{j}", api="/api/test/",
+                                                method=j) for j in range(2)]
+            for menu in self.menus
+        }
+        self.fields = {menu.id: MenuField.objects.create(model="Test", menu=menu, field_name="name", title="名称")
+                       for menu in self.menus}
+        self.depts = [Dept.objects.create(name=f"部门{i}") for i in range(3)]
+
+    def build_body(self, checked, data_range=0, dept=None):
+        return [{
+            'id': menu.id,
+            'isCheck': menu.id in checked,
+            'btns': [{'id': btn.id, 'isCheck': menu.id in checked, 'data_range': data_range, 'dept': dept or []}
+                     for btn in self.buttons[menu.id]],
+            'columns': [{'id': self.fields[menu.id].id, 'is_query': menu.id in checked, 'is_create': False,
+                         'is_update': False}],
+        } for menu in self.menus]
+
+    def assert_state(self, checked, data_range, dept):
+        menu_ids = set(RoleMenuPermission.objects.filter(role=self.role).values_list('menu_id', flat=True))
+        self.assertEqual(menu_ids, set(checked) | ({self.parent.id} if checked else set()))
+        permissions = RoleMenuButtonPermission.objects.filter(role=self.role)
+        self.assertEqual(permissions.count(), len(checked) * 2)
+        self.assertEqual(set(permissions.values_list('data_range', flat=True)), {data_range} if checked else set())
+        for permission in permissions:
+            self.assertEqual(set(permission.dept.values_list('id', flat=True)), set(dept))
+        self.assertEqual(FieldPermission.objects.filter(role=self.role).count(), len(self.menus))
+        self.assertEqual(FieldPermission.objects.filter(role=self.role, is_query=True).count(), len(checked))
+
+    def test_apply(self):
+        checked = [menu.id for menu in self.menus[:5]]
+        dept = [d.id for d in self.depts[:2]]
+        apply_role_permission(self.role.id, self.build_body(checked, 4, dept))
+        self.assert_state(checked, 4, dept)
+        first_ids = set(RoleMenuButtonPermission.objects.filter(role=self.role).values_list('id', flat=True))
+
+        checked = [menu.id for menu in self.menus[3:]]
+        dept = [d.id for d in self.depts[1:]]
+        with CaptureQueriesContext(connection) as queries:
+            apply_role_permission(self.role.id, self.build_body(checked, 4, dept))
+        self.assert_state(checked, 4, dept)
+        self.assertLessEqual(len(queries), 25)
+        # 保留未变化的授权记录
+        kept_ids = set(RoleMenuButtonPermission.objects.filter(role=self.role).values_list('id', flat=True))
+        self.assertEqual(len(first_ids & kept_ids), 4)
+
+        apply_role_permission(self.role.id, self.build_body([], 0))
+        self.assert_state([], 0, [])
+
+
+class MenuListQueryCountTest(TestCase):
+    """
+    菜单列表: 是否有下级菜单及菜单按钮不逐行查询
+    """
+
+    def setUp(self):
+        self.user = Users.objects.create(username="menu_test", name="menu_test", is_superuser=True)
+
+    def create_menus(self, count):
+        for i in range(Menu.objects.count(), Menu.objects.count() + count):
+            menu = Menu.objects.create(name=f"菜单{i}")
+            Menu.objects.create(name=f"子菜单{i}", parent=menu)
+            MenuButton.objects.create(menu=menu, name="查询", value=f"menu{i}:Search", api="/api/test/", method=0)
+
+    def list_menu_queries(self):
+        request = APIRequestFactory().get('/api/system/menu/')
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = MenuViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, 200)
+        menu_tables = (f'"{Menu._meta.db_table}"', f'"{MenuButton._meta.db_table}"')
+        return response.data['data'], [
+            item['sql'] for item in queries.captured_queries
+            if any(f"FROM {table}" in item['sql'] for table in menu_tables)
+        ]
+
+    def test_query_count(self):
+        self.create_menus(3)
+        _, queries = self.list_menu_queries()
+        self.assertEqual(len(queries), 2)
+        self.create_menus(10)
+        data, queries = self.list_menu_queries()
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(len(data), 13)
+        self.assertTrue(all(item['hasChild'] for item in data))
+        self.assertEqual(data[0]['menuPermission'][0]['name'], "查询")
+
+
+class DeptListQueryCountTest(TestCase):
+    """
+    部门列表: 上级部门、用户数、下级部门数不逐行查询
+    """
+
+    def setUp(self):
+        self.user = Users.objects.create(username="dept_test", name="dept_test", is_superuser=True)
+
+    def list_dept_queries(self):
+        request = APIRequestFactory().get('/api/system/dept/')
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = DeptViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, 200)
+        # 修改人名称(modifier_name)的查询不在此统计
+        return response.data['data'], [
+            item['sql'] for item in queries.captured_queries
+            if f'FROM "{Dept._meta.db_table}"' in item['sql'] or 'COUNT(' in item['sql']
+        ]
+
+    def test_query_count(self):
+        root = Dept.objects.create(name="总部")
+        for i in range(5):
+            dept = Dept.objects.create(name=f"部门{i}", parent=root)
+            Users.objects.create(username=f"dept_user{i}", name=f"dept_user{i}", dept=dept)
+            Users.objects.create(username=f"dept_user{i}_2", name=f"dept_user{i}_2", dept=dept)
+        data, queries = self.list_dept_queries()
+        self.assertEqual(len(queries), 1)
+        data = {item['name']: item for item in data}
+        self.assertEqual(data["总部"]['has_children'], 5)
+        self.assertTrue(data["总部"]['hasChild'])
+        self.assertEqual(data["总部"]['dept_user_count'], 0)
+        self.assertEqual(data["部门0"]['dept_user_count'], 2)
+        self.assertEqual(data["部门0"]['parent_name'], "总部")
+        self.assertFalse(data["部门0"]['hasChild'])
+
+
+class DeptStatisticsTest(TestCase):
+    """
+    部门信息统计: 分组聚合查询与计数缓存结果一致
+    """
+
+    def setUp(self):
+        self.root = Dept.objects.create(name="总部")
+        self.sub = Dept.objects.create(name="研发部", parent=self.root)
+        self.leaf = Dept.objects.create(name="前端组", parent=self.sub)
+        for i, (dept, gender) in enumerate([(self.root, 1), (self.sub, 2), (self.leaf, 0), (self.leaf, 1)]):
+            Users.objects.create(username=f"stat_user{i}", name=f"stat_user{i}", dept=dept, gender=gender)
+
+    def assert_statistics(self):
+        result = get_dept_statistics(self.root.id, show_all=True)
+        self.assertEqual(result['statistics'], {'total': 4, 'male': 2, 'female': 1, 'unknown': 1})
+        self.assertEqual(result['sub_dept_map'], [{'name': "研发部", 'count': 3}])
+        result = get_dept_statistics(self.root.id, show_all=False)
+        self.assertEqual(result['statistics'], {'total': 1, 'male': 1, 'female': 0, 'unknown': 0})
+
+    def test_statistics(self):
+        # 两次统计,每次4个查询
+        with self.assertNumQueries(8):
+            self.assert_statistics()
+
+    @override_settings(DEPT_USER_COUNTER_CACHE=True, LOCAL_CACHE_SINGLE_PROCESS=True)
+    def test_counter_cache(self):
+        cache.clear()
+        self.assert_statistics()
+        with self.captureOnCommitCallbacks(execute=True):
+            user = Users.objects.create(username="stat_user_new", name="stat_user_new", dept=self.leaf, gender=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            user.dept = self.root
+            user.save()
+        result = get_dept_statistics(self.root.id, show_all=False)
+        self.assertEqual(result['statistics'], {'total': 2, 'male': 1, 'female': 1, 'unknown': 0})
+        self.assertEqual(result['sub_dept_map'], [{'name': "研发部", 'count': 3}])
+
+
+@override_settings(LOCAL_CACHE_SINGLE_PROCESS=True)
+class UserListQueryCountTest(TestCase):
+    """
+    用户列表: 部门完整名称不逐级查询
+    """
+
+    def setUp(self):
+        self.admin = Users.objects.create(username="user_test", name="user_test", is_superuser=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            dept = None
+            for i in range(6):
+                dept = Dept.objects.create(name=f"部门{i}", parent=dept)
+        self.dept = dept
+
+    def create_users(self, count):
+        start = Users.objects.count()
+        for i in range(start, start + count):
+            Users.objects.create(username=f"list_user{i}", name=f"list_user{i}", dept=self.dept)
+
+    def list_user_queries(self):
+        request = APIRequestFactory().get('/api/system/user/', {'limit': 100})
+        force_authenticate(request, user=self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = UserViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data['data'], [
+            item['sql'] for item in queries.captured_queries if f'FROM "{Dept._meta.db_table}"' in item['sql']
+        ]
+
+    def test_query_count(self):
+        self.create_users(3)
+        self.list_user_queries()
+        self.create_users(10)
+        data, queries = self.list_user_queries()
+        self.assertEqual(len(data), 13)
+        self.assertEqual(data[0]['dept_name_all'], "/".join(f"部门{i}" for i in range(6)))
+        self.assertEqual(data[0]['dept_name'], "部门5")
+        self.assertEqual(len(queries), 0)
+
+    @override_settings(LOCAL_CACHE_SINGLE_PROCESS=False)
+    def test_query_count_without_process_cache(self):
+        # 默认的 LocMemCache 下不启用进程内缓存, 每个请求只查询一次部门表
+        self.create_users(3)
+        self.list_user_queries()
+        self.create_users(47)
+        data, queries = self.list_user_queries()
+        self.assertEqual(len(data), 50)
+        self.assertEqual(data[0]['dept_name_all'], "/".join(f"部门{i}" for i in range(6)))
+        self.assertEqual(len(queries), 1)
+
+
+class QueryPlanTest(TestCase):
+    """
+    视图集根据序列化器字段自动生成查询计划
+    """
+
+    def setUp(self):
+        self.admin = Users.objects.create(username="user_test", name="user_test", is_superuser=True)
+
+    def list_user(self, params=None, **initkwargs):
+        request = APIRequestFactory().get('/api/system/user/', params or {})
+        force_authenticate(request, user=self.admin)
+        return UserViewSet.as_view({'get': 'list'}, **initkwargs)(request)
+
+    def test_build_plan(self):
+        plan = build_query_plan(UserSerializer(context={}))
+        self.assertEqual(plan.select_related, {"creator", "dept"})
+        self.assertIn("role", plan.prefetch_related)
+        self.assertIn("dept", plan.only)
+        plan = build_query_plan(DeptSerializer(context={}))
+        self.assertEqual(plan.select_related, {"creator", "parent"})
+        # 注解字段无法推断,不使用only
+        self.assertFalse(plan.only_safe)
+
+    @override_settings(QUERY_PLAN_DEBUG_HEADER=True)
+    def test_restql_fields(self):
+        response = self.list_user({'query': '{id,name,dept_name}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Query-Plan'], "select_related=dept; only=dept,id,name")
+        response = self.list_user(auto_query_plan=False)
+        self.assertFalse(response.has_header('X-Query-Plan'))
+
+
+class ModifierNameTest(TestCase):
+    """
+    修改人名称: 列表一次查询
+    """
+
+    def setUp(self):
+        self.admin = Users.objects.create(username="user_test", name="user_test", is_superuser=True)
+        modifiers = [Users.objects.create(username=f"modifier{i}", name=f"修改人{i}") for i in range(5)]
+        for i in range(20):
+            Role.objects.create(name=f"角色{i}", key=f"modifier_role{i}", sort=i,
+                                modifier=str(modifiers[i % len(modifiers)].id))
+
+    def user_queries(self, queries):
+        return [item for item in queries.captured_queries if f'FROM "{Users._meta.db_table}"' in item['sql']]
+
+    def test_list(self):
+        request = APIRequestFactory().get('/api/system/role/', {'limit': 100})
+        force_authenticate(request, user=self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = RoleViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, 200)
+        names = {item['name']: item['modifier_name'] for item in response.data['data']}
+        self.assertEqual(names["角色6"], "修改人1")
+        self.assertEqual(len(self.user_queries(queries)), 1)
+
+    def test_values(self):
+        queryset = Role.objects.filter(key__startswith="modifier_role").values()
+        with CaptureQueriesContext(connection) as queries:
+            data = RoleSerializer(queryset, many=True).data
+        self.assertEqual(len(data), 20)
+        self.assertEqual(data[0]['modifier_name'], "修改人0")
+        self.assertEqual(len(self.user_queries(queries)), 1)
+
+    def test_custom_list_serializer(self):
+        class RoleListSerializer(ListSerializer):
+            pass
+
+        class CustomRoleSerializer(RoleSerializer):
+            class Meta(RoleSerializer.Meta):
+                list_serializer_class = RoleListSerializer
+
+        queryset = Role.objects.filter(key__startswith="modifier_role")
+        self.assertIsInstance(RoleSerializer(queryset, many=True), CustomListSerializer)
+        self.assertIs(type(CustomRoleSerializer(queryset, many=True)), RoleListSerializer)
+
+
+class KeysetPaginationTest(TestCase):
+    """
+    游标分页: 不执行COUNT, 通过cursor前后翻页, 携带ordering参数时按其排序
+    """
+
+    def setUp(self):
+        self.admin = Users.objects.create(username="user_test", name="user_test", is_superuser=True)
+        now = datetime.datetime.now()
+        logs = OperationLog.objects.bulk_create([OperationLog(request_path=f"/api/{i}/") for i in range(25)])
+        for i, log in enumerate(logs):
+            # 部分日志创建时间相同, 由id保证顺序唯一
+            OperationLog.objects.filter(id=log.id).update(create_datetime=now - datetime.timedelta(seconds=i // 2))
+        self.expected = list(OperationLog.objects.order_by("-create_datetime", "-id").values_list("id", flat=True))
+
+    def list_log(self, params, count=False):
+        request = APIRequestFactory().get('/api/system/operation_log/', params)
+        force_authenticate(request, user=self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = OperationLogViewSet.as_view({'get': 'list'}, keyset_pagination=True, count_strategy=None)(
+                request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(any("COUNT(" in item['sql'] for item in queries.captured_queries), count)
+        return response.data
+
+    def test_cursor(self):
+        data = self.list_log({'limit': 10})
+        pages = [[item['id'] for item in data['data']]]
+        self.assertTrue(data['is_next'])
+        self.assertFalse(data['is_previous'])
+        while data['next']:
+            data = self.list_log({'limit': 10, 'cursor': data['next']})
+            pages.append([item['id'] for item in data['data']])
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual((data['page'], data['total'], data['is_next']), (3, 25, False))
+        data = self.list_log({'limit': 10, 'cursor': data['previous']})
+        self.assertEqual([item['id'] for item in data['data']], pages[1])
+        data = self.list_log({'limit': 10, 'cursor': data['previous']})
+        self.assertEqual([item['id'] for item in data['data']], pages[0])
+        self.assertEqual(data['page'], 1)
+        self.assertFalse(data['is_previous'])
+
+    def test_page_number(self):
+        data = self.list_log({'limit': 10, 'page': 2})
+        self.assertEqual([item['id'] for item in data['data']], self.expected[10:20])
+        self.assertTrue(data['is_previous'])
+        self.assertEqual((data['total'], data['total_exact']), (None, False))
+
+    def test_ordering(self):
+        data = self.list_log({'limit': 10, 'page': 2, 'ordering': 'id'}, count=True)
+        self.assertEqual([item['id'] for item in data['data']], sorted(self.expected)[10:20])
+        self.assertEqual(data['total'], 25)
+        self.assertNotIn('next', data)
+
+
+class CountStrategyTest(TestCase):
+    """
+    分页总数统计策略
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.admin = Users.objects.create(username="user_test", name="user_test", is_superuser=True)
+        Role.objects.bulk_create([Role(name=f"角色{i}", key=f"count_role{i}", sort=i) for i in range(30)])
+
+    def list_role(self, strategy, params=None):
+        request = APIRequestFactory().get('/api/system/role/', params or {'limit': 10})
+        force_authenticate(request, user=self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = RoleViewSet.as_view({'get': 'list'}, count_strategy=strategy)(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len([item for item in queries.captured_queries if "COUNT(" in item['sql']])
+
+    def test_exact(self):
+        data, count_queries = self.list_role("exact")
+        self.assertEqual((data['total'], data['total_exact'], count_queries), (Role.objects.count(), True, 1))
+
+    def test_cached(self):
+        total = Role.objects.count()
+        data, count_queries = self.list_role("cached")
+        self.assertEqual((data['total'], data['total_exact'], count_queries), (total, True, 1))
+        data, count_queries = self.list_role("cached")
+        self.assertEqual((data['total'], data['total_exact'], count_queries), (total, False, 0))
+        # 查询条件不同时分别缓存
+        data, count_queries = self.list_role("cached", {'limit': 10, 'name': '角色1'})
+        self.assertEqual((data['total_exact'], count_queries), (True, 1))
+
+    @override_settings(PAGINATION_COUNT_ESTIMATE_THRESHOLD=0)
+    def test_estimated(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("仅验证SQLite的统计信息估算")
+        # 未 ANALYZE 时无统计信息, 使用精确统计
+        data, count_queries = self.list_role("estimated")
+        self.assertEqual((data['total_exact'], count_queries), (True, 1))
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        data, count_queries = self.list_role("estimated")
+        self.assertEqual((data['total'], data['total_exact'], count_queries), (Role.objects.count(), False, 0))
+        # 超出估算页数的页码仍可访问
+        data, _ = self.list_role("estimated", {'limit': 10, 'page': 100})
+        self.assertEqual(data['data'], [])
+
+    @override_settings(PAGINATION_COUNT_ESTIMATE_THRESHOLD=0)
+    def test_estimated_filtered(self):
+        # 有查询条件时不估算(表统计信息是全表行数), 按查询条件缓存精确统计
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        params = {'limit': 10, 'name': '角色1'}
+        total = Role.objects.filter(name__icontains='角色1').count()
+        with mock.patch.object(EstimatedCountStrategy, "estimate") as estimate:
+            data, count_queries = self.list_role("estimated", params)
+            self.assertEqual((data['total'], data['total_exact'], count_queries), (total, True, 1))
+            data, count_queries = self.list_role("estimated", params)
+            self.assertEqual((data['total'], data['total_exact'], count_queries), (total, False, 0))
+        estimate.assert_not_called()
+
+
+class AutoFilterSetTest(TestCase):
+    """
+    自动生成的过滤器按视图集缓存
+    """
+
+    def setUp(self):
+        Role.objects.bulk_create([Role(name=f"过滤角色{i}", key=f"filter_role{i}", sort=i, status=i % 2 == 0)
+                                  for i in range(10)])
+
+    def filter_role(self, params):
+        request = Request(APIRequestFactory().get('/api/system/role/', params))
+        return CustomDjangoFilterBackend().filter_queryset(request, Role.objects.all(), RoleViewSet())
+
+    def test_cached_class(self):
+        backend = CustomDjangoFilterBackend()
+        filterset_class = backend.get_filterset_class(RoleViewSet(), Role.objects.all())
+        self.assertIs(CustomDjangoFilterBackend().get_filterset_class(RoleViewSet(), Role.objects.all()),
+                      filterset_class)
+        self.assertEqual(filterset_class.orm_lookup_map["name"], "name__icontains")
+        self.assertEqual(filterset_class.orm_lookup_map["sort"], "sort__exact")
+        filterset_class = CustomDjangoFilterBackend().get_filterset_class(UserViewSet(), Users.objects.all())
+        self.assertEqual(set(filterset_class.orm_lookup_map),
+                         {"name", "username", "gender", "is_active", "dept", "user_type"})
+
+    def test_filter(self):
+        self.assertEqual(self.filter_role({'name': '过滤角色'}).count(), 10)
+        self.assertEqual(self.filter_role({'name': '过滤角色', 'status': 'True'}).count(), 5)
+        self.assertEqual(self.filter_role({'name': '过滤角色', 'sort': ['2', '5']}).count(), 4)
+        self.assertEqual(self.filter_role({'name': '', 'unknown': '1'}).count(), Role.objects.count())
+
+
+class SearchIndexTest(TestCase):
+    """
+    用户搜索使用全文搜索索引(SQLite FTS5), 并随数据变化维护
+    """
+
+    def setUp(self):
+        self.admin = Users.objects.create(username="user_test", name="user_test", is_superuser=True)
+        self.dept = Dept.objects.create(name="研发中心")
+        self.role = Role.objects.create(name="系统审计员", key="search_auditor", sort=1)
+        for i in range(3):
+            user = Users.objects.create(username=f"search_user{i}", name=f"检索用户{i}", dept=self.dept)
+            user.role.add(self.role)
+        Users.objects.create(username="other_user", name="其他用户")
+        get_search_index(Users).rebuild()
+
+    def tearDown(self):
+        # 测试结束后影子表随事务回滚, 刷新版本号使其他测试重新检查
+        dispatch.refresh_cache_version("search_index")
+
+    def search(self, term):
+        request = APIRequestFactory().get('/api/system/user/', {'search': term, 'limit': 100})
+        force_authenticate(request, user=self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = UserViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, 200)
+        sql = [item['sql'] for item in queries.captured_queries if 'MATCH' in item['sql']]
+        return sorted(item['username'] for item in response.data['data']), sql
+
+    def test_search(self):
+        users, sql = self.search("研发中心")
+        self.assertEqual(users, ["search_user0", "search_user1", "search_user2"])
+        # 总数及分页查询均使用影子表, 无需DISTINCT
+        self.assertEqual(len(sql), 2)
+        self.assertFalse(any("DISTINCT" in item for item in sql))
+        users, _ = self.search("审计员")
+        self.assertEqual(len(users), 3)
+        users, _ = self.search("other")
+        self.assertEqual(users, ["other_user"])
+        # 少于3个字符时回退为模糊查询
+        users, sql = self.search("其他")
+        self.assertEqual((users, sql), (["other_user"], []))
+
+    def test_maintenance(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dept.name = "产品中心"
+            self.dept.save()
+            other = Users.objects.get(username="other_user")
+            other.role.add(self.role)
+            Users.objects.get(username="search_user0").delete()
+        self.assertEqual(self.search("研发中心")[0], [])
+        self.assertEqual(self.search("产品中心")[0], ["search_user1", "search_user2"])
+        self.assertEqual(self.search("审计员")[0], ["other_user", "search_user1", "search_user2"])
+
+    def test_related_unchanged(self):
+        # 部门未修改搜索字段(名称)时不更新引用它的用户
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.dept.sort = 2
+            self.dept.save()
+        self.assertFalse(any(Users._meta.db_table in item['sql'] for item in queries.captured_queries))
+        with self.captureOnCommitCallbacks(execute=True):
+            Dept.objects.create(name="研发中心分部", parent=self.dept)
+        self.assertEqual(self.search("研发中心")[0], ["search_user0", "search_user1", "search_user2"])
+
+
+class SearchIndexTableCheckTest(TestCase):
+    """
+    全文搜索影子表检查: 未启用进程内缓存时按时间间隔重新检查, 而不是每次搜索都查询
+    """
+
+    def tearDown(self):
+        dispatch.refresh_cache_version("search_index")
+
+    @override_settings(LOCAL_CACHE_SINGLE_PROCESS=False, SEARCH_INDEX_TABLE_CHECK_INTERVAL=60)
+    def test_interval(self):
+        index = get_search_index(Users)
+        with mock.patch.object(connection.introspection, "table_names", return_value=[index.table]) as table_names, \
+                mock.patch("dvadmin.utils.search_index.time.monotonic", return_value=1000):
+            dispatch.refresh_cache_version("search_index")
+            self.assertTrue(index.table_exists())
+            self.assertTrue(index.table_exists())
+            self.assertEqual(table_names.call_count, 1)
+        with mock.patch.object(connection.introspection, "table_names", return_value=[]) as table_names, \
+                mock.patch("dvadmin.utils.search_index.time.monotonic", return_value=1061):
+            self.assertFalse(index.table_exists())
+            self.assertEqual(table_names.call_count, 1)
+
+
+class OperationLogWriterTest(TestCase):
+    """
+    操作日志: 请求内构建, 批量写入
+    """
+
+    class QueueOnlyWriter(LogWriter):
+        # 不启动后台线程, 由测试调用 flush 写入
+        def _ensure_started(self):
+            if self.queue is None:
+                self.queue = queue.Queue(maxsize=getattr(settings, "API_LOG_QUEUE_SIZE", 10000))
+
+    @override_settings(API_LOG_ASYNC=False)
+    def test_middleware(self):
+        admin = Users.objects.create(username="user_test", name="user_test", is_superuser=True)
+        client = Client(HTTP_AUTHORIZATION=f"JWT {RefreshToken.for_user(admin).access_token}",
+                        HTTP_USER_AGENT="Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0 Safari/537.36")
+        before = OperationLog.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post('/api/system/role/', {'name': '日志角色', 'key': 'log_role', 'sort': 1},
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(OperationLog.objects.count(), before + 1)
+        log = OperationLog.objects.order_by('-id').first()
+        self.assertEqual((log.request_modular, log.request_method, log.creator_id), ("角色表", "POST", admin.id))
+        # 日志只写入一次
+        self.assertEqual(len([item for item in queries.captured_queries
+                              if item['sql'].startswith(f'INSERT INTO "{OperationLog._meta.db_table}"')]), 1)
+        self.assertEqual(len([item for item in queries.captured_queries
+                              if item['sql'].startswith(f'UPDATE "{OperationLog._meta.db_table}"')]), 0)
+
+    @override_settings(API_LOG_ASYNC=True, API_LOG_QUEUE_SIZE=3, API_LOG_QUEUE_TIMEOUT=0)
+    def test_backpressure(self):
+        writer = self.QueueOnlyWriter()
+        before = OperationLog.objects.count()
+        results = [writer.submit(OperationLog(request_path=f"/api/log/{i}/")) for i in range(5)]
+        self.assertEqual(results, [True, True, True, False, False])
+        self.assertEqual(writer.get_stats(), {"queued": 3, "written": 0, "dropped": 2, "failed": 0, "pending": 3})
+        with self.assertNumQueries(1):
+            writer.flush()
+        self.assertEqual(OperationLog.objects.count(), before + 3)
+        self.assertEqual(writer.get_stats()["written"], 3)
+
+    @override_settings(API_LOG_ASYNC=True)
+    def test_create_datetime(self):
+        # 异步写入时保留提交时的创建时间, 而非写入时间
+        writer = self.QueueOnlyWriter()
+        submitted = timezone.now() - datetime.timedelta(minutes=5)
+        writer.submit(OperationLog(request_path="/api/log/delayed/", create_datetime=submitted))
+        writer.flush()
+        self.assertEqual(OperationLog.objects.get(request_path="/api/log/delayed/").create_datetime, submitted)
+        self.assertEqual(FileLogSink.to_dict(OperationLog(create_datetime=submitted))["create_datetime"], submitted)
+        self.assertIsNotNone(FileLogSink.to_dict(OperationLog())["create_datetime"])
+
+
+class LogRetentionTest(TestCase):
+    """
+    日志归档: 超期日志按天写入归档文件后删除, 归档数据可按日期查询
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=os.path.join(self.root, "media"),
+                                     LOG_ARCHIVE_DIR=os.path.join(self.root, "archive"), LOG_RETENTION_DAYS=30)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.today = datetime.datetime.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        for days in (40, 40, 31, 29, 0):
+            log = LoginLog.objects.create(username=f"login_{days}", ip="127.0.0.1")
+            LoginLog.objects.filter(id=log.id).update(create_datetime=self.today - datetime.timedelta(days=days))
+
+    def test_archive(self):
+        cutoff = get_cutoff()
+        self.assertEqual(archive_expired_logs(LoginLog, cutoff, chunk_size=2), 3)
+        self.assertEqual(sorted(LoginLog.objects.values_list("username", flat=True)), ["login_0", "login_29"])
+        start_date = (self.today - datetime.timedelta(days=40)).date()
+        rows = read_archived_logs(LoginLog, start_date, cutoff.date())
+        self.assertEqual([row["username"] for row in rows], ["login_31", "login_40", "login_40"])
+        # 重复归档(如写入后删除前中断)时按id去重
+        LoginLog.objects.create(id=rows[0]["id"], username="login_31")
+        LoginLog.objects.filter(id=rows[0]["id"]).update(create_datetime=self.today - datetime.timedelta(days=31))
+        self.assertEqual(archive_expired_logs(LoginLog, cutoff), 1)
+        self.assertEqual(len(read_archived_logs(LoginLog, start_date, cutoff.date())), 3)
+        # 归档文件不在媒体目录下(媒体文件无需鉴权即可访问)
+        self.assertFalse(os.path.exists(settings.MEDIA_ROOT))
+        self.assertTrue(os.listdir(os.path.join(self.root, "archive")))
+
+    def test_archive_dir_in_media_root(self):
+        with override_settings(LOG_ARCHIVE_DIR=os.path.join(settings.MEDIA_ROOT, "log_archive")):
+            with self.assertRaises(ImproperlyConfigured):
+                archive_expired_logs(LoginLog, get_cutoff())
+        self.assertEqual(LoginLog.objects.count(), 5)
+
+    def test_archive_view(self):
+        archive_expired_logs(LoginLog, get_cutoff())
+        admin = Users.objects.create(username="user_test", name="user_test", is_superuser=True)
+        day = (self.today - datetime.timedelta(days=40)).date()
+        view = LoginLogViewSet.as_view({"get": "archive"})
+        request = APIRequestFactory().get("/api/system/login_log/archive/")
+        force_authenticate(request, user=admin)
+        self.assertEqual(view(request).data["data"], [
+            (self.today - datetime.timedelta(days=31)).date().isoformat(), day.isoformat()])
+        request = APIRequestFactory().get("/api/system/login_log/archive/", {
+            "start_date": day.isoformat(), "end_date": (day + datetime.timedelta(days=30)).isoformat(), "limit": 2})
+        force_authenticate(request, user=admin)
+        response = view(request)
+        self.assertEqual((response.data["total"], len(response.data["data"])), (3, 2))
+        request = APIRequestFactory().get("/api/system/login_log/archive/", {
+            "start_date": day.isoformat(), "end_date": (day + datetime.timedelta(days=31)).isoformat()})
+        force_authenticate(request, user=admin)
+        self.assertEqual(view(request).data["code"], 400)
+
+    def test_to_days(self):
+        # 与 MySQL TO_DAYS('2000-01-01') 一致
+        self.assertEqual(to_days(datetime.date(2000, 1, 1)), 730485)
+
+    def test_partition_requires_confirm(self):
+        # 分区会使表结构与模型不一致, 须显式确认
+        with self.assertRaises(CommandError):
+            call_command("archive_logs", "--partition")
+
+
+class UserAgentCacheTest(TestCase):
+    """
+    UA 解析: 按 UA 字符串 LRU 缓存, 同一请求只解析一次
+    """
+    ua_string = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36"
+
+    def setUp(self):
+        parse_user_agent.cache_clear()
+
+    @override_settings(ENABLE_LOGIN_ANALYSIS_LOG=False, API_LOG_ASYNC=False)
+    def test_parse_once(self):
+        user = Users.objects.create(username="user_test", name="user_test")
+        request = Request(APIRequestFactory().post("/api/login/", HTTP_USER_AGENT=self.ua_string))
+        request.user = user
+        self.assertEqual((get_browser(request), get_os(request)), ("Chrome 120.0.0", "Windows 10"))
+        save_login_log(request)
+        self.assertEqual(get_user_agent_cache_info().misses, 1)
+        log = LoginLog.objects.get(username="user_test")
+        self.assertEqual((log.browser, log.os, log.agent), ("Chrome 120.0.0", "Windows 10",
+                                                            "PC / Windows 10 / Chrome 120.0.0"))
+        # 其他请求相同 UA 命中缓存
+        get_os(APIRequestFactory().get("/", HTTP_USER_AGENT=self.ua_string))
+        self.assertEqual(get_user_agent_cache_info()[:2], (1, 1))
+
+
+class IPGeolocationTest(TestCase):
+    """
+    IP地理位置: 本地离线库二分查找, LRU 缓存, 登录日志写入时解析或写入后补充
+    """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        source = os.path.join(directory, "ip.csv")
+        with open(source, "w", encoding="utf-8") as file:
+            file.write("start_ip,end_ip,continent,country,province,city\n"
+                       "8.8.8.0,8.8.8.255,北美洲,美国,加利福尼亚,山景城\n"
+                       "1.0.1.0,1.0.3.255,亚洲,中国,福建,福州\n"
+                       "1.0.8.0,1.0.15.255,亚洲,中国,广东,广州\n"
+                       "1.0.32.0,1.0.63.255,亚洲,中国,广东,广州\n")
+        self.db = os.path.join(directory, "ip.db")
+        self.assertEqual(LocalIPGeolocationProvider.build(source, self.db), 4)
+        override = override_settings(IP_GEOLOCATION_PROVIDER="local", IP_GEOLOCATION_DB=self.db,
+                                     ENABLE_LOGIN_ANALYSIS_LOG=True)
+        override.enable()
+        self.addCleanup(override.disable)
+        ip_geolocation._providers.clear()
+        ip_geolocation.lookup_ip_geolocation.cache_clear()
+        self.addCleanup(ip_geolocation._providers.clear)
+
+    def test_lookup(self):
+        provider = LocalIPGeolocationProvider(self.db)
+        self.assertEqual(provider.lookup("1.0.1.0")["city"], "福州")
+        self.assertEqual(provider.lookup("1.0.3.255")["city"], "福州")
+        self.assertEqual(provider.lookup("1.0.40.1")["city"], "广州")
+        self.assertEqual(provider.lookup("8.8.8.8")["country"], "美国")
+        self.assertEqual(provider.lookup("1.0.4.0")["city"], "")
+        self.assertEqual(provider.lookup("255.255.255.255")["city"], "")
+        self.assertEqual(provider.lookup("1.0.1.1")["isp"], "")
+
+    def test_cache(self):
+        for ip in ("8.8.8.8", "8.8.8.8", "192.168.1.1", "unknown"):
+            get_ip_geolocation(ip)
+        # 内网IP不解析
+        info = get_ip_geolocation_cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+    @override_settings(API_LOG_ASYNC=False)
+    def test_login_log(self):
+        user = Users.objects.create(username="user_test", name="user_test")
+        request = Request(APIRequestFactory().post("/api/login/", REMOTE_ADDR="1.0.9.1", HTTP_USER_AGENT="Mozilla/5.0"))
+        request.user = user
+        save_login_log(request)
+        log = LoginLog.objects.get(username="user_test")
+        self.assertEqual((log.ip, log.country, log.province, log.city), ("1.0.9.1", "中国", "广东", "广州"))
+
+    class BlockingProvider(IPGeolocationProvider):
+        # 模拟远程接口
+        blocking = True
+
+        def lookup(self, ip):
+            return {**ip_geolocation.get_empty_geolocation(), "country": "美国"} if ip == "8.8.8.8" else None
+
+    @override_settings(API_LOG_ASYNC=False)
+    def test_login_log_enrich(self):
+        # 可能阻塞的解析方式: 登录日志先写入, 再由后台线程补充地理位置
+        writer = log_writer.login_log_geolocation_writer
+        writer.queue = queue.Queue()
+        self.addCleanup(setattr, writer, "queue", None)
+        user = Users.objects.create(username="user_test", name="user_test")
+        with override_settings(IP_GEOLOCATION_PROVIDER=self.BlockingProvider), \
+                mock.patch.object(writer, "_ensure_started"):
+            for ip in ("8.8.8.8", "8.8.8.8", "192.168.1.1", "9.9.9.9"):
+                request = Request(APIRequestFactory().post("/api/login/", REMOTE_ADDR=ip))
+                request.user = user
+                save_login_log(request)
+            self.assertEqual(sorted(LoginLog.objects.filter(continent__isnull=True).values_list("ip", flat=True)),
+                             ["8.8.8.8", "8.8.8.8", "9.9.9.9"])
+            # 按写入的登录日志主键更新, 不更新同一IP的其他登录日志
+            other = LoginLog.objects.create(username="other", ip="8.8.8.8")
+            writer.flush()
+            self.assertEqual(dict(LoginLog.objects.exclude(id=other.id).values_list("ip", "country").order_by("id")),
+                             {"8.8.8.8": "美国", "192.168.1.1": "", "9.9.9.9": ""})
+            self.assertIsNone(LoginLog.objects.get(id=other.id).country)
+            # 未返回主键(如 MySQL)时按IP更新
+            writer.bulk_create([("8.8.8.8", None)])
+        self.assertEqual(LoginLog.objects.get(id=other.id).country, "美国")
+        # 解析失败不缓存
+        self.assertEqual(get_ip_geolocation_cache_info().currsize, 1)
+
+
+class LogSinkTest(TestCase):
+    """
+    日志输出目标: 数据库、NDJSON 文件(按大小/时间滚动)、独立日志数据库路由
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.addCleanup(log_sinks._sinks.clear)
+
+    def read_lines(self, path):
+        with open(path, encoding="utf-8") as file:
+            return [json.loads(line) for line in file]
+
+    def test_file_and_database(self):
+        with override_settings(API_LOG_ASYNC=False, LOG_SINKS=["database", "file"], LOG_FILE_SINK_DIR=self.directory):
+            LogWriter().submit(OperationLog(request_path="/api/sink/", request_method="POST",
+                                            json_result={"code": 2000, "msg": "成功"}))
+        self.assertTrue(OperationLog.objects.filter(request_path="/api/sink/").exists())
+        rows = self.read_lines(os.path.join(self.directory, "public",
+                                            f"{OperationLog._meta.db_table}.{os.getpid()}.ndjson"))
+        self.assertEqual((rows[0]["request_path"], rows[0]["json_result"]), ("/api/sink/", {"code": 2000, "msg": "成功"}))
+        self.assertIsNotNone(rows[0]["create_datetime"])
+
+    def test_file_rollover(self):
+        sink = FileLogSink(directory=self.directory, max_bytes=300, interval=60 * 60)
+        path = sink.get_path(OperationLog)
+        sink.write([OperationLog(request_path="/api/size/")])
+        sink.write([OperationLog(request_path="/api/size/")])
+        # 超过大小滚动
+        self.assertEqual(len(os.listdir(os.path.dirname(path))), 2)
+        # 跨越时间段滚动
+        os.utime(path, (time.time() - 2 * 60 * 60, time.time() - 2 * 60 * 60))
+        sink.max_bytes = 1024 * 1024
+        sink.write([OperationLog(request_path="/api/time/")])
+        self.assertEqual(len(os.listdir(os.path.dirname(path))), 3)
+        self.assertEqual([row["request_path"] for row in self.read_lines(path)], ["/api/time/"])
+        # 文件被其他进程或外部轮转移走时不报错
+        os.remove(path)
+        sink.rollover(path)
+        self.assertFalse(sink.should_rollover(path, 1024))
+
+    def test_partial_failure(self):
+        # 数据库写入成功、文件写入失败时不计为写入失败
+        blocked = os.path.join(self.directory, "blocked")
+        open(blocked, "w").close()
+        writer = LogWriter()
+        with override_settings(API_LOG_ASYNC=False, LOG_SINKS=["database", "file"], LOG_FILE_SINK_DIR=blocked):
+            writer.submit(OperationLog(request_path="/api/partial/"))
+        self.assertTrue(OperationLog.objects.filter(request_path="/api/partial/").exists())
+        self.assertEqual((writer.get_stats()["written"], writer.get_stats()["failed"]), (1, 0))
+
+    def test_router(self):
+        router = LogDatabaseRouter()
+        self.assertIsNone(router.db_for_write(OperationLog))
+        connections.databases["logs"] = connections.databases["default"]
+        try:
+            self.assertEqual(router.db_for_write(OperationLog), "logs")
+            self.assertEqual(router.db_for_read(Users, instance=OperationLog()), "default")
+            self.assertIsNone(router.db_for_read(Users))
+            self.assertFalse(router.allow_migrate("logs", "system", "users", model=Users))
+            self.assertFalse(router.allow_migrate("default", "system", "loginlog", model=LoginLog))
+            self.assertTrue(router.allow_migrate("logs", "system", "loginlog", model=LoginLog))
+            # 跨库关联的创建人使用 prefetch_related
+            with override_settings(DATABASE_ROUTERS=["dvadmin.utils.log_sinks.LogDatabaseRouter"]):
+                serializer = OperationLogSerializer(context={"request": Request(APIRequestFactory().get("/"))})
+                self.assertIn("creator", build_query_plan(serializer).prefetch_related)
+        finally:
+            del connections.databases["logs"]
+
+
+class ProcessCacheTest(TestCase):
+    """
+    进程内缓存: 仅在缓存版本号存放于共享缓存(或单进程部署)时启用
+    """
+
+    def test_shared_cache(self):
+        self.assertFalse(dispatch.is_shared_cache())
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache",
+                                                   "LOCATION": "redis://127.0.0.1:6379/1"}}):
+            self.assertTrue(dispatch.is_shared_cache())
+            self.assertTrue(dispatch.is_process_cache_enabled())
+
+    def test_bypass_local_cache(self):
+        dept = Dept.objects.create(name="部门")
+        self.assertEqual(get_dept_full_name(dept.id), "部门")
+        # 模拟其他进程修改数据: 当前进程的缓存版本号未变化
+        Dept.objects.filter(id=dept.id).update(name="新部门")
+        self.assertEqual(get_dept_full_name(dept.id), "新部门")
+        self.assertIsNot(get_api_permission_index(), get_api_permission_index())
+        with override_settings(LOCAL_CACHE_SINGLE_PROCESS=True):
+            self.assertIs(get_api_permission_index(), get_api_permission_index())
+
+    def test_request_cache(self):
+        request = Request(APIRequestFactory().get("/"))
+        calls = []
+        for item in (request, request._request):
+            self.assertEqual(get_request_cache(item, "test", lambda: calls.append(1) or len(calls)), 1)
+        self.assertEqual(get_request_cache(None, "test", lambda: calls.append(1) or len(calls)), 2)
+
+
+class ApiPermissionIndexTenantTest(TestCase):
+    """
+    接口权限索引: 租户模式下各租户单独缓存
+    """
+
+    def set_tenant(self, schema_name):
+        connection.tenant = types.SimpleNamespace(schema_name=schema_name)
+
+    @override_settings(LOCAL_CACHE_SINGLE_PROCESS=True)
+    def test_per_tenant(self):
+        self.addCleanup(delattr, connection, "tenant")
+        self.set_tenant("tenant_a")
+        index_a = get_api_permission_index()
+        self.set_tenant("tenant_b")
+        # 两个租户的权限版本号相同
+        cache.set(dispatch._get_cache_version_key("permission", "tenant_b"),
+                  dispatch.get_cache_version("permission", "tenant_a"), timeout=None)
+        index_b = get_api_permission_index()
+        self.assertIsNot(index_a, index_b)
+        self.assertIs(get_api_permission_index(), index_b)
+        self.set_tenant("tenant_a")
+        self.assertIs(get_api_permission_index(), index_a)
+
+
+class PermissionSnapshotTest(TestCase):
+    """
+    token 权限快照: 仅共享缓存时启用, 缓存清空后旧版本号不再生效
+    """
+
+    def setUp(self):
+        self.user = Users.objects.create(username="snapshot_user", name="snapshot_user")
+        self.role = Role.objects.create(name="快照角色", key="snapshot_role", sort=1)
+        self.user.role.add(self.role)
+
+    def get_role_ids(self, token):
+        return getattr(CustomJWTAuthentication().get_user(token), "role_id_list", None)
+
+    @override_settings(PERMISSION_JWT_SNAPSHOT=True)
+    def test_local_cache(self):
+        token = set_permission_snapshot(RefreshToken.for_user(self.user).access_token, self.user)
+        self.assertNotIn("role_ids", token)
+        self.assertIsNone(self.get_role_ids(token))
+
+    def test_shared_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        shared_cache = {"default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                                    "LOCATION": directory}}
+        with override_settings(PERMISSION_JWT_SNAPSHOT=True, CACHES=shared_cache):
+            token = set_permission_snapshot(RefreshToken.for_user(self.user).access_token, self.user)
+            self.assertEqual(self.get_role_ids(token), [self.role.id])
+            # 缓存清空(如重启、淘汰)后重新生成的版本号与旧token不一致
+            cache.clear()
+            self.assertIsNone(self.get_role_ids(token))
+
+
+class DeptClosureSyncTest(TestCase):
+    """
+    部门闭包表: 迁移后自动补全, 批量修改上级部门时同步
+    """
+
+    def setUp(self):
+        self.root = Dept.objects.create(name="总部")
+        self.sub = Dept.objects.create(name="研发部", parent=self.root)
+        self.other = Dept.objects.create(name="市场部", parent=self.root)
+        self.leaf = Dept.objects.create(name="前端组", parent=self.sub)
+
+    def test_backfill_after_migrate(self):
+        DeptClosure.objects.all().delete()
+        backfill_dept_closure(sender=None)
+        self.assertEqual(set(Dept.recursion_all_dept(self.root.id)),
+                         {self.root.id, self.sub.id, self.other.id, self.leaf.id})
+        # 已一致时不重建
+        with self.assertNumQueries(3):
+            backfill_dept_closure(sender=None)
+
+    def test_queryset_update_parent(self):
+        version = dispatch.get_cache_version("dept")
+        with self.captureOnCommitCallbacks(execute=True):
+            Dept.objects.filter(id=self.sub.id).update(parent=self.other)
+        self.assertEqual(set(Dept.recursion_all_dept(self.other.id)), {self.other.id, self.sub.id, self.leaf.id})
+        self.assertNotEqual(dispatch.get_cache_version("dept"), version)
+        Dept.objects.filter(id=self.sub.id).update(parent_id=None)
+        self.assertEqual(set(Dept.recursion_all_dept(self.other.id)), {self.other.id})
+        self.assertEqual(set(Dept.recursion_all_dept(self.sub.id)), {self.sub.id, self.leaf.id})
+
+
+class DataScopeLogDatabaseTest(TestCase):
+    """
+    数据权限: 日志在独立日志数据库时, 部门范围在部门所在数据库查询, 不以子查询关联部门闭包表
+    """
+
+    def setUp(self):
+        self.root = Dept.objects.create(name="总部")
+        self.sub = Dept.objects.create(name="研发部", parent=self.root)
+        self.other = Dept.objects.create(name="市场部")
+        role = Role.objects.create(name="日志审计", key="log_scope", sort=1)
+        menu = Menu.objects.create(name="操作日志")
+        button = MenuButton.objects.create(menu=menu, name="查询", value="log:search",
+                                           api="/api/system/operation_log/", method=0)
+        RoleMenuButtonPermission.objects.create(role=role, menu_button=button, data_range=1)
+        self.user = Users.objects.create(username="log_scope_user", name="log_scope_user", dept=self.root)
+        self.user.role.add(role)
+        for dept in (self.root, self.sub, self.other):
+            OperationLog.objects.create(request_path=f"/api/{dept.id}/", dept_belong_id=str(dept.id))
+
+    def filter_logs(self):
+        request = Request(APIRequestFactory().get("/api/system/operation_log/"))
+        request.user = self.user
+        request.parser_context = {"kwargs": {}}
+        return filters.DataLevelPermissionsFilter().filter_queryset(request, OperationLog.objects.all(), None)
+
+    def test_subquery(self):
+        queryset = self.filter_logs()
+        self.assertIn(DeptClosure._meta.db_table, str(queryset.query))
+        self.assertEqual(sorted(queryset.values_list("dept_belong_id", flat=True)),
+                         sorted([str(self.root.id), str(self.sub.id)]))
+
+    def test_log_database(self):
+        connections.databases["logs"] = connections.databases["default"]
+        try:
+            with override_settings(DATABASE_ROUTERS=["dvadmin.utils.log_sinks.LogDatabaseRouter"]):
+                queryset = self.filter_logs()
+                self.assertEqual(queryset.db, "logs")
+                sql = str(queryset.query)
+        finally:
+            del connections.databases["logs"]
+        self.assertNotIn(DeptClosure._meta.db_table, sql)
+        self.assertEqual(sorted(queryset.using("default").values_list("dept_belong_id", flat=True)),
+                         sorted([str(self.root.id), str(self.sub.id)]))
+
+
+class ApiPermissionMatchTest(TestCase):
+    """
+    接口权限匹配: 路由模板不区分大小写, 未启用进程内缓存时按角色查询, 系统检查返回警告
+    """
+
+    def setUp(self):
+        self.role = Role.objects.create(name="接口角色", key="api_role", sort=1)
+        menu = Menu.objects.create(name="用户管理")
+        for i, api in enumerate(["/API/System/User/", "/api/not_exist/{id}/"]):
+            button = MenuButton.objects.create(menu=menu, name=f"按钮{i}", value=f"api_match:{i}", api=api, method=0)
+            RoleMenuButtonPermission.objects.create(role=self.role, menu_button=button)
+
+    def test_case_insensitive(self):
+        self.assertEqual(get_api_route_template("/API/System/User/"), "/api/system/user/")
+        for enabled in (True, False):
+            with self.subTest(process_cache=enabled), override_settings(LOCAL_CACHE_SINGLE_PROCESS=enabled):
+                self.assertTrue(match_api_permission("/api/system/user/", 0, [self.role.id]))
+                self.assertFalse(match_api_permission("/api/system/user/", 1, [self.role.id]))
+                self.assertFalse(match_api_permission("/api/system/user/", 0, []))
+
+    @override_settings(LOCAL_CACHE_SINGLE_PROCESS=False)
+    def test_uncached_by_roles(self):
+        with mock.patch("dvadmin.utils.permission.ApiPermissionIndex.build") as build:
+            self.assertTrue(match_api_permission("/api/not_exist/1/", 0, [self.role.id]))
+        build.assert_not_called()
+
+    def test_check_warning(self):
+        warnings = check_api_permission_index()
+        unmapped = [w for w in warnings if w.id == "dvadmin.W001" and "/api/not_exist/{id}/" in w.msg]
+        self.assertEqual(len(unmapped), 1)
+        self.assertIsInstance(unmapped[0], checks.Warning)
+        self.assertFalse([w for w in warnings if "/API/System/User/" in w.msg])
+
+
+class ApiPermissionEquivalenceTest(TestCase):
+    """
+    接口权限: 路由索引及合并正则的判断结果与原实现(逐条正则匹配)一致
+    """
+    # (说明, 接口白名单, 角色接口, 请求方法, 请求地址)
+    cases = [
+        ("白名单", [("/api/system/dept_lazy_tree/", 0)], [], "GET", "/api/system/dept_lazy_tree/"),
+        ("白名单{id}", [("/api/system/user/{id}/", 0)], [], "GET", "/api/system/user/12/"),
+        ("白名单请求方法不一致", [("/api/system/user/{id}/", 0)], [], "DELETE", "/api/system/user/12/"),
+        ("角色接口", [], [("/api/system/user/", 0)], "GET", "/api/system/user/"),
+        ("角色接口{id}", [], [("/api/system/user/{id}/", 2)], "PUT", "/api/system/user/5/"),
+        ("{id}含横线", [], [("/api/system/user/{id}/", 2)], "PUT", "/api/system/user/abc-1/"),
+        ("{id}含下划线", [], [("/api/system/user/{id}/", 2)], "PUT", "/api/system/user/abc_1/"),
+        ("请求方法不一致", [], [("/api/system/user/{id}/", 2)], "DELETE", "/api/system/user/5/"),
+        ("{id}不匹配列表", [], [("/api/system/user/{id}/", 0)], "GET", "/api/system/user/"),
+        ("请求缺少结尾斜杠", [], [("/api/system/user/", 0)], "GET", "/api/system/user"),
+        ("接口缺少结尾斜杠", [], [("/api/system/user", 0)], "GET", "/api/system/user/"),
+        ("接口大小写", [], [("/API/System/User/", 0)], "GET", "/api/system/user/"),
+        ("请求大小写", [], [("/api/system/user/", 0)], "GET", "/API/SYSTEM/USER/"),
+        ("自定义路由", [], [("/api/system/system_config/get_table_data/{id}/", 0)], "GET",
+         "/api/system/system_config/get_table_data/3/"),
+        ("正则接口", [], [("/api/system/user/.*", 0)], "GET", "/api/system/user/5/"),
+        ("未授权", [], [("/api/system/role/", 0)], "GET", "/api/system/user/"),
+    ]
+
+    def setUp(self):
+        self.user = Users.objects.create(username="equivalence_user", name="equivalence_user")
+        self.role = Role.objects.create(name="接口角色", key="equivalence_role", sort=1)
+        self.user.role.add(self.role)
+        self.menu = Menu.objects.create(name="接口菜单")
+
+    def legacy_has_permission(self, path, method):
+        # 原实现: 白名单及角色接口逐条转为正则, 与 "接口:请求方法序号" 匹配
+        method = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH'].index(method)
+        api_list = list(ApiWhiteList.objects.values_list('url', 'method'))
+        api_list += RoleMenuButtonPermission.objects.filter(role__in=[self.role.id]).values_list(
+            'menu_button__api', 'menu_button__method')
+        patterns = [str(api).replace('{id}', '([a-zA-Z0-9-]+)') + ":" + str(method) + '$' for api, method in api_list
+                    if api]
+        return any(re.match(item, path + ":" + str(method), re.M | re.I) for item in patterns)
+
+    def has_permission(self, path, method):
+        http_request = getattr(APIRequestFactory(), method.lower())(path)
+        try:
+            http_request.resolver_match = resolve(path)
+        except Resolver404:
+            http_request.resolver_match = None
+        request = Request(http_request)
+        request.user = Users.objects.get(pk=self.user.pk)
+        return CustomPermission().has_permission(request, None)
+
+    def test_equivalence(self):
+        for enabled in (True, False):
+            for name, white_list, role_apis, method, path in self.cases:
+                with self.subTest(name, process_cache=enabled), \
+                        override_settings(LOCAL_CACHE_SINGLE_PROCESS=enabled), transaction.atomic():
+                    for url, api_method in white_list:
+                        ApiWhiteList.objects.create(url=url, method=api_method)
+                    for i, (api, api_method) in enumerate(role_apis):
+                        button = MenuButton.objects.create(menu=self.menu, name=f"按钮{i}", value=f"equivalence:{i}",
+                                                           api=api, method=api_method)
+                        RoleMenuButtonPermission.objects.create(role=self.role, menu_button=button)
+                    self.assertEqual(self.has_permission(path, method), self.legacy_has_permission(path, method))
+                    transaction.set_rollback(True)
+                dispatch.refresh_cache_version("permission")
+
+
+@override_settings(LOCAL_CACHE_SINGLE_PROCESS=True)
+class DataScopeCacheTest(TestCase):
+    """
+    数据权限范围缓存: 命中统计, 权限、角色、部门变化时失效, LRU 淘汰
+    """
+    api = "/api/system/user/"
+
+    def setUp(self):
+        self.cache = DataScopeCache(maxsize=2)
+        self.dept = Dept.objects.create(name="研发部")
+        self.role = Role.objects.create(name="数据角色", key="data_scope_role", sort=1)
+        self.other_role = Role.objects.create(name="其他角色", key="data_scope_other", sort=2)
+        menu = Menu.objects.create(name="用户管理")
+        self.button = MenuButton.objects.create(menu=menu, name="查询", value="data_scope:Search", api=self.api,
+                                                method=0)
+        self.permission = RoleMenuButtonPermission.objects.create(role=self.role, menu_button=self.button,
+                                                                  data_range=2)
+
+    def get(self, role_id_list=None, api=None):
+        role_id_list = [self.role.id, self.other_role.id] if role_id_list is None else role_id_list
+        return self.cache.get(self.dept.id, role_id_list, api or self.api, 0)
+
+    def assertInfo(self, hits, misses):
+        info = self.cache.info()
+        self.assertEqual((info["hits"], info["misses"]), (hits, misses))
+
+    def test_hit(self):
+        self.assertEqual(self.get(), (DATA_SCOPE_DEPT, frozenset({2})))
+        # 角色顺序不同视为同一key
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get([self.other_role.id, self.role.id]), (DATA_SCOPE_DEPT, frozenset({2})))
+        self.assertInfo(1, 1)
+
+    def test_invalidate(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.permission.data_range = 3
+            self.permission.save()
+        self.assertEqual(self.get(), (DATA_SCOPE_ALL, frozenset()))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.role.status = False
+            self.role.save()
+        self.assertEqual(self.get(), (DATA_SCOPE_DEPT, frozenset()))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dept.name = "研发中心"
+            self.dept.save()
+        self.get()
+        self.assertInfo(0, 4)
+
+    def test_white_list(self):
+        self.assertFalse(self.cache.is_white_list(self.api, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            ApiWhiteList.objects.create(url=self.api, method=0, enable_datasource=False)
+        self.assertTrue(self.cache.is_white_list(self.api, 0))
+
+    def test_lru(self):
+        apis = ["/api/a/", "/api/b/", "/api/c/"]
+        self.get(api=apis[0])
+        self.get(api=apis[1])
+        self.get(api=apis[0])
+        # 超出 maxsize 时淘汰最久未使用的 /api/b/
+        self.get(api=apis[2])
+        self.assertEqual(self.cache.info()["size"], 2)
+        self.get(api=apis[0])
+        self.assertInfo(2, 3)
+        self.get(api=apis[1])
+        self.assertInfo(2, 4)
+
+    @override_settings(LOCAL_CACHE_SINGLE_PROCESS=False)
+    def test_disabled(self):
+        self.get()
+        self.permission.data_range = 3
+        self.permission.save()
+        self.assertEqual(self.get(), (DATA_SCOPE_ALL, frozenset()))
+        self.assertEqual(self.cache.info(), {"hits": 0, "misses": 0, "size": 0, "maxsize": 2})
+
+
+@override_settings(LOCAL_CACHE_SINGLE_PROCESS=True)
+class RoleCacheTest(TestCase):
+    """
+    按角色缓存的前端路由: ETag 协商缓存, 查询参数分别缓存, 菜单或权限变化时失效
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = Users.objects.create(username="role_cache_user", name="role_cache_user")
+        self.role = Role.objects.create(name="路由角色", key="role_cache_role", sort=1)
+        self.user.role.add(self.role)
+        self.menu = Menu.objects.create(name="系统管理", web_path="/system")
+        RoleMenuPermission.objects.create(role=self.role, menu=self.menu)
+
+    def web_router(self, params=None, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        request = APIRequestFactory().get("/api/system/menu/web_router/", params or {}, **headers)
+        force_authenticate(request, user=Users.objects.get(pk=self.user.pk))
+        # 与路由注册时一致使用 action 的 permission_classes
+        return MenuViewSet.as_view({"get": "web_router"}, permission_classes=[])(request)
+
+    def test_etag(self):
+        response = self.web_router()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.web_router(etag=response["ETag"]).status_code, 304)
+        self.assertEqual(self.web_router(etag='"other"').status_code, 200)
+
+    def test_query_params(self):
+        # 查询参数(如 restql 的 query/exclude)不同时分别缓存, 参数顺序不影响
+        def get(query_string):
+            request = Request(APIRequestFactory().get(f"/api/test/?{query_string}"))
+            request.user = self.user
+            response = role_cache_response(request, "role_cache_test", lambda: request.query_params.get("query"),
+                                           lambda data: DetailResponse(data=data))
+            return response.data["data"], response["ETag"]
+
+        data, etag = get("query={id}&page=1")
+        self.assertEqual(data, "{id}")
+        self.assertEqual(get("")[0], None)
+        self.assertEqual(get("exclude=name")[0], None)
+        self.assertEqual(get("page=1&query={id}"), (data, etag))
+        self.assertEqual(get("query={id,name}&page=1")[0], "{id,name}")
+
+    def test_invalidate(self):
+        etag = self.web_router()["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.menu.name = "系统设置"
+            self.menu.save()
+        response = self.web_router(etag=etag)
+        self.assertEqual((response.status_code, response.data["data"][0]["title"]), (200, "系统设置"))
+        etag = response["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Menu.objects.create(name="日志管理", web_path="/log")
+            RoleMenuPermission.objects.create(role=self.role, menu=other)
+        response = self.web_router(etag=etag)
+        self.assertEqual((response.status_code, len(response.data["data"])), (200, 2))
+        etag = response["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            button = MenuButton.objects.create(menu=other, name="查询", value="role_cache:Search", api="/api/log/",
+                                               method=0)
+        self.assertEqual(self.web_router(etag=etag).status_code, 200)
+        etag = self.web_router()["ETag"]
+        self.assertEqual(self.web_router(etag=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            RoleMenuButtonPermission.objects.create(role=self.role, menu_button=button)
+        self.assertEqual(self.web_router(etag=etag).status_code, 200)
+
+
+@skipUnless(os.environ.get("DVADMIN_BENCHMARK"), "设置环境变量 DVADMIN_BENCHMARK=1 后执行")
+class DataScopeBenchmark(TestCase):
+    """
+    数据权限过滤性能对比: 部门id列表(IN) 与 部门闭包表子查询
+    执行: DVADMIN_BENCHMARK=1 python manage.py test dvadmin.system.tests.DataScopeBenchmark
+    """
+    branch = 10
+
+    def build_dept_tree(self, size):
+        Users.objects.all().delete()
+        Dept.objects.all().delete()
+        level = Dept.objects.bulk_create([Dept(name="root", sort=1)])
+        dept_ids = [level[0].id]
+        while len(dept_ids) < size:
+            rows = [
+                Dept(name=f"dept-{len(dept_ids)}-{i}", sort=i, parent_id=parent.id)
+                for parent in level for i in range(self.branch)
+            ][:size - len(dept_ids)]
+            level = Dept.objects.bulk_create(rows, batch_size=1000)
+            dept_ids.extend(dept.id for dept in level)
+        DeptClosure.rebuild()
+        Users.objects.bulk_create([
+            Users(username=f"user-{dept_id}", password="", name=f"user-{dept_id}", dept_id=dept_id,
+                  dept_belong_id=str(dept_id))
+            for dept_id in dept_ids
+        ], batch_size=1000)
+        return dept_ids
+
+    @staticmethod
+    def run_list(queryset):
+        return queryset.count(), list(queryset.order_by("id").values_list("id", flat=True)[:20])
+
+    def in_list(self, dept_id):
+        dept_list = Dept.recursion_all_dept(dept_id)
+        return Users.objects.filter(dept_belong_id__in=dept_list)
+
+    def sub_query(self, dept_id):
+        condition = get_data_scope_filter("dept_belong_id", dept_id, [], {1}, output_field=CharField())
+        return Users.objects.filter(condition)
+
+    def compare(self, size, dept_id, times=5):
+        result = {}
+        for name, strategy in (("in_list", self.in_list), ("sub_query", self.sub_query)):
+            try:
+                start_time = time.time()
+                for _ in range(times):
+                    queryset = strategy(dept_id)
+                    data = self.run_list(queryset)
+                run_time = (time.time() - start_time) / times
+                sql, params = queryset.query.sql_with_params()
+                result[name] = data
+                print(f"[{size}] dept={dept_id} {name}: {run_time * 1000:.2f} ms, "
+                      f"sql {len(sql)} chars, {len(params)} params, {data[0]} rows")
+            except OperationalError as e:
+                print(f"[{size}] dept={dept_id} {name}: {e}")
+        if len(result) == 2:
+            self.assertEqual(result["in_list"], result["sub_query"])
+
+    def test_benchmark(self):
+        for size in (10000, 50000):
+            dept_ids = self.build_dept_tree(size)
+            # 整个部门树 / 第二层的一个部门 / 叶子部门
+            for dept_id in (dept_ids[0], dept_ids[1], dept_ids[-1]):
+                self.compare(size, dept_id)
+
+
+@skipUnless(os.environ.get("DVADMIN_BENCHMARK"), "设置环境变量 DVADMIN_BENCHMARK=1 后执行")
+class FilterBackendBenchmark(TestCase):
+    """
+    过滤器性能对比: 每次请求生成 AutoFilterSet 与 按视图集缓存
+    执行: DVADMIN_BENCHMARK=1 python manage.py test dvadmin.system.tests.FilterBackendBenchmark
+    """
+
+    def run_filter(self, times, cached):
+        params = {'name': 'test', 'username': 'test', 'gender': '1', 'is_active': '1', 'page': '1', 'limit': '20'}
+        request = Request(APIRequestFactory().get('/api/system/user/', params))
+        start_time = time.time()
+        for _ in range(times):
+            if not cached:
+                filters._auto_filterset_cache.clear()
+            queryset = CustomDjangoFilterBackend().filter_queryset(request, Users.objects.all(), UserViewSet())
+        run_time = (time.time() - start_time) / times
+        return run_time, str(queryset.query)
+
+    def test_benchmark(self):
+        times = 1000
+        uncached_time, uncached_sql = self.run_filter(times, cached=False)
+        cached_time, cached_sql = self.run_filter(times, cached=True)
+        print(f"AutoFilterSet 每次生成: {uncached_time * 1000:.3f} ms/次, 缓存: {cached_time * 1000:.3f} ms/次, "
+              f"提升 {uncached_time / cached_time:.1f} 倍")
+        self.assertEqual(uncached_sql, cached_sql)
+
 
 if __name__ == '__main__':
     getMenu()
\ No newline at end of file
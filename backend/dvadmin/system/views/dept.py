@@ -5,11 +5,14 @@
 @contact: QQ:2505811377
 @Remark: 部门管理
 """
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
 from dvadmin.system.models import Dept, RoleMenuButtonPermission, Users
+from dvadmin.utils.dept_statistics import get_dept_statistics
 from dvadmin.utils.json_response import DetailResponse, SuccessResponse, ErrorResponse
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
@@ -26,14 +29,35 @@ class DeptSerializer(CustomModelSerializer):
 
     dept_user_count = serializers.SerializerMethodField()
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        预先关联上级部门并标注用户数、下级部门数,避免逐行查询
+        :param queryset:
+        :return:
+        """
+        return queryset.select_related('parent').annotate(
+            user_count=Coalesce(Subquery(
+                Users.objects.filter(dept=OuterRef('pk')).order_by().values('dept').annotate(
+                    count=Count('id')).values('count')
+            ), 0),
+            children_count=Coalesce(Subquery(
+                Dept.objects.filter(parent=OuterRef('pk')).order_by().values('parent').annotate(
+                    count=Count('id')).values('count')
+            ), 0),
+        )
+
     def get_dept_user_count(self, obj: Dept):
+        user_count = getattr(obj, 'user_count', None)
+        if user_count is not None:
+            return user_count
         return Users.objects.filter(dept=obj).count()
 
     def get_hasChild(self, instance):
-        hasChild = Dept.objects.filter(parent=instance.id)
-        if hasChild:
-            return True
-        return False
+        children_count = getattr(instance, 'children_count', None)
+        if children_count is not None:
+            return children_count > 0
+        return Dept.objects.filter(parent=instance.id).exists()
 
     def get_status_label(self, obj: Dept):
         if obj.status:
@@ -41,6 +65,9 @@ class DeptSerializer(CustomModelSerializer):
         return "禁用"
 
     def get_has_children(self, obj: Dept):
+        children_count = getattr(obj, 'children_count', None)
+        if children_count is not None:
+            return children_count
         return Dept.objects.filter(parent_id=obj.id).count()
 
     class Meta:
@@ -119,7 +146,7 @@ class DeptViewSet(CustomModelViewSet):
             queryset = self.queryset.filter(status=True, parent=parent)
         else:
             queryset = self.queryset.filter(status=True)
-        queryset = self.filter_queryset(queryset)
+        queryset = DeptSerializer.setup_eager_loading(self.filter_queryset(queryset))
         serializer = DeptSerializer(queryset, many=True, request=request)
         data = serializer.data
         return SuccessResponse(data=data)
@@ -189,49 +216,36 @@ class DeptViewSet(CustomModelViewSet):
     @action(methods=['GET'], detail=False, permission_classes=[])
     def dept_info(self, request):
         """部门信息"""
-        def inner(did, li):
-            sub = Dept.objects.filter(parent_id=did)
-            if not sub.exists():
-                return li
-            for i in sub:
-                li.append(i.pk)
-                inner(i, li)
-            return li
         dept_id = request.query_params.get('dept_id')
         show_all = request.query_params.get('show_all')
         if dept_id is None:
             return ErrorResponse(msg="部门不存在")
         if not show_all:
             show_all = 0
-        if int(show_all):  # 递归当前部门下的所有部门，查询用户
-            all_did = [dept_id]
-            inner(dept_id, all_did)
-            users = Users.objects.filter(dept_id__in=all_did)
-        else:
-            if dept_id != '':
-                users = Users.objects.filter(dept_id=dept_id)
-            else:
-                users = Users.objects.none()
-        dept_obj = Dept.objects.get(id=dept_id) if dept_id != '' else None
-        sub_dept = Dept.objects.filter(parent_id=dept_obj.pk) if dept_id != '' else []
+        if dept_id == '':
+            return SuccessResponse({
+                'dept_name': None,
+                'dept_user': 0,
+                'owner': None,
+                'description': None,
+                'gender': {'male': 0, 'female': 0, 'unknown': 0},
+                'sub_dept_map': []
+            })
+        # 递归当前部门下的所有部门时，统计所有下级部门的用户
+        result = get_dept_statistics(dept_id, show_all=bool(int(show_all)))
+        if result is None:
+            return ErrorResponse(msg="部门不存在")
+        dept_obj, statistics = result['dept'], result['statistics']
         data = {
-            'dept_name': dept_obj and dept_obj.name,
-            'dept_user': users.count(),
-            'owner': dept_obj and dept_obj.owner,
-            'description': dept_obj and dept_obj.description,
+            'dept_name': dept_obj.name,
+            'dept_user': statistics['total'],
+            'owner': dept_obj.owner,
+            'description': dept_obj.description,
             'gender': {
-                'male': users.filter(gender=1).count(),
-                'female': users.filter(gender=2).count(),
-                'unknown': users.filter(gender=0).count(),
+                'male': statistics['male'],
+                'female': statistics['female'],
+                'unknown': statistics['unknown'],
             },
-            'sub_dept_map': []
+            'sub_dept_map': result['sub_dept_map']
         }
-        for dept in sub_dept:
-            all_did = [dept.pk]
-            inner(dept.pk, all_did)
-            sub_data = {
-                'name': dept.name,
-                'count': Users.objects.filter(dept_id__in=all_did).count()
-            }
-            data['sub_dept_map'].append(sub_data)
         return SuccessResponse(data)
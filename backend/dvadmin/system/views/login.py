@@ -15,6 +15,7 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 from django.conf import settings
 from application import dispatch
 from dvadmin.system.models import Users
+from dvadmin.utils.authentication import set_permission_snapshot
 from dvadmin.utils.json_response import ErrorResponse, DetailResponse
 from dvadmin.utils.request_util import save_login_log
 from dvadmin.utils.serializers import CustomModelSerializer
@@ -62,6 +63,11 @@ class LoginSerializer(TokenObtainPairSerializer):
 
     default_error_messages = {"no_active_account": _("账号/密码错误")}
 
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        return set_permission_snapshot(token, user)
+
     def validate(self, attrs):
         captcha = self.initial_data.get("captcha", None)
         if dispatch.get_system_config_values("base.captcha_state"):
@@ -195,6 +201,11 @@ class LoginTokenSerializer(TokenObtainPairSerializer):
 
     default_error_messages = {"no_active_account": _("账号/密码不正确")}
 
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        return set_permission_snapshot(token, user)
+
     def validate(self, attrs):
         if not getattr(settings, "LOGIN_NO_CAPTCHA_AUTH", False):
             return {"code": 4000, "msg": "该接口暂未开通!", "data": None}
@@ -7,6 +7,7 @@
 @Remark: 按钮权限管理
 """
 from dvadmin.system.models import LoginLog
+from dvadmin.utils.log_retention import ArchivedLogMixin
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
 
@@ -22,7 +23,7 @@ class LoginLogSerializer(CustomModelSerializer):
         read_only_fields = ["id"]
 
 
-class LoginLogViewSet(CustomModelViewSet):
+class LoginLogViewSet(ArchivedLogMixin, CustomModelViewSet):
     """
     登录日志接口
     list:查询
@@ -30,7 +31,10 @@ class LoginLogViewSet(CustomModelViewSet):
     update:修改
     retrieve:单例
     destroy:删除
+    archive:归档日志查询
     """
     queryset = LoginLog.objects.all()
     serializer_class = LoginLogSerializer
+    # 日志数据量大, 总数使用估算值避免COUNT全表
+    count_strategy = "estimated"
     extra_filter_class = []
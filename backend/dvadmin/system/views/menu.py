@@ -6,12 +6,15 @@
 @Created on: 2021/6/1 001 22:38
 @Remark: 菜单模块
 """
+from django.db.models import Exists, OuterRef, Prefetch
 from rest_framework import serializers
 from rest_framework.decorators import action
 
-from dvadmin.system.models import Menu, RoleMenuPermission
+from dvadmin.system.models import Menu, RoleMenuPermission, MenuButton
 from dvadmin.system.views.menu_button import MenuButtonSerializer
+from dvadmin.utils.authentication import get_user_role_ids
 from dvadmin.utils.json_response import SuccessResponse, ErrorResponse
+from dvadmin.utils.role_cache import role_cache_response
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
 
@@ -23,8 +26,26 @@ class MenuSerializer(CustomModelSerializer):
     menuPermission = serializers.SerializerMethodField(read_only=True)
     hasChild = serializers.SerializerMethodField()
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        预先标注是否有下级菜单并预取菜单按钮,避免逐行查询
+        :param queryset:
+        :return:
+        """
+        return queryset.annotate(
+            has_child=Exists(Menu.objects.filter(parent=OuterRef('pk')))
+        ).prefetch_related(
+            Prefetch('menuPermission', queryset=MenuButton.objects.order_by('-name').only('id', 'name', 'value', 'menu'))
+        )
+
     def get_menuPermission(self, instance):
-        queryset = instance.menuPermission.order_by('-name').values('id', 'name', 'value')
+        if 'menuPermission' in getattr(instance, '_prefetched_objects_cache', {}):
+            queryset = [
+                {'id': item.id, 'name': item.name, 'value': item.value} for item in instance.menuPermission.all()
+            ]
+        else:
+            queryset = instance.menuPermission.order_by('-name').values('id', 'name', 'value')
         # MenuButtonSerializer(instance.menuPermission.all(), many=True)
         if queryset:
             return queryset
@@ -32,15 +53,15 @@ class MenuSerializer(CustomModelSerializer):
             return None
 
     def get_hasChild(self, instance):
-        hasChild = Menu.objects.filter(parent=instance.id)
-        if hasChild:
-            return True
-        return False
+        has_child = getattr(instance, 'has_child', None)
+        if has_child is not None:
+            return has_child
+        return Menu.objects.filter(parent=instance.id).exists()
 
     class Meta:
         model = Menu
         fields = "__all__"
-        read_only_fields = ["id"]
+        read_only_fields = ["id", "ancestor_ids", "full_name"]
 
 
 class MenuCreateSerializer(CustomModelSerializer):
@@ -58,7 +79,7 @@ class MenuCreateSerializer(CustomModelSerializer):
     class Meta:
         model = Menu
         fields = "__all__"
-        read_only_fields = ["id"]
+        read_only_fields = ["id", "ancestor_ids", "full_name"]
 
 
 class WebRouterSerializer(CustomModelSerializer):
@@ -110,7 +131,7 @@ class MenuViewSet(CustomModelViewSet):
                 queryset = self.queryset.filter()
         else:
             queryset = self.queryset.filter(parent__isnull=True)
-        queryset = self.filter_queryset(queryset)
+        queryset = MenuSerializer.setup_eager_loading(self.filter_queryset(queryset))
         serializer = MenuSerializer(queryset, many=True, request=request)
         data = serializer.data
         return SuccessResponse(data=data)
@@ -119,15 +140,19 @@ class MenuViewSet(CustomModelViewSet):
     def web_router(self, request):
         """用于前端获取当前角色的路由"""
         user = request.user
-        if user.is_superuser:
-            queryset = self.queryset.filter(status=1)
-        else:
-            role_list = user.role.values_list('id', flat=True)
-            menu_list = RoleMenuPermission.objects.filter(role__in=role_list).values_list('menu_id', flat=True)
-            queryset = Menu.objects.filter(id__in=menu_list)
-        serializer = WebRouterSerializer(queryset, many=True, request=request)
-        data = serializer.data
-        return SuccessResponse(data=data, total=len(data), msg="获取成功")
+
+        def get_data():
+            if user.is_superuser:
+                queryset = self.queryset.filter(status=1)
+            else:
+                role_list = get_user_role_ids(user)
+                menu_list = RoleMenuPermission.objects.filter(role__in=role_list).values_list('menu_id', flat=True)
+                queryset = Menu.objects.filter(id__in=menu_list)
+            serializer = WebRouterSerializer(queryset, many=True, request=request)
+            return serializer.data
+
+        return role_cache_response(request, "web_router", get_data,
+                                   lambda data: SuccessResponse(data=data, total=len(data), msg="获取成功"))
 
     @action(methods=['GET'], detail=False, permission_classes=[])
     def get_all_menu(self, request):
@@ -11,7 +11,9 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
 from dvadmin.system.models import MenuButton, RoleMenuButtonPermission
+from dvadmin.utils.authentication import get_user_role_ids
 from dvadmin.utils.json_response import DetailResponse, SuccessResponse
+from dvadmin.utils.role_cache import role_cache_response
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
 
@@ -74,10 +76,14 @@ class MenuButtonViewSet(CustomModelViewSet):
         :param request:
         :return:
         """
-        is_superuser = request.user.is_superuser
-        if is_superuser:
-            queryset = MenuButton.objects.values_list('value',flat=True)
-        else:
-            role_id = request.user.role.values_list('id', flat=True)
-            queryset = RoleMenuButtonPermission.objects.filter(role__in=role_id).values_list('menu_button__value',flat=True).distinct()
-        return DetailResponse(data=queryset)
\ No newline at end of file
+        def get_data():
+            is_superuser = request.user.is_superuser
+            if is_superuser:
+                queryset = MenuButton.objects.values_list('value',flat=True)
+            else:
+                role_id = get_user_role_ids(request.user)
+                queryset = RoleMenuButtonPermission.objects.filter(role__in=role_id).values_list('menu_button__value',flat=True).distinct()
+            return list(queryset)
+
+        return role_cache_response(request, "menu_button_all_permission", get_data,
+                                   lambda data: DetailResponse(data=data))
\ No newline at end of file
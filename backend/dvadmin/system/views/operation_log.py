@@ -8,6 +8,7 @@
 """
 
 from dvadmin.system.models import OperationLog
+from dvadmin.utils.log_retention import ArchivedLogMixin
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.viewset import CustomModelViewSet
 
@@ -33,7 +34,7 @@ class OperationLogCreateUpdateSerializer(CustomModelSerializer):
         fields = '__all__'
 
 
-class OperationLogViewSet(CustomModelViewSet):
+class OperationLogViewSet(ArchivedLogMixin, CustomModelViewSet):
     """
     操作日志接口
     list:查询
@@ -41,7 +42,10 @@ class OperationLogViewSet(CustomModelViewSet):
     update:修改
     retrieve:单例
     destroy:删除
+    archive:归档日志查询
     """
     queryset = OperationLog.objects.order_by('-create_datetime')
     serializer_class = OperationLogSerializer
+    # 日志数据量大, 总数使用估算值避免COUNT全表
+    count_strategy = "estimated"
     # permission_classes = []
@@ -6,6 +6,7 @@
 @Created on: 2021/6/3 003 0:30
 @Remark: 菜单按钮管理
 """
+from django.db import transaction
 from django.db.models import F, Subquery, OuterRef, Exists
 from rest_framework import serializers
 from rest_framework.decorators import action
@@ -13,6 +14,7 @@ from rest_framework.permissions import IsAuthenticated
 
 from dvadmin.system.models import RoleMenuButtonPermission, Menu, MenuButton, Dept, RoleMenuPermission, FieldPermission, \
     MenuField
+from dvadmin.system.signals import refresh_cache_version_on_commit
 from dvadmin.system.views.menu import MenuSerializer
 from dvadmin.utils.json_response import DetailResponse, ErrorResponse
 from dvadmin.utils.serializers import CustomModelSerializer
@@ -118,9 +120,11 @@ class RoleMenuPermissionSerializer(CustomModelSerializer):
     columns = serializers.SerializerMethodField()
 
     def get_name(self, instance):
-        parent_list = Menu.get_all_parent(instance['id'])
-        names = [d["name"] for d in parent_list]
-        return "/".join(names)
+        full_name = instance.get('full_name')
+        if full_name is None:
+            parent_list = Menu.get_all_parent(instance['id'])
+            full_name = "/".join([d["name"] for d in parent_list])
+        return full_name
     def get_isCheck(self, instance):
         params = self.request.query_params
         return RoleMenuPermission.objects.filter(
@@ -144,6 +148,145 @@ class RoleMenuPermissionSerializer(CustomModelSerializer):
         model = Menu
         fields = ['id','name','isCheck','btns','columns']
 
+def get_role_permission_matrix(role_id, menu_queryset):
+    """
+    获取角色的菜单、按钮及数据权限范围授权情况,查询次数与菜单数量无关
+    :param role_id: 角色id
+    :param menu_queryset: 需要展示的菜单
+    :return: [{'name', 'id', 'isCheck', 'btns': [{'id', 'name', 'value', 'isCheck', 'data_range'}]}]
+    """
+    menu_list = list(menu_queryset.values('name', 'id', 'full_name'))
+    menu_ids = [item['id'] for item in menu_list]
+    checked_menu_ids = set(RoleMenuPermission.objects.filter(
+        role__id=role_id, menu_id__in=menu_ids
+    ).values_list('menu_id', flat=True))
+    button_data_range = dict(RoleMenuButtonPermission.objects.filter(
+        role__id=role_id, menu_button__menu_id__in=menu_ids
+    ).values_list('menu_button_id', 'data_range'))
+    menu_btns = {}
+    for btn in MenuButton.objects.filter(menu_id__in=menu_ids).values('id', 'name', 'value', 'menu_id'):
+        menu_btns.setdefault(btn.pop('menu_id'), []).append({
+            **btn,
+            'isCheck': btn['id'] in button_data_range,
+            'data_range': button_data_range.get(btn['id']),
+        })
+    data = []
+    for item in menu_list:
+        completeName = item['full_name']
+        if completeName is None:
+            completeName = "/".join([d["name"] for d in Menu.get_all_parent(item['id'])])
+        data.append({
+            'name': completeName,
+            'id': item['id'],
+            'isCheck': item['id'] in checked_menu_ids,
+            'btns': menu_btns.get(item['id'], []),
+        })
+    return data
+
+
+@transaction.atomic
+def apply_role_permission(role_id, body):
+    """
+    对比角色现有授权,批量新增、修改、删除菜单、按钮(含数据权限关联部门)及字段权限,查询次数与菜单数量无关
+    :param role_id: 角色id
+    :param body: 角色授权页面提交的菜单列表 [{'id', 'isCheck', 'btns': [...], 'columns': [...]}]
+    :return:
+    """
+    # 1. 菜单权限: 勾选的菜单及其所有上级菜单
+    checked_menu_ids = [menu.get('id') for menu in body if menu.get('isCheck')]
+    menu_ids = set()
+    for item in Menu.objects.filter(id__in=checked_menu_ids).values('id', 'ancestor_ids', 'full_name'):
+        if item['full_name'] is not None:
+            menu_ids.update(item['ancestor_ids'] + [item['id']])
+        else:
+            menu_ids.update(d["id"] for d in Menu.get_all_parent(item['id']))
+    exist_menu_ids = set(RoleMenuPermission.objects.filter(role_id=role_id).values_list('menu_id', flat=True))
+    if exist_menu_ids - menu_ids:
+        RoleMenuPermission.objects.filter(role_id=role_id, menu_id__in=exist_menu_ids - menu_ids).delete()
+    RoleMenuPermission.objects.bulk_create(
+        [RoleMenuPermission(role_id=role_id, menu_id=menu_id) for menu_id in menu_ids - exist_menu_ids])
+
+    # 2. 按钮权限及数据权限范围
+    buttons = {}
+    for menu in body:
+        for btn in menu.get('btns') or []:
+            if btn.get('isCheck'):
+                buttons[btn.get('id')] = (btn.get('data_range', 0) or 0, set(btn.get('dept') or []))
+    exist_buttons = {}
+    delete_ids = []
+    for instance in RoleMenuButtonPermission.objects.filter(role_id=role_id, menu_button__isnull=False):
+        if instance.menu_button_id in buttons and instance.menu_button_id not in exist_buttons:
+            exist_buttons[instance.menu_button_id] = instance
+        else:
+            delete_ids.append(instance.id)
+    if delete_ids:
+        RoleMenuButtonPermission.objects.filter(id__in=delete_ids).delete()
+    update_list = []
+    for button_id, instance in exist_buttons.items():
+        if instance.data_range != buttons[button_id][0]:
+            instance.data_range = buttons[button_id][0]
+            update_list.append(instance)
+    RoleMenuButtonPermission.objects.bulk_update(update_list, ['data_range'])
+    create_ids = [button_id for button_id in buttons if button_id not in exist_buttons]
+    if create_ids:
+        RoleMenuButtonPermission.objects.bulk_create([
+            RoleMenuButtonPermission(role_id=role_id, menu_button_id=button_id, data_range=buttons[button_id][0])
+            for button_id in create_ids
+        ])
+        # bulk_create 在部分数据库(如MySQL)下不回填主键,重新查询
+        for instance in RoleMenuButtonPermission.objects.filter(role_id=role_id, menu_button_id__in=create_ids):
+            exist_buttons[instance.menu_button_id] = instance
+
+    # 3. 自定数据权限关联部门
+    DeptThrough = RoleMenuButtonPermission.dept.through
+    dept_pairs = {
+        (exist_buttons[button_id].id, dept_id)
+        for button_id, (_, dept_ids) in buttons.items() for dept_id in dept_ids
+    }
+    exist_dept_pairs = {}
+    for through_id, permission_id, dept_id in DeptThrough.objects.filter(
+            rolemenubuttonpermission_id__in=[instance.id for instance in exist_buttons.values()]
+    ).values_list('id', 'rolemenubuttonpermission_id', 'dept_id'):
+        exist_dept_pairs[(permission_id, dept_id)] = through_id
+    delete_through_ids = [through_id for pair, through_id in exist_dept_pairs.items() if pair not in dept_pairs]
+    if delete_through_ids:
+        DeptThrough.objects.filter(id__in=delete_through_ids).delete()
+    DeptThrough.objects.bulk_create([
+        DeptThrough(rolemenubuttonpermission_id=permission_id, dept_id=dept_id)
+        for permission_id, dept_id in dept_pairs if (permission_id, dept_id) not in exist_dept_pairs
+    ])
+
+    # 4. 字段权限
+    columns = {}
+    for menu in body:
+        for col in menu.get('columns') or []:
+            columns[col.get('id')] = (col.get('is_query'), col.get('is_create'), col.get('is_update'))
+    exist_fields = {}
+    delete_ids = []
+    for instance in FieldPermission.objects.filter(role_id=role_id, field_id__in=list(columns)):
+        if instance.field_id in exist_fields:
+            delete_ids.append(instance.id)
+        else:
+            exist_fields[instance.field_id] = instance
+    if delete_ids:
+        FieldPermission.objects.filter(id__in=delete_ids).delete()
+    update_list = []
+    for field_id, instance in exist_fields.items():
+        is_query, is_create, is_update = columns[field_id]
+        if (instance.is_query, instance.is_create, instance.is_update) != (is_query, is_create, is_update):
+            instance.is_query, instance.is_create, instance.is_update = is_query, is_create, is_update
+            update_list.append(instance)
+    FieldPermission.objects.bulk_update(update_list, ['is_query', 'is_create', 'is_update'])
+    FieldPermission.objects.bulk_create([
+        FieldPermission(role_id=role_id, field_id=field_id, is_query=is_query, is_create=is_create,
+                        is_update=is_update)
+        for field_id, (is_query, is_create, is_update) in columns.items() if field_id not in exist_fields
+    ])
+    # 批量操作不触发 post_save 信号,手动刷新权限及菜单缓存
+    refresh_cache_version_on_commit("permission")
+    refresh_cache_version_on_commit("menu")
+
+
 class RoleMenuButtonPermissionViewSet(CustomModelViewSet):
     """
     菜单按钮接口
@@ -180,37 +323,13 @@ class RoleMenuButtonPermissionViewSet(CustomModelViewSet):
         # serializer = RoleMenuPermissionSerializer(queryset,many=True,request=request)
         # data = serializer.data
         # return DetailResponse(data=data)
-        data = []
         if is_superuser:
-            queryset = Menu.objects.filter(status=1,is_catalog=False).values('name', 'id').all()
+            queryset = Menu.objects.filter(status=1,is_catalog=False)
         else:
             role_id = request.user.role.values_list('id', flat=True)
-            menu_list = RoleMenuPermission.objects.filter(role__in=role_id).values_list('id',flat=True)
-            queryset = Menu.objects.filter(status=1, is_catalog=False,id__in=menu_list).values('name', 'id')
-        for item in queryset:
-            parent_list = Menu.get_all_parent(item['id'])
-            names = [d["name"] for d in parent_list]
-            completeName = "/".join(names)
-            isCheck = RoleMenuPermission.objects.filter(
-                menu__id=item['id'],
-                role__id=role,
-            ).exists()
-            mbCheck = RoleMenuButtonPermission.objects.filter(
-                menu_button=OuterRef("pk"),
-                role__id=role,
-            )
-            btns = MenuButton.objects.filter(
-                menu__id=item['id'],
-            ).annotate(isCheck=Exists(mbCheck)).values('id', 'name', 'value', 'isCheck',
-                                                       data_range=F('menu_button_permission__data_range'))
-            dicts = {
-                'name': completeName,
-                'id': item['id'],
-                'isCheck': isCheck,
-                'btns': btns,
-
-            }
-            data.append(dicts)
+            menu_list = RoleMenuPermission.objects.filter(role__in=role_id).values_list('menu_id',flat=True)
+            queryset = Menu.objects.filter(status=1, is_catalog=False,id__in=menu_list)
+        data = get_role_permission_matrix(role, queryset)
         return DetailResponse(data=data)
 
     @action(methods=['PUT'], detail=True, permission_classes=[IsAuthenticated])
@@ -221,24 +340,7 @@ class RoleMenuButtonPermissionViewSet(CustomModelViewSet):
         :param pk: role
         :return:
         """
-        body = request.data
-        RoleMenuPermission.objects.filter(role=pk).delete()
-        RoleMenuButtonPermission.objects.filter(role=pk).delete()
-        for menu in body:
-            if menu.get('isCheck'):
-                menu_parent = Menu.get_all_parent(menu.get('id'))
-                role_menu_permission_list = []
-                for d in menu_parent:
-                    role_menu_permission_list.append(RoleMenuPermission(role_id=pk, menu_id=d["id"]))
-                RoleMenuPermission.objects.bulk_create(role_menu_permission_list)
-                # RoleMenuPermission.objects.create(role_id=pk, menu_id=menu.get('id'))
-            for btn in menu.get('btns'):
-                if btn.get('isCheck'):
-                    data_range = btn.get('data_range',0) or 0
-                    instance = RoleMenuButtonPermission.objects.create(role_id=pk, menu_button_id=btn.get('id'),data_range=data_range)
-                    instance.dept.set(btn.get('dept',[]))
-            for col in menu.get('columns'):
-                FieldPermission.objects.update_or_create(role_id=pk,field_id=col.get('id'),is_query=col.get('is_query'),is_create=col.get('is_create'),is_update=col.get('is_update'))
+        apply_role_permission(pk, request.data)
         return DetailResponse(msg="授权成功")
 
 
@@ -6,11 +6,12 @@ from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from django.db import connection
-from django.db.models import Q
 from application import dispatch
 from dvadmin.system.models import Users, Role, Dept
 from dvadmin.system.views.role import RoleSerializer
+from dvadmin.utils.dept_path import get_dept_full_name
 from dvadmin.utils.json_response import ErrorResponse, DetailResponse, SuccessResponse
+from dvadmin.utils.search_index import search_queryset
 from dvadmin.utils.serializers import CustomModelSerializer
 from dvadmin.utils.validator import CustomUniqueValidator
 from dvadmin.utils.viewset import CustomModelViewSet
@@ -35,6 +36,7 @@ class UserSerializer(CustomModelSerializer):
     dept_name = serializers.CharField(source='dept.name', read_only=True)
     role_info = DynamicSerializerMethodField()
     dept_name_all = serializers.SerializerMethodField()
+    query_plan_hints = {"role_info": ["role"], "dept_name_all": ["dept_id"]}
 
     class Meta:
         model = Users
@@ -46,9 +48,7 @@ class UserSerializer(CustomModelSerializer):
         }
 
     def get_dept_name_all(self, instance):
-        dept_name_all = recursion(instance.dept, "parent", "name")
-        dept_name_all.reverse()
-        return "/".join(dept_name_all)
+        return get_dept_full_name(instance.dept_id, self.request)
 
     def get_role_info(self, instance, parsed_query):
         roles = instance.role.all()
@@ -229,7 +229,7 @@ class UserViewSet(CustomModelViewSet):
     destroy:删除
     """
 
-    queryset = Users.objects.exclude(is_superuser=1).all()
+    queryset = Users.objects.exclude(is_superuser=1).select_related('dept').prefetch_related('role').all()
     serializer_class = UserSerializer
     create_serializer_class = UserCreateSerializer
     update_serializer_class = UserUpdateSerializer
@@ -376,27 +376,11 @@ class UserViewSet(CustomModelViewSet):
         if not show_all:
             show_all = 0
         if int(show_all):
-            all_did = [dept_id]
-            def inner(did):
-                sub = Dept.objects.filter(parent_id=did)
-                if not sub.exists():
-                    return
-                for i in sub:
-                    all_did.append(i.pk)
-                    inner(i)
             if dept_id != '':
-                inner(dept_id)
-                searchs = [
-                    Q(**{f+'__icontains':i})
-                    for f in self.search_fields
-                ] if (i:=request.query_params.get('search')) else []
-                q_obj = []
-                if searchs:
-                    q = searchs[0]
-                    for i in searchs[1:]:
-                        q |= i
-                    q_obj.append(Q(q))
-                queryset = Users.objects.filter(*q_obj, dept_id__in=all_did)
+                queryset = Users.objects.filter(dept_id__in=Dept.get_descendant_ids(dept_id)).select_related(
+                    'dept').prefetch_related('role')
+                if search := request.query_params.get('search'):
+                    queryset = search_queryset(queryset, self.search_fields, search)
             else:
                 queryset = self.filter_queryset(self.get_queryset())
         else:
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 自定义JWT认证
+"""
+from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from application import dispatch
+
+# 用户角色快照在token中的字段名
+ROLE_IDS_CLAIM = "role_ids"
+PERMISSION_VERSION_CLAIM = "permission_version"
+
+
+def is_permission_snapshot_enabled():
+    """
+    是否开启token中的权限快照(settings.PERMISSION_JWT_SNAPSHOT)
+    权限版本号须存放在多进程共享的缓存(如redis)中, 否则其他进程中角色变化后旧token仍会被信任, 此时不启用快照
+    :return:
+    """
+    return getattr(settings, "PERMISSION_JWT_SNAPSHOT", False) and dispatch.is_shared_cache()
+
+
+def set_permission_snapshot(token, user):
+    """
+    将用户的角色id及权限版本号写入token
+    先读取版本号再读取角色,读取期间角色变化时token会被判定为过期
+    :param token: simplejwt 的 token
+    :param user: 用户
+    :return: token
+    """
+    if not is_permission_snapshot_enabled():
+        return token
+    token[PERMISSION_VERSION_CLAIM] = dispatch.get_cache_version("user_role")
+    token[ROLE_IDS_CLAIM] = list(user.role.values_list('id', flat=True))
+    return token
+
+
+def get_user_role_ids(user):
+    """
+    获取用户的角色id列表:
+    token中权限快照有效时直接使用,否则查询数据库,同一请求内只查询一次
+    :param user: 用户
+    :return: [role_id, ...]
+    """
+    role_id_list = getattr(user, "role_id_list", None)
+    if role_id_list is None:
+        role_id_list = list(user.role.values_list('id', flat=True))
+        user.role_id_list = role_id_list
+    return role_id_list
+
+
+class CustomJWTAuthentication(JWTAuthentication):
+    """
+    自定义JWT认证:
+    开启 PERMISSION_JWT_SNAPSHOT 后,token中的权限版本号与共享缓存中的一致时,
+    使用token中的角色id,避免每次请求查询用户角色;版本号不一致(签发后角色有变化)时回退为查询数据库
+    """
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        if is_permission_snapshot_enabled():
+            role_id_list = validated_token.get(ROLE_IDS_CLAIM, None)
+            version = validated_token.get(PERMISSION_VERSION_CLAIM, None)
+            if role_id_list is not None and version == dispatch.get_cache_version("user_role"):
+                user.role_id_list = list(role_id_list)
+        return user
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 分页总数统计策略: 精确统计、按查询条件缓存、按数据库统计信息估算(仅无查询条件时)
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections, DatabaseError
+from django.utils.module_loading import import_string
+
+from application import dispatch
+
+
+class CountStrategy:
+    """
+    总数统计策略基类, count 返回 (总数, 是否为精确值)
+    """
+
+    def __init__(self, request=None, view=None):
+        self.request = request
+        self.view = view
+
+    def count(self, queryset):
+        raise NotImplementedError
+
+
+class ExactCountStrategy(CountStrategy):
+    """
+    精确统计: COUNT(*)
+    """
+
+    def count(self, queryset):
+        return queryset.count(), True
+
+
+class CachedCountStrategy(CountStrategy):
+    """
+    缓存统计: 以查询SQL及参数为key缓存COUNT(*)结果, 过期时间 settings.PAGINATION_COUNT_CACHE_TIMEOUT
+    """
+
+    def get_cache_key(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        schema_name = connection.tenant.schema_name if dispatch.is_tenants_mode() else ""
+        signature = hashlib.md5(f"{queryset.db}:{sql}:{params!r}".encode("utf-8")).hexdigest()
+        return f"dvadmin:pagination_count:{schema_name}:{queryset.model._meta.db_table}:{signature}"
+
+    def count(self, queryset):
+        key = self.get_cache_key(queryset)
+        total = cache.get(key)
+        if total is not None:
+            return total, False
+        total = queryset.count()
+        cache.set(key, total, getattr(settings, "PAGINATION_COUNT_CACHE_TIMEOUT", 60))
+        return total, True
+
+
+class EstimatedCountStrategy(CountStrategy):
+    """
+    估算统计: 仅无查询条件时读取表统计信息估算(MySQL/PostgreSQL/SQLite);
+    有查询条件(含数据权限、过滤、搜索)时执行计划的预估行数可能偏差很大, 改用缓存统计;
+    估算值小于 settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD 或无法估算时使用精确统计
+    """
+
+    def count(self, queryset):
+        if self.is_filtered(queryset):
+            return CachedCountStrategy(self.request, self.view).count(queryset)
+        try:
+            estimate = self.estimate(queryset)
+        except DatabaseError:
+            estimate = None
+        if estimate is None or estimate < getattr(settings, "PAGINATION_COUNT_ESTIMATE_THRESHOLD", 10000):
+            return queryset.count(), True
+        return estimate, False
+
+    @staticmethod
+    def is_filtered(queryset):
+        query = queryset.query
+        return bool(query.where) or query.distinct or query.low_mark != 0 or query.high_mark is not None
+
+    def estimate(self, queryset):
+        db_connection = connections[queryset.db]
+        vendor_estimate = getattr(self, f"estimate_{db_connection.vendor}", None)
+        if vendor_estimate is None:
+            return None
+        return vendor_estimate(db_connection, queryset.model._meta.db_table)
+
+    @staticmethod
+    def estimate_mysql(db_connection, db_table):
+        with db_connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                [db_table])
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None else None
+
+    @staticmethod
+    def estimate_postgresql(db_connection, db_table):
+        with db_connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)", [db_table])
+            row = cursor.fetchone()
+        # 从未 ANALYZE 的表 reltuples 为 -1
+        return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+    @staticmethod
+    def estimate_sqlite(db_connection, db_table):
+        # SQLite 仅在执行过 ANALYZE 后有表行数统计(sqlite_stat1)
+        with db_connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [db_table])
+            row = cursor.fetchone()
+        return int(row[0].split()[0]) if row else None
+
+
+COUNT_STRATEGIES = {
+    "exact": ExactCountStrategy,
+    "cached": CachedCountStrategy,
+    "estimated": EstimatedCountStrategy,
+}
+
+
+def get_count_strategy(strategy, request=None, view=None):
+    """
+    获取总数统计策略实例
+    :param strategy: 策略名称(exact|cached|estimated)、策略类或其导入路径
+    :param request:
+    :param view:
+    :return: CountStrategy
+    """
+    if isinstance(strategy, str):
+        strategy = COUNT_STRATEGIES.get(strategy) or import_string(strategy)
+    return strategy(request=request, view=view)
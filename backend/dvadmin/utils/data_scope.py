@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 数据权限范围解析及缓存
+"""
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Cast
+
+from application import dispatch
+from dvadmin.system.models import DeptClosure, ApiWhiteList, RoleMenuButtonPermission
+
+# 数据权限范围解析结果
+DATA_SCOPE_ALL = "all"  # 全部数据
+DATA_SCOPE_SELF = "self"  # 仅本人数据
+DATA_SCOPE_DEPT = "dept"  # 部门数据(本部门及以下、本部门、自定部门)
+
+# 影响数据权限范围的缓存版本号
+DATA_SCOPE_CACHE_VERSIONS = ("permission", "role", "dept")
+
+
+def compile_datasource_white_list():
+    """
+    编译不校验数据权限(enable_datasource=False)的接口白名单
+    :return: 编译后的正则列表
+    """
+    matchers = []
+    for url, method in ApiWhiteList.objects.filter(enable_datasource=False).values_list("url", "method"):
+        if not url:
+            continue
+        try:
+            matchers.append(re.compile(str(url.replace("{id}", ".*?")) + ":" + str(method), re.M | re.I))
+        except re.error:
+            continue
+    return matchers
+
+
+def resolve_data_scope(user_dept_id, role_id_list, api, method):
+    """
+    根据角色解析用户在接口上的数据权限范围
+    (0, "仅本人数据权限"),
+    (1, "本部门及以下数据权限"),
+    (2, "本部门数据权限"),
+    (3, "全部数据权限"),
+    (4, "自定数据权限")
+    :param user_dept_id: 用户部门id
+    :param role_id_list: 角色id列表
+    :param api: 接口地址(单例查询时为 {id} 模板)
+    :param method: 请求方法的序号
+    :return: (数据权限范围, 部门数据权限范围集合)
+    """
+    role_permission_list = RoleMenuButtonPermission.objects.filter(
+        role__in=role_id_list,
+        role__status=1,
+        menu_button__api=api,
+        menu_button__method=method).values_list('data_range', flat=True)
+    data_scope_list = set(role_permission_list)
+    # 拥有[全部数据权限]则返回所有数据
+    if 3 in data_scope_list:
+        return DATA_SCOPE_ALL, frozenset()
+    # 仅本人数据权限时只返回本人数据
+    if 0 in data_scope_list:
+        return DATA_SCOPE_SELF, frozenset()
+    return DATA_SCOPE_DEPT, frozenset(data_scope_list & {1, 2, 4})
+
+
+def get_data_scope_filter(field, user_dept_id, role_id_list, data_ranges, output_field=None, subquery=True):
+    """
+    根据部门数据权限范围生成过滤条件,下级部门及自定部门以子查询表示,
+    SQL长度与可见部门数量无关; 过滤的模型与部门表不在同一数据库(如独立日志数据库)时,
+    子查询无法执行, 传 subquery=False 在部门所在数据库查询出部门id列表
+    :param field: 部门字段名,如 dept_belong_id
+    :param user_dept_id: 用户部门id
+    :param role_id_list: 角色id列表
+    :param data_ranges: 部门数据权限范围集合(1/2/4)
+    :param output_field: 部门字段类型与部门id不一致(如 dept_belong_id 为字符串)时,子查询转换的类型
+    :param subquery: 是否以子查询表示部门, 为False时查询出部门id列表
+    :return: Q对象,无可见部门时返回None
+    """
+
+    def dept_values(queryset, name):
+        if not subquery:
+            values = queryset.values_list(name, flat=True)
+            return [value if output_field is None else output_field.to_python(value) for value in values]
+        if output_field is None:
+            return queryset.values(name)
+        return queryset.values(**{"_dept_id": Cast(name, output_field=output_field)}).values("_dept_id")
+
+    condition = None
+    if 1 in data_ranges:
+        condition = Q(**{f"{field}__in": dept_values(DeptClosure.objects.filter(ancestor_id=user_dept_id),
+                                                     "descendant_id")})
+    elif 2 in data_ranges:
+        condition = Q(**{field: user_dept_id if output_field is None else str(user_dept_id)})
+    if 4 in data_ranges:
+        custom_dept = RoleMenuButtonPermission.dept.through.objects.filter(
+            rolemenubuttonpermission__role__in=role_id_list,
+            rolemenubuttonpermission__role__status=1,
+            rolemenubuttonpermission__data_range=4,
+        )
+        custom_condition = Q(**{f"{field}__in": dept_values(custom_dept, "dept_id")})
+        condition = custom_condition if condition is None else condition | custom_condition
+    return condition
+
+
+class DataScopeCache:
+    """
+    数据权限范围的进程内缓存:
+    以 (用户部门, 角色集合, 接口模板, 请求方法) 为key缓存解析结果,
+    权限、角色、部门变化时通过缓存版本号整体失效,租户模式下各租户单独缓存,
+    未启用进程内缓存(dispatch.is_process_cache_enabled)时每次重新解析
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def _get_store(self):
+        schema_name = connection.tenant.schema_name if dispatch.is_tenants_mode() else None
+        version = tuple(dispatch.get_cache_version(name) for name in DATA_SCOPE_CACHE_VERSIONS)
+        store = self._stores.get(schema_name)
+        if store is None or store["version"] != version:
+            with self._lock:
+                store = self._stores.get(schema_name)
+                if store is None or store["version"] != version:
+                    store = {"version": version, "data": OrderedDict(), "white_list": None}
+                    self._stores[schema_name] = store
+        return store
+
+    def is_white_list(self, api, method):
+        """
+        判断接口是否在不校验数据权限的接口白名单中
+        :param api: 当前请求的接口
+        :param method: 请求方法的序号
+        :return: True或者False
+        """
+        if dispatch.is_process_cache_enabled():
+            store = self._get_store()
+            if store["white_list"] is None:
+                store["white_list"] = compile_datasource_white_list()
+            white_list = store["white_list"]
+        else:
+            white_list = compile_datasource_white_list()
+        new_api = f"{api}:{method}"
+        return any(matcher.match(new_api) for matcher in white_list)
+
+    def get(self, user_dept_id, role_id_list, api, method):
+        """
+        获取数据权限范围,未命中时解析并缓存
+        :return: (数据权限范围, 部门数据权限范围集合)
+        """
+        if not dispatch.is_process_cache_enabled():
+            return resolve_data_scope(user_dept_id, role_id_list, api, method)
+        store = self._get_store()
+        data = store["data"]
+        key = (user_dept_id, frozenset(role_id_list), api, method)
+        with self._lock:
+            value = data.get(key)
+            if value is not None:
+                data.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = resolve_data_scope(user_dept_id, role_id_list, api, method)
+        with self._lock:
+            data[key] = value
+            while len(data) > self.maxsize:
+                data.popitem(last=False)
+        return value
+
+    def info(self):
+        """
+        缓存命中情况
+        :return: {"hits": 命中次数, "misses": 未命中次数, "size": 当前缓存数, "maxsize": 最大缓存数}
+        """
+        size = sum(len(store["data"]) for store in list(self._stores.values()))
+        return {"hits": self.hits, "misses": self.misses, "size": size, "maxsize": self.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._stores = {}
+            self.hits = self.misses = 0
+
+
+data_scope_cache = DataScopeCache(maxsize=getattr(settings, "DATA_SCOPE_CACHE_SIZE", 10000))
+
+
+def get_data_scope_cache_info():
+    """
+    获取数据权限范围缓存的命中情况
+    :return:
+    """
+    return data_scope_cache.info()
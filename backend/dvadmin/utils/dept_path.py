@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 部门完整名称(如 总部/研发部/前端组)的进程内缓存
+"""
+import threading
+
+from django.db import connection
+
+from application import dispatch
+from dvadmin.system.models import Dept
+from dvadmin.utils.request_util import get_request_cache
+
+PATH_SEPARATOR = "/"
+
+_dept_path_cache = {}
+_dept_path_lock = threading.Lock()
+
+
+def build_dept_path_map():
+    """
+    一次查询所有部门,计算每个部门的完整名称
+    :return: {dept_id: "总部/研发部/前端组"}
+    """
+    dept_map = {dept_id: (name, parent_id) for dept_id, name, parent_id in Dept.objects.values_list(
+        "id", "name", "parent_id")}
+    path_map = {}
+    for dept_id in dept_map:
+        names, current, visited = [], dept_id, set()
+        while current in dept_map and current not in visited:
+            visited.add(current)
+            name, parent_id = dept_map[current]
+            if name:
+                names.append(name)
+            current = parent_id
+        names.reverse()
+        path_map[dept_id] = PATH_SEPARATOR.join(names)
+    return path_map
+
+
+def get_dept_path_map(request=None):
+    """
+    获取部门完整名称映射(进程内缓存),部门变化时通过部门版本号失效;
+    未启用进程内缓存时同一请求内只查询一次
+    :param request: 当前请求
+    :return: {dept_id: "总部/研发部/前端组"}
+    """
+    if not dispatch.is_process_cache_enabled():
+        return get_request_cache(request, "dept_path_map", build_dept_path_map)
+    schema_name = connection.tenant.schema_name if dispatch.is_tenants_mode() else None
+    version = dispatch.get_cache_version("dept")
+    cached = _dept_path_cache.get(schema_name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _dept_path_lock:
+        cached = _dept_path_cache.get(schema_name)
+        if cached is None or cached[0] != version:
+            cached = (version, build_dept_path_map())
+            _dept_path_cache[schema_name] = cached
+    return cached[1]
+
+
+def get_dept_full_name(dept_id, request=None):
+    """
+    获取部门完整名称
+    :param dept_id: 部门id
+    :param request: 当前请求, 列表逐行获取时须传入, 避免每行查询一次部门表
+    :return: 完整名称,部门不存在时返回空字符串
+    """
+    if not dept_id:
+        return ""
+    return get_dept_path_map(request).get(dept_id, "")
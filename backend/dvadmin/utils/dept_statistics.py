@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 部门用户统计: 分组聚合查询及可选的部门用户数计数缓存
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Q
+
+from application import dispatch
+from dvadmin.system.models import Dept, DeptClosure, Users
+
+# 统计项: 统计名称 -> 过滤条件
+STATISTICS_FIELDS = {
+    "total": None,
+    "male": Q(gender=1),
+    "female": Q(gender=2),
+    "unknown": Q(gender=0),
+}
+# 性别 -> 统计名称
+GENDER_STATISTICS = {1: "male", 2: "female", 0: "unknown"}
+
+
+def is_dept_counter_cache_enabled():
+    """
+    是否开启部门用户数计数缓存(settings.DEPT_USER_COUNTER_CACHE), 计数须存放在共享缓存中
+    :return:
+    """
+    return getattr(settings, "DEPT_USER_COUNTER_CACHE", False) and dispatch.is_process_cache_enabled()
+
+
+def _get_counter_key(dept_id, name):
+    schema_name = connection.tenant.schema_name if dispatch.is_tenants_mode() else ""
+    return f"dvadmin:dept_user_count:{schema_name}:{dept_id}:{name}"
+
+
+def _get_statistics_annotations():
+    return {
+        name: Count("id", filter=condition) if condition is not None else Count("id")
+        for name, condition in STATISTICS_FIELDS.items()
+    }
+
+
+def _empty_statistics():
+    return {name: 0 for name in STATISTICS_FIELDS}
+
+
+def get_dept_user_counter(dept_ids):
+    """
+    从计数缓存获取各部门(不含下级部门)的用户统计,缓存中没有的部门一次分组查询后写入缓存
+    :param dept_ids: 部门id列表
+    :return: {dept_id: {"total", "male", "female", "unknown"}}
+    """
+    keys = {_get_counter_key(dept_id, name): (dept_id, name) for dept_id in dept_ids for name in STATISTICS_FIELDS}
+    values = cache.get_many(list(keys))
+    result = {dept_id: _empty_statistics() for dept_id in dept_ids}
+    missing = set()
+    for key, (dept_id, name) in keys.items():
+        if key in values:
+            result[dept_id][name] = values[key]
+        else:
+            missing.add(dept_id)
+    if missing:
+        counter = {}
+        queryset = Users.objects.filter(dept_id__in=list(missing)).order_by().values("dept_id").annotate(
+            **_get_statistics_annotations())
+        for item in queryset:
+            result[item["dept_id"]] = {name: item[name] for name in STATISTICS_FIELDS}
+        for dept_id in missing:
+            counter.update({_get_counter_key(dept_id, name): result[dept_id][name] for name in STATISTICS_FIELDS})
+        cache.set_many(counter, getattr(settings, "DEPT_USER_COUNTER_CACHE_TIMEOUT", 60 * 60))
+    return result
+
+
+def update_dept_user_counter(dept_id, gender, delta):
+    """
+    增量更新部门用户数计数缓存,缓存中不存在时忽略(下次读取时重新统计)
+    :param dept_id: 部门id
+    :param gender: 性别
+    :param delta: 变化量,1或-1
+    :return:
+    """
+    if not dept_id:
+        return
+    for name in ("total", GENDER_STATISTICS.get(gender)):
+        if name is None:
+            continue
+        try:
+            cache.incr(_get_counter_key(dept_id, name), delta)
+        except ValueError:
+            pass
+
+
+def get_dept_statistics(dept_id, show_all=False):
+    """
+    部门统计: 部门用户数(按性别)及直接下级部门(含其所有下级)的用户数
+    :param dept_id: 部门id
+    :param show_all: 是否统计所有下级部门的用户
+    :return: {"dept": 部门, "statistics": {...}, "sub_dept_map": [{"name", "count"}]}
+    """
+    dept = Dept.objects.filter(id=dept_id).only("id", "name", "owner", "description").first()
+    if dept is None:
+        return None
+    # 直接下级部门及其所有下级部门
+    sub_dept_list = []
+    sub_dept_descendants = {}
+    for sub_dept_id, name, descendant_id in DeptClosure.objects.filter(
+            ancestor__parent_id=dept.id).order_by("ancestor__sort").values_list(
+            "ancestor_id", "ancestor__name", "descendant_id"):
+        if sub_dept_id not in sub_dept_descendants:
+            sub_dept_list.append((sub_dept_id, name))
+            sub_dept_descendants[sub_dept_id] = []
+        sub_dept_descendants[sub_dept_id].append(descendant_id)
+
+    if is_dept_counter_cache_enabled():
+        dept_ids = [dept.id] + [i for descendants in sub_dept_descendants.values() for i in descendants]
+        counter = get_dept_user_counter(dept_ids)
+        statistics = dict(counter[dept.id])
+        sub_dept_count = {}
+        for sub_dept_id, descendants in sub_dept_descendants.items():
+            sub_dept_count[sub_dept_id] = sum(counter[i]["total"] for i in descendants)
+            if show_all:
+                for i in descendants:
+                    for name in STATISTICS_FIELDS:
+                        statistics[name] += counter[i][name]
+    else:
+        if show_all:
+            users = Users.objects.filter(dept_id__in=Dept.get_descendant_ids(dept.id))
+        else:
+            users = Users.objects.filter(dept_id=dept.id)
+        statistics = users.aggregate(**_get_statistics_annotations())
+        # 按直接下级部门汇总其所有下级部门的用户数
+        sub_dept_count = dict(Users.objects.filter(
+            dept__ancestor_closure__ancestor__parent_id=dept.id
+        ).order_by().values_list("dept__ancestor_closure__ancestor_id").annotate(count=Count("id")))
+    return {
+        "dept": dept,
+        "statistics": statistics,
+        "sub_dept_map": [
+            {"name": name, "count": sub_dept_count.get(sub_dept_id, 0)} for sub_dept_id, name in sub_dept_list
+        ],
+    }
@@ -12,7 +12,7 @@ from collections import OrderedDict
 from functools import reduce
 
 import six
-from django.db import models
+from django.db import models, router
 from django.db.models import Q, F
 from django.db.models.constants import LOOKUP_SEP
 from django_filters import utils, FilterSet
@@ -20,10 +20,26 @@ from django_filters.constants import ALL_FIELDS
 from django_filters.filters import CharFilter, DateTimeFromToRangeFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from django_filters.utils import get_model_field
-from rest_framework.filters import BaseFilterBackend
+from rest_framework.filters import BaseFilterBackend, SearchFilter
 from django_filters.conf import settings
-from dvadmin.system.models import Dept, ApiWhiteList, RoleMenuButtonPermission
+from dvadmin.system.models import Dept, DeptClosure
+from dvadmin.utils.authentication import get_user_role_ids
+from dvadmin.utils.data_scope import data_scope_cache, get_data_scope_filter, DATA_SCOPE_ALL, DATA_SCOPE_SELF
 from dvadmin.utils.models import CoreModel
+from dvadmin.utils.search_index import get_search_index, search_queryset
+from timezone_field import TimeZoneField
+
+# 自动生成的 AutoFilterSet 缓存: (视图类, 模型, filter_fields) -> AutoFilterSet
+_auto_filterset_cache = {}
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
 
 class CoreModelFilterBankend(BaseFilterBackend):
     """
@@ -58,21 +74,13 @@ class CoreModelFilterBankend(BaseFilterBackend):
 
 def get_dept(dept_id: int, dept_all_list=None, dept_list=None):
     """
-    递归获取部门的所有下级部门
+    获取部门的所有下级部门(含自身),通过部门闭包表一次查询
     :param dept_id: 需要获取的部门id
-    :param dept_all_list: 所有部门列表
-    :param dept_list: 递归部门list
+    :param dept_all_list: 兼容旧版本参数,已不再使用
+    :param dept_list: 兼容旧版本参数,已不再使用
     :return:
     """
-    if not dept_all_list:
-        dept_all_list = Dept.objects.all().values("id", "parent")
-    if dept_list is None:
-        dept_list = [dept_id]
-    for ele in dept_all_list:
-        if ele.get("parent") == dept_id:
-            dept_list.append(ele.get("id"))
-            get_dept(ele.get("id"), dept_all_list, dept_list)
-    return list(set(dept_list))
+    return Dept.recursion_all_dept(dept_id)
 
 
 class DataLevelPermissionsFilter(BaseFilterBackend):
@@ -97,23 +105,8 @@ class DataLevelPermissionsFilter(BaseFilterBackend):
         methodList = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
         method = methodList.index(method)
         # ***接口白名单***
-        api_white_list = ApiWhiteList.objects.filter(enable_datasource=False).values(
-            permission__api=F("url"), permission__method=F("method")
-        )
-        api_white_list = [
-            str(item.get("permission__api").replace("{id}", ".*?"))
-            + ":"
-            + str(item.get("permission__method"))
-            for item in api_white_list
-            if item.get("permission__api")
-        ]
-        for item in api_white_list:
-            new_api = f"{api}:{method}"
-            matchObj = re.match(item, new_api, re.M | re.I)
-            if matchObj is None:
-                continue
-            else:
-                return queryset
+        if data_scope_cache.is_white_list(api, method):
+            return queryset
         """
         判断是否为超级管理员:
         如果不是超级管理员,则进入下一步权限判断
@@ -148,53 +141,29 @@ class DataLevelPermissionsFilter(BaseFilterBackend):
         _pk = request.parser_context["kwargs"].get('pk')
         if _pk: # 判断是否是单例查询
             re_api = re.sub(_pk,'{id}', api)
-        role_id_list = request.user.role.values_list('id', flat=True)
-        role_permission_list=RoleMenuButtonPermission.objects.filter(
-            role__in=role_id_list,
-            role__status=1,
-            menu_button__api=re_api,
-            menu_button__method=method).values(
-            'data_range'
-        )
-        dataScope_list = []  # 权限范围列表
-        for ele in role_permission_list:
-                # 判断用户是否为超级管理员角色/如果拥有[全部数据权限]则返回所有数据
-            if ele.get("data_range") == 3:
-                return queryset
-            dataScope_list.append(ele.get("data_range"))
-        dataScope_list = list(set(dataScope_list))
+        role_id_list = get_user_role_ids(request.user)
+        data_scope, data_ranges = data_scope_cache.get(user_dept_id, role_id_list, re_api, method)
+        # 拥有[全部数据权限]则返回所有数据
+        if data_scope == DATA_SCOPE_ALL:
+            return queryset
 
         # 4. 只为仅本人数据权限时只返回过滤本人数据，并且部门为自己本部门(考虑到用户会变部门，只能看当前用户所在的部门数据)
-        if 0 in dataScope_list:
+        if data_scope == DATA_SCOPE_SELF:
             return queryset.filter(
                 creator=request.user, dept_belong_id=user_dept_id
             )
 
-        # 5. 自定数据权限 获取部门，根据部门过滤
-        dept_list = []
-        for ele in dataScope_list:
-            if ele == 1:
-                dept_list.append(user_dept_id)
-                dept_list.extend(
-                    get_dept(
-                        user_dept_id,
-                    )
-                )
-            elif ele == 2:
-                dept_list.append(user_dept_id)
-            elif ele == 4:
-                dept_ids = RoleMenuButtonPermission.objects.filter(
-                    role__in=role_id_list,
-                    role__status=1,
-                    data_range=4).values_list(
-                    'dept__id',flat=True
-                )
-                dept_list.extend(
-                    dept_ids
-                )
+        # 5. 自定数据权限 获取部门，根据部门过滤(以子查询过滤,不展开部门id列表;
+        # 数据在其他数据库(如独立日志数据库)时无法关联部门闭包表, 在部门所在数据库查询出部门id列表)
+        subquery = queryset.db == router.db_for_read(DeptClosure)
         if queryset.model._meta.model_name == 'dept':
-            return queryset.filter(id__in=list(set(dept_list)))
-        return queryset.filter(dept_belong_id__in=list(set(dept_list)))
+            condition = get_data_scope_filter("id", user_dept_id, role_id_list, data_ranges)
+        else:
+            condition = get_data_scope_filter("dept_belong_id", user_dept_id, role_id_list, data_ranges,
+                                              output_field=models.CharField(), subquery=subquery)
+        if condition is None:
+            return queryset.none()
+        return queryset.filter(condition)
 
 
 class CustomDjangoFilterBackend(DjangoFilterBackend):
@@ -270,159 +239,205 @@ class CustomDjangoFilterBackend(DjangoFilterBackend):
             return filterset_class
 
         if filterset_fields and queryset is not None:
-            MetaBase = getattr(self.filterset_base, "Meta", object)
-
-            class AutoFilterSet(self.filterset_base):
-                @classmethod
-                def get_all_model_fields(cls, model):
-                    opts = model._meta
-
-                    return [
-                        f.name
-                        for f in sorted(opts.fields + opts.many_to_many)
-                        if (f.name == "id")
-                        or not isinstance(f, models.AutoField)
-                        and not (getattr(f.remote_field, "parent_link", False))
-                    ]
-
-                @classmethod
-                def get_fields(cls):
-                    """
-                    Resolve the 'fields' argument that should be used for generating filters on the
-                    filterset. This is 'Meta.fields' sans the fields in 'Meta.exclude'.
-                    """
-                    model = cls._meta.model
-                    fields = cls._meta.fields
-                    exclude = cls._meta.exclude
-
-                    assert not (fields is None and exclude is None), (
-                        "Setting 'Meta.model' without either 'Meta.fields' or 'Meta.exclude' "
-                        "has been deprecated since 0.15.0 and is now disallowed. Add an explicit "
-                        "'Meta.fields' or 'Meta.exclude' to the %s class." % cls.__name__
-                    )
-
-                    # Setting exclude with no fields implies all other fields.
-                    if exclude is not None and fields is None:
-                        fields = ALL_FIELDS
-
-                    # Resolve ALL_FIELDS into all fields for the filterset's model.
-                    if fields == ALL_FIELDS:
-                        fields = cls.get_all_model_fields(model)
-
-                    # Remove excluded fields
-                    exclude = exclude or []
-                    if not isinstance(fields, dict):
-                        fields = [(f, [settings.DEFAULT_LOOKUP_EXPR]) for f in fields if f not in exclude]
-                    else:
-                        fields = [(f, lookups) for f, lookups in fields.items() if f not in exclude]
-
-                    return OrderedDict(fields)
-
-                @classmethod
-                def get_filters(cls):
-                    """
-                    Get all filters for the filterset. This is the combination of declared and
-                    generated filters.
-                    """
-
-                    # No model specified - skip filter generation
-                    if not cls._meta.model:
-                        return cls.declared_filters.copy()
-
-                    # Determine the filters that should be included on the filterset.
-                    filters = OrderedDict()
-                    fields = cls.get_fields()
-                    undefined = []
-
-                    for field_name, lookups in fields.items():
-                        field = get_model_field(cls._meta.model, field_name)
-                        from django.db import models
-                        from timezone_field import TimeZoneField
-
-                        # 不进行 过滤的model 类
-                        if isinstance(field, (models.JSONField, TimeZoneField)):
-                            continue
-                        # warn if the field doesn't exist.
-                        if field is None:
-                            undefined.append(field_name)
-                        # 更新默认字符串搜索为模糊搜索
-                        if (
-                            isinstance(field, (models.CharField))
-                            and filterset_fields == "__all__"
-                            and lookups == ["exact"]
-                        ):
-                            lookups = ["icontains"]
-                        for lookup_expr in lookups:
-                            filter_name = cls.get_filter_name(field_name, lookup_expr)
-
-                            # If the filter is explicitly declared on the class, skip generation
-                            if filter_name in cls.declared_filters:
-                                filters[filter_name] = cls.declared_filters[filter_name]
-                                continue
-
-                            if field is not None:
-                                filters[filter_name] = cls.filter_for_field(field, field_name, lookup_expr)
-
-                    # Allow Meta.fields to contain declared filters *only* when a list/tuple
-                    if isinstance(cls._meta.fields, (list, tuple)):
-                        undefined = [f for f in undefined if f not in cls.declared_filters]
-
-                    if undefined:
-                        raise TypeError(
-                            "'Meta.fields' must not contain non-model field names: %s" % ", ".join(undefined)
-                        )
-
-                    # Add in declared filters. This is necessary since we don't enforce adding
-                    # declared filters to the 'Meta.fields' option
-                    filters.update(cls.declared_filters)
-                    return filters
-
-                class Meta(MetaBase):
-                    model = queryset.model
-                    fields = filterset_fields
-
-            return AutoFilterSet
+            cache_key = (view.__class__, queryset.model, _freeze(self.filter_fields), _freeze(filterset_fields))
+            filterset_class = _auto_filterset_cache.get(cache_key)
+            if filterset_class is None:
+                filterset_class = self.build_filterset_class(queryset.model, filterset_fields)
+                _auto_filterset_cache[cache_key] = filterset_class
+            return filterset_class
 
         return None
 
-    def filter_queryset(self, request, queryset, view):
-        filterset = self.get_filterset(request, queryset, view)
-        if filterset is None:
-            return queryset
-        if filterset.__class__.__name__ == "AutoFilterSet":
-            queryset = filterset.queryset
-            filter_fields = filterset.filters if self.filter_fields == "__all__" else self.filter_fields
-            orm_lookup_dict = dict(
-                zip(
-                    [field for field in filter_fields],
-                    [filterset.filters[lookup].lookup_expr for lookup in filterset.filters.keys()],
+    def build_filterset_class(self, filterset_model, filterset_fields):
+        """
+        根据 filter_fields 生成 AutoFilterSet, 并预先计算查询参数到 orm 查询条件的映射 orm_lookup_map
+        :param filterset_model: 模型
+        :param filterset_fields: 过滤字段
+        :return:
+        """
+        MetaBase = getattr(self.filterset_base, "Meta", object)
+
+        class AutoFilterSet(self.filterset_base):
+            @classmethod
+            def get_all_model_fields(cls, model):
+                opts = model._meta
+
+                return [
+                    f.name
+                    for f in sorted(opts.fields + opts.many_to_many)
+                    if (f.name == "id")
+                    or not isinstance(f, models.AutoField)
+                    and not (getattr(f.remote_field, "parent_link", False))
+                ]
+
+            @classmethod
+            def get_fields(cls):
+                """
+                Resolve the 'fields' argument that should be used for generating filters on the
+                filterset. This is 'Meta.fields' sans the fields in 'Meta.exclude'.
+                """
+                model = cls._meta.model
+                fields = cls._meta.fields
+                exclude = cls._meta.exclude
+
+                assert not (fields is None and exclude is None), (
+                    "Setting 'Meta.model' without either 'Meta.fields' or 'Meta.exclude' "
+                    "has been deprecated since 0.15.0 and is now disallowed. Add an explicit "
+                    "'Meta.fields' or 'Meta.exclude' to the %s class." % cls.__name__
                 )
+
+                # Setting exclude with no fields implies all other fields.
+                if exclude is not None and fields is None:
+                    fields = ALL_FIELDS
+
+                # Resolve ALL_FIELDS into all fields for the filterset's model.
+                if fields == ALL_FIELDS:
+                    fields = cls.get_all_model_fields(model)
+
+                # Remove excluded fields
+                exclude = exclude or []
+                if not isinstance(fields, dict):
+                    fields = [(f, [settings.DEFAULT_LOOKUP_EXPR]) for f in fields if f not in exclude]
+                else:
+                    fields = [(f, lookups) for f, lookups in fields.items() if f not in exclude]
+
+                return OrderedDict(fields)
+
+            @classmethod
+            def get_filters(cls):
+                """
+                Get all filters for the filterset. This is the combination of declared and
+                generated filters.
+                """
+
+                # No model specified - skip filter generation
+                if not cls._meta.model:
+                    return cls.declared_filters.copy()
+
+                # Determine the filters that should be included on the filterset.
+                filters = OrderedDict()
+                fields = cls.get_fields()
+                undefined = []
+
+                for field_name, lookups in fields.items():
+                    field = get_model_field(cls._meta.model, field_name)
+                    # 不进行 过滤的model 类
+                    if isinstance(field, (models.JSONField, TimeZoneField)):
+                        continue
+                    # warn if the field doesn't exist.
+                    if field is None:
+                        undefined.append(field_name)
+                    # 更新默认字符串搜索为模糊搜索
+                    if (
+                        isinstance(field, (models.CharField))
+                        and filterset_fields == "__all__"
+                        and lookups == ["exact"]
+                    ):
+                        lookups = ["icontains"]
+                    for lookup_expr in lookups:
+                        filter_name = cls.get_filter_name(field_name, lookup_expr)
+
+                        # If the filter is explicitly declared on the class, skip generation
+                        if filter_name in cls.declared_filters:
+                            filters[filter_name] = cls.declared_filters[filter_name]
+                            continue
+
+                        if field is not None:
+                            filters[filter_name] = cls.filter_for_field(field, field_name, lookup_expr)
+
+                # Allow Meta.fields to contain declared filters *only* when a list/tuple
+                if isinstance(cls._meta.fields, (list, tuple)):
+                    undefined = [f for f in undefined if f not in cls.declared_filters]
+
+                if undefined:
+                    raise TypeError(
+                        "'Meta.fields' must not contain non-model field names: %s" % ", ".join(undefined)
+                    )
+
+                # Add in declared filters. This is necessary since we don't enforce adding
+                # declared filters to the 'Meta.fields' option
+                filters.update(cls.declared_filters)
+                return filters
+
+            class Meta(MetaBase):
+                model = filterset_model
+                fields = filterset_fields
+
+        AutoFilterSet.orm_lookup_map = self.get_orm_lookup_map(AutoFilterSet.base_filters)
+        return AutoFilterSet
+
+    def get_orm_lookup_map(self, filters):
+        """
+        计算查询参数到 orm 查询条件的映射, 如 {"name": "name__icontains"}
+        :param filters: AutoFilterSet 的过滤器
+        :return:
+        """
+        filter_fields = filters if self.filter_fields == "__all__" else self.filter_fields
+        orm_lookup_dict = dict(
+            zip(
+                [field for field in filter_fields],
+                [filters[lookup].lookup_expr for lookup in filters.keys()],
             )
-            orm_lookups = [
-                self.construct_search(lookup, lookup_expr) for lookup, lookup_expr in orm_lookup_dict.items()
-            ]
-            # print(orm_lookups)
-            conditions = []
+        )
+        orm_lookups = [
+            self.construct_search(lookup, lookup_expr) for lookup, lookup_expr in orm_lookup_dict.items()
+        ]
+        orm_lookup_map = {}
+        for lookup in orm_lookups:
+            search_term_key = LOOKUP_SEP.join(lookup.split(LOOKUP_SEP)[:-1]) if len(
+                lookup.split(LOOKUP_SEP)) > 1 else lookup
+            # 与 find_filter_lookups 一致, 同名参数取第一个
+            orm_lookup_map.setdefault(search_term_key, lookup)
+        return orm_lookup_map
+
+    def filter_queryset(self, request, queryset, view):
+        filterset_class = self.get_filterset_class(view, queryset)
+        orm_lookup_map = getattr(filterset_class, "orm_lookup_map", None)
+        if orm_lookup_map is not None:
+            # AutoFilterSet: 无需实例化过滤器, 每个查询参数一次字典查找
+            data = request.query_params
             queries = []
-            for search_term_key in filterset.data.keys():
-                orm_lookup = self.find_filter_lookups(orm_lookups, search_term_key)
-                if not orm_lookup or filterset.data.get(search_term_key) == '':
+            for search_term_key in data.keys():
+                orm_lookup = orm_lookup_map.get(search_term_key)
+                if not orm_lookup or data.get(search_term_key) == '':
                     continue
-                filterset_data_len = len(filterset.data.getlist(search_term_key))
-                if filterset_data_len == 1:
-                    query = Q(**{orm_lookup: filterset.data[search_term_key]})
-                    queries.append(query)
+                filterset_data_len = len(data.getlist(search_term_key))
+                if orm_lookup.endswith(LOOKUP_SEP + "search"):
+                    # "@"前缀: 使用全文搜索索引
+                    queryset = search_queryset(queryset, [search_term_key], data[search_term_key])
+                elif filterset_data_len == 1:
+                    queries.append(Q(**{orm_lookup: data[search_term_key]}))
                 elif filterset_data_len == 2:
-                    orm_lookup += '__range'
-                    query = Q(**{orm_lookup: filterset.data.getlist(search_term_key)})
-                    queries.append(query)
+                    queries.append(Q(**{f'{search_term_key}__range': data.getlist(search_term_key)}))
             if len(queries) > 0:
-                conditions.append(reduce(operator.and_, queries))
-                queryset = queryset.filter(reduce(operator.and_, conditions))
-                return queryset
-            else:
-                return queryset
+                return queryset.filter(reduce(operator.and_, queries))
+            return queryset
 
+        filterset = self.get_filterset(request, queryset, view)
+        if filterset is None:
+            return queryset
         if not filterset.is_valid() and self.raise_exception:
             raise utils.translate_validation(filterset.errors)
         return filterset.qs
+
+
+class CustomSearchFilter(SearchFilter):
+    """
+    搜索过滤器: 模型注册了搜索索引且search_fields均在索引中(无前缀或"@"前缀)时使用全文搜索索引,
+    避免跨表 icontains 及 DISTINCT; 否则使用 DRF 默认的 SearchFilter
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        search_index = get_search_index(queryset.model)
+        if not search_fields or not search_terms or search_index is None:
+            return super().filter_queryset(request, queryset, view)
+        if any(field[0] in self.lookup_prefixes and field[0] != "@" for field in search_fields):
+            return super().filter_queryset(request, queryset, view)
+        fields = [field.lstrip("@") for field in search_fields]
+        if not all(search_index.can_search(fields, term) for term in search_terms):
+            return super().filter_queryset(request, queryset, view)
+        for term in search_terms:
+            queryset = search_index.filter(queryset, fields, term)
+        return queryset
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: IP 地理位置解析: 可选远程接口或本地离线库(mmap + 二分查找), 查询结果进程内 LRU 缓存(functools.lru_cache)
+"""
+import csv
+import ipaddress
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from functools import lru_cache
+
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# 地理位置字段, 与登录日志字段一致
+GEOLOCATION_FIELDS = ["continent", "country", "province", "city", "district", "isp", "area_code", "country_english",
+                      "country_code", "longitude", "latitude"]
+
+
+def get_empty_geolocation():
+    return {field: "" for field in GEOLOCATION_FIELDS}
+
+
+class IPGeolocationProvider:
+    """
+    IP 地理位置解析基类, lookup 返回地理位置字典, 无法解析(如网络错误)时返回None;
+    blocking 为True(如网络请求)时, 登录日志先写入, 再由后台线程解析后补充地理位置
+    """
+    blocking = False
+
+    def lookup(self, ip):
+        raise NotImplementedError
+
+
+class RemoteIPGeolocationProvider(IPGeolocationProvider):
+    """
+    远程接口解析: https://ip.django-vue-admin.com, 请求失败后 retry_interval 秒内不再请求, 避免接口不可用时逐个等待超时
+    """
+    url = "https://ip.django-vue-admin.com/ip/analysis"
+    blocking = True
+
+    def __init__(self, timeout=None, retry_interval=None):
+        self.timeout = timeout or getattr(settings, "IP_GEOLOCATION_TIMEOUT", 1)
+        self.retry_interval = getattr(settings, "IP_GEOLOCATION_RETRY_INTERVAL", 60) if retry_interval is None \
+            else retry_interval
+        self._unavailable_until = 0
+
+    def lookup(self, ip):
+        if time.monotonic() < self._unavailable_until:
+            return None
+        try:
+            res = requests.get(url=self.url, params={"ip": ip}, timeout=self.timeout)
+            if res.status_code == 200:
+                res_data = res.json()
+                if res_data.get('code') == 0:
+                    return {**get_empty_geolocation(), **(res_data.get('data') or {})}
+        except Exception as e:
+            logger.warning(f"IP地理位置解析失败: {ip} {e}")
+            self._unavailable_until = time.monotonic() + self.retry_interval
+        return None
+
+
+class LocalIPGeolocationProvider(IPGeolocationProvider):
+    """
+    本地离线库解析(仅IPv4), 库文件由 python manage.py build_ip_database 生成, 文件结构:
+    (1)文件头: 标识 DVIP + 版本号 + IP段数量
+    (2)索引区: 按起始IP排序的定长记录(起始IP, 结束IP, 数据偏移, 数据长度), 通过 mmap 二分查找
+    (3)数据区: 以 \\t 分隔的地理位置字段(UTF-8), 相同地理位置只存一份
+    """
+    magic = b"DVIP"
+    version = 1
+    header = struct.Struct(">4sII")
+    record = struct.Struct(">IIIH")
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, "IP_GEOLOCATION_DB", None)
+        self._mmap = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self._mmap is None:
+            with self._lock:
+                if self._mmap is None:
+                    with open(self.path, "rb") as file:
+                        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                    magic, version, count = self.header.unpack_from(buffer, 0)
+                    if magic != self.magic or version != self.version:
+                        buffer.close()
+                        raise ValueError(f"IP地理位置库文件格式错误: {self.path}")
+                    self._count = count
+                    self._mmap = buffer
+        return self._mmap
+
+    def lookup(self, ip):
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version != 4:
+            return get_empty_geolocation()
+        buffer = self._open()
+        value = int(address)
+        low, high = 0, self._count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            start, end, offset, length = self.record.unpack_from(
+                buffer, self.header.size + middle * self.record.size)
+            if value < start:
+                high = middle - 1
+            elif value > end:
+                low = middle + 1
+            else:
+                values = buffer[offset:offset + length].decode("utf-8").split("\t")
+                return dict(zip(GEOLOCATION_FIELDS, values))
+        return get_empty_geolocation()
+
+    @classmethod
+    def build(cls, source, target):
+        """
+        由CSV生成库文件, CSV每行为: 起始IP,结束IP,continent,country,province,city,...(同 GEOLOCATION_FIELDS 顺序)
+        :param source: CSV文件路径
+        :param target: 库文件路径
+        :return: IP段数量
+        """
+        ranges = []
+        with open(source, encoding="utf-8", newline="") as file:
+            for row in csv.reader(file):
+                if not row or row[0].startswith("#"):
+                    continue
+                try:
+                    start, end = int(ipaddress.IPv4Address(row[0].strip())), int(ipaddress.IPv4Address(row[1].strip()))
+                except ValueError:
+                    # 表头或IPv6
+                    continue
+                values = [value.strip().replace("\t", " ") for value in row[2:2 + len(GEOLOCATION_FIELDS)]]
+                values += [""] * (len(GEOLOCATION_FIELDS) - len(values))
+                ranges.append((start, end, "\t".join(values).encode("utf-8")))
+        ranges.sort()
+        data_start = cls.header.size + len(ranges) * cls.record.size
+        offsets, data = {}, bytearray()
+        for _, _, value in ranges:
+            if value not in offsets:
+                offsets[value] = data_start + len(data)
+                data += value
+        with open(target, "wb") as file:
+            file.write(cls.header.pack(cls.magic, cls.version, len(ranges)))
+            for start, end, value in ranges:
+                file.write(cls.record.pack(start, end, offsets[value], len(value)))
+            file.write(data)
+        return len(ranges)
+
+
+IP_GEOLOCATION_PROVIDERS = {
+    "remote": RemoteIPGeolocationProvider,
+    "local": LocalIPGeolocationProvider,
+}
+
+_providers = {}
+
+
+def get_ip_geolocation_provider(provider=None):
+    """
+    获取IP地理位置解析器(进程内单例)
+    :param provider: 名称(remote|local)、类或其导入路径, 默认 settings.IP_GEOLOCATION_PROVIDER
+    :return: IPGeolocationProvider
+    """
+    provider = provider or getattr(settings, "IP_GEOLOCATION_PROVIDER", "remote")
+    if provider not in _providers:
+        klass = provider
+        if isinstance(provider, str):
+            klass = IP_GEOLOCATION_PROVIDERS.get(provider) or import_string(provider)
+        _providers[provider] = klass()
+    return _providers[provider]
+
+
+@lru_cache(maxsize=getattr(settings, "IP_GEOLOCATION_CACHE_SIZE", 10000))
+def lookup_ip_geolocation(ip, provider):
+    """
+    解析IP地理位置, 结果按 (IP, 解析方式) LRU 缓存(命中情况见 lookup_ip_geolocation.cache_info());
+    解析失败时抛出 LookupError, 不缓存
+    :param ip:
+    :param provider: 解析方式, 同 get_ip_geolocation_provider
+    :return: 地理位置字典
+    """
+    data = get_ip_geolocation_provider(provider).lookup(ip)
+    if data is None:
+        raise LookupError(f"IP地理位置解析失败: {ip}")
+    return data
+
+
+def is_ip_geolocation_required(ip):
+    """
+    是否需要解析IP地理位置: 已开启 ENABLE_LOGIN_ANALYSIS_LOG 且为公网IP
+    :param ip:
+    :return:
+    """
+    if not ip or ip == 'unknown' or not getattr(settings, 'ENABLE_LOGIN_ANALYSIS_LOG', True):
+        return False
+    try:
+        return not ipaddress.ip_address(ip).is_private
+    except ValueError:
+        return False
+
+
+def get_ip_geolocation(ip):
+    """
+    获取IP地理位置, 内网IP、未开启 ENABLE_LOGIN_ANALYSIS_LOG 或解析失败时各字段为空
+    :param ip:
+    :return: {continent, country, province, ...}
+    """
+    if not is_ip_geolocation_required(ip):
+        return get_empty_geolocation()
+    try:
+        return dict(lookup_ip_geolocation(ip, getattr(settings, "IP_GEOLOCATION_PROVIDER", "remote")))
+    except LookupError:
+        pass
+    except (OSError, ValueError) as e:
+        # 本地库文件不存在或损坏
+        logger.warning(f"IP地理位置解析失败: {ip} {e}")
+    return get_empty_geolocation()
+
+
+def get_ip_geolocation_cache_info():
+    """
+    获取IP地理位置缓存的命中情况
+    :return: CacheInfo(hits, misses, maxsize, currsize)
+    """
+    return lookup_ip_geolocation.cache_info()
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 日志保留与归档: 超过保留天数的操作日志/登录日志按天写入 gzip 压缩的 NDJSON 归档文件后从数据库删除;
+MySQL 下可将日志表改为按月 RANGE 分区表, 归档后删除过期分区; 归档数据可按日期范围查询
+"""
+import datetime
+import gzip
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections, router, transaction
+from django.db.models import Min
+from django.utils import timezone
+from rest_framework.decorators import action
+
+from application import dispatch
+from dvadmin.utils.json_response import DetailResponse, ErrorResponse, SuccessResponse
+
+logger = logging.getLogger(__name__)
+
+
+def get_archive_models():
+    """
+    参与归档的日志模型
+    :return: {名称: 模型}
+    """
+    from dvadmin.system.models import OperationLog, LoginLog
+    return {"operation_log": OperationLog, "login_log": LoginLog}
+
+
+def get_connection(model):
+    """
+    获取日志模型所在数据库的连接(配置了独立日志数据库时为日志数据库)
+    :param model:
+    :return:
+    """
+    return connections[router.db_for_write(model)]
+
+
+def get_cutoff(days=None):
+    """
+    获取归档截止时间: 保留天数前的零点, 早于该时间的日志将被归档
+    :param days: 保留天数, 为None时使用 settings.LOG_RETENTION_DAYS
+    :return: datetime
+    """
+    if days is None:
+        days = getattr(settings, "LOG_RETENTION_DAYS", 180)
+    now = timezone.localtime() if settings.USE_TZ else timezone.now()
+    return now.replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=days)
+
+
+def get_archive_dir(model):
+    """
+    获取模型的归档目录: LOG_ARCHIVE_DIR/<租户schema>/<表名>
+    归档目录不能位于 MEDIA_ROOT 下(媒体文件无需鉴权即可访问), 否则抛出 ImproperlyConfigured
+    :param model:
+    :return:
+    """
+    default_dir = os.path.join(settings.BASE_DIR, "logs", "archive")
+    archive_dir = os.path.abspath(getattr(settings, "LOG_ARCHIVE_DIR", default_dir))
+    media_root = os.path.abspath(settings.MEDIA_ROOT)
+    if archive_dir == media_root or archive_dir.startswith(media_root + os.sep):
+        raise ImproperlyConfigured("LOG_ARCHIVE_DIR 不能位于 MEDIA_ROOT 下")
+    schema_name = connection.tenant.schema_name if dispatch.is_tenants_mode() else "public"
+    return os.path.join(archive_dir, schema_name, model._meta.db_table)
+
+
+def get_archive_path(model, day):
+    return os.path.join(get_archive_dir(model), f"{day.isoformat()}.ndjson.gz")
+
+
+def get_row_date(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
+# ================================================= #
+# ************** 归档 ************** #
+# ================================================= #
+
+def write_archive(model, rows):
+    """
+    将日志数据按创建日期追加写入归档文件(每次追加为一个独立的 gzip member)
+    :param model:
+    :param rows: values() 形式的日志数据
+    :return:
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(get_row_date(row["create_datetime"]), []).append(row)
+    os.makedirs(get_archive_dir(model), exist_ok=True)
+    for day, items in groups.items():
+        with gzip.open(get_archive_path(model, day), "at", encoding="utf-8") as file:
+            file.writelines(json.dumps(item, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n" for item in items)
+
+
+def archive_expired_logs(model, cutoff, chunk_size=None):
+    """
+    分批归档早于截止时间的日志: 先写入归档文件, 再删除已归档的数据;
+    写入后删除前中断时, 重新执行会重复写入, 读取归档时按id去重
+    :param model: 日志模型
+    :param cutoff: 截止时间
+    :param chunk_size: 每批条数
+    :return: 归档条数
+    """
+    chunk_size = chunk_size or getattr(settings, "LOG_ARCHIVE_CHUNK_SIZE", 5000)
+    queryset = model.objects.filter(create_datetime__lt=cutoff).order_by("create_datetime", "id")
+    total = 0
+    while True:
+        rows = list(queryset.values()[:chunk_size])
+        if not rows:
+            break
+        write_archive(model, rows)
+        with transaction.atomic(using=router.db_for_write(model)):
+            model.objects.filter(id__in=[row["id"] for row in rows]).delete()
+        total += len(rows)
+    return total
+
+
+# ================================================= #
+# ************** 归档查询 ************** #
+# ================================================= #
+
+def get_archived_dates(model):
+    """
+    获取已归档的日期列表
+    :param model:
+    :return: ["2024-01-01", ...]
+    """
+    directory = get_archive_dir(model)
+    if not os.path.isdir(directory):
+        return []
+    return sorted((name[:-len(".ndjson.gz")] for name in os.listdir(directory) if name.endswith(".ndjson.gz")),
+                  reverse=True)
+
+
+def read_archived_logs(model, start_date, end_date):
+    """
+    读取日期范围内的归档日志, 按id去重, 按创建时间倒序
+    :param model:
+    :param start_date: 开始日期(含)
+    :param end_date: 结束日期(含)
+    :return: [dict]
+    """
+    rows = {}
+    day = start_date
+    while day <= end_date:
+        path = get_archive_path(model, day)
+        day += datetime.timedelta(days=1)
+        if not os.path.exists(path):
+            continue
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                for line in file:
+                    if line.strip():
+                        row = json.loads(line)
+                        rows[row["id"]] = row
+        except (EOFError, OSError, ValueError):
+            # 写入中断导致文件末尾不完整时, 保留已读取的数据
+            logger.warning(f"归档文件 {path} 不完整, 已读取 {len(rows)} 条")
+    return sorted(rows.values(), key=lambda row: (row.get("create_datetime") or "", row["id"]), reverse=True)
+
+
+class ArchivedLogMixin:
+    """
+    归档日志查询: GET archive/?start_date=2024-01-01&end_date=2024-01-31&page=1&limit=20
+    (1)未传日期时返回已归档的日期列表
+    (2)日期范围最多 archive_max_days 天
+    """
+    archive_max_days = 31
+
+    @action(methods=["get"], detail=False)
+    def archive(self, request, *args, **kwargs):
+        model = self.get_queryset().model
+        start_date = request.query_params.get("start_date")
+        end_date = request.query_params.get("end_date") or start_date
+        if not start_date:
+            return DetailResponse(data=get_archived_dates(model), msg="获取成功")
+        try:
+            start_date = datetime.date.fromisoformat(start_date)
+            end_date = datetime.date.fromisoformat(end_date)
+        except ValueError:
+            return ErrorResponse(msg="日期格式错误, 应为 YYYY-MM-DD")
+        if end_date < start_date or (end_date - start_date).days >= self.archive_max_days:
+            return ErrorResponse(msg=f"日期范围须在 {self.archive_max_days} 天以内")
+        rows = read_archived_logs(model, start_date, end_date)
+        page = request.query_params.get("page", "1")
+        limit = request.query_params.get("limit", "20")
+        page = int(page) if page.isdigit() and int(page) > 0 else 1
+        limit = min(int(limit), 999) if limit.isdigit() and int(limit) > 0 else 20
+        return SuccessResponse(data=rows[(page - 1) * limit:page * limit], msg="获取成功", page=page, limit=limit,
+                               total=len(rows))
+
+
+# ================================================= #
+# ************** MySQL 分区 ************** #
+# ================================================= #
+
+def to_days(day):
+    """
+    与 MySQL TO_DAYS() 一致的天数
+    :param day: date
+    :return: int
+    """
+    return day.toordinal() + 365
+
+
+def next_month(day):
+    return (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def get_partitions(model):
+    """
+    获取表的分区, 非分区表返回空列表
+    :param model:
+    :return: [(分区名, 分区上界 TO_DAYS 值或 MAXVALUE)]
+    """
+    db_connection = get_connection(model)
+    if db_connection.vendor != "mysql":
+        return []
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION", [model._meta.db_table])
+        return list(cursor.fetchall())
+
+
+def get_partition_sql(start, end):
+    """
+    生成 [start, end) 月份的分区定义
+    :param start: 开始月份第一天
+    :param end: 结束月份第一天
+    :return: [分区定义]
+    """
+    items = []
+    while start < end:
+        upper = next_month(start)
+        items.append(f"PARTITION p{start:%Y%m} VALUES LESS THAN ({to_days(upper)})")
+        start = upper
+    return items
+
+
+def partition_table(model, months_ahead=None):
+    """
+    将日志表改为按月 RANGE 分区表(仅 MySQL, 其他数据库保持普通表):
+    分区字段须包含在主键中, 主键改为 (id, create_datetime), create_datetime 改为非空
+    注意: 该 DDL 直接修改表结构, 模型及迁移文件不会体现(Django 不支持联合主键), 分区后数据库与模型存在差异:
+    (1)模型中主键仍为 id, create_datetime 仍为 null=True, 写入时须设置 create_datetime(日志写入时已自动设置)
+    (2)之后生成的迁移若修改这两个字段(AlterField), 执行前须人工核对, 否则会覆盖分区所需的表结构或执行失败
+    (3)配置了独立日志数据库时修改的是日志数据库中的表
+    :param model:
+    :param months_ahead: 预建未来月份分区数
+    :return: 是否执行了分区
+    """
+    db_connection = get_connection(model)
+    if db_connection.vendor != "mysql" or get_partitions(model):
+        return False
+    months_ahead = months_ahead or getattr(settings, "LOG_PARTITION_MONTHS_AHEAD", 3)
+    table = db_connection.ops.quote_name(model._meta.db_table)
+    today = timezone.now().date()
+    first = model.objects.aggregate(first=Min("create_datetime"))["first"]
+    start = (get_row_date(first) if first else today).replace(day=1)
+    end = next_month(today)
+    for _ in range(months_ahead):
+        end = next_month(end)
+    partitions = get_partition_sql(start, end) + ["PARTITION pmax VALUES LESS THAN MAXVALUE"]
+    with db_connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {table} SET create_datetime = COALESCE(update_datetime, NOW(6)) "
+                       f"WHERE create_datetime IS NULL")
+        cursor.execute(f"ALTER TABLE {table} MODIFY create_datetime DATETIME(6) NOT NULL, "
+                       f"DROP PRIMARY KEY, ADD PRIMARY KEY (id, create_datetime)")
+        cursor.execute(f"ALTER TABLE {table} PARTITION BY RANGE (TO_DAYS(create_datetime)) "
+                       f"({', '.join(partitions)})")
+    return True
+
+
+def maintain_partitions(model, cutoff, months_ahead=None):
+    """
+    分区维护: 预建未来月份分区, 删除上界不晚于截止时间的分区(其中数据已全部归档)
+    :param model:
+    :param cutoff: 归档截止时间
+    :param months_ahead: 预建未来月份分区数
+    :return: (新增分区数, 删除分区数)
+    """
+    partitions = [(name, description) for name, description in get_partitions(model) if name != "pmax"]
+    if not partitions:
+        return 0, 0
+    months_ahead = months_ahead or getattr(settings, "LOG_PARTITION_MONTHS_AHEAD", 3)
+    db_connection = get_connection(model)
+    table = db_connection.ops.quote_name(model._meta.db_table)
+    start = datetime.date.fromordinal(int(partitions[-1][1]) - 365)
+    end = next_month(timezone.now().date())
+    for _ in range(months_ahead):
+        end = next_month(end)
+    added = get_partition_sql(start, end)
+    # 至少保留一个分区, 避免 DROP 全部分区
+    dropped = [name for name, description in partitions[:-1] if int(description) <= to_days(get_row_date(cutoff))]
+    with db_connection.cursor() as cursor:
+        if added:
+            cursor.execute(f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO "
+                           f"({', '.join(added)}, PARTITION pmax VALUES LESS THAN MAXVALUE)")
+        if dropped:
+            cursor.execute(f"ALTER TABLE {table} DROP PARTITION {', '.join(dropped)}")
+    return len(added), len(dropped)
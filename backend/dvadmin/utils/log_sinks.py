@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 日志输出目标(sink): 主数据库(ORM)、独立日志数据库(数据库路由)、NDJSON 文件(按大小/时间滚动),
+通过 settings.LOG_SINKS 配置, 可同时输出到多个目标
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from django.utils.module_loading import import_string
+
+from application import dispatch
+
+logger = logging.getLogger(__name__)
+
+
+def get_log_database_alias():
+    """
+    获取独立日志数据库的别名, 未配置 settings.LOG_DATABASE 时返回None
+    :return:
+    """
+    alias = getattr(settings, "LOG_DATABASE_ALIAS", "logs")
+    return alias if alias in connections.databases else None
+
+
+class LogDatabaseRouter:
+    """
+    日志数据库路由: 配置了独立日志数据库时, settings.LOG_DATABASE_MODELS 中的日志模型读写该数据库,
+    日志关联的其他模型(如创建人)仍读写主数据库
+    """
+
+    @staticmethod
+    def is_log_model(model):
+        return model._meta.label in getattr(settings, "LOG_DATABASE_MODELS", ["system.OperationLog", "system.LoginLog"])
+
+    def db_for_model(self, model, **hints):
+        alias = get_log_database_alias()
+        if alias is None:
+            return None
+        if self.is_log_model(model):
+            return alias
+        instance = hints.get("instance")
+        if instance is not None and self.is_log_model(type(instance)):
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.db_for_model(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_model(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 日志与用户等主库数据的关联不使用数据库外键约束(db_constraint=False), 允许跨库关联
+        if get_log_database_alias() and (self.is_log_model(type(obj1)) or self.is_log_model(type(obj2))):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        alias = get_log_database_alias()
+        if alias is None:
+            return None
+        model = hints.get("model")
+        is_log_model = model is not None and self.is_log_model(model)
+        if db == alias:
+            return is_log_model
+        return False if is_log_model else None
+
+
+class LogSink:
+    """
+    日志输出目标基类, write 写入一批同一模型的未保存日志实例
+    """
+
+    def write(self, instances):
+        raise NotImplementedError
+
+
+class DatabaseLogSink(LogSink):
+    """
+    数据库输出: ORM bulk_create, 写入的数据库由数据库路由决定(配置了独立日志数据库时为日志数据库)
+    """
+    using = None
+
+    def get_using(self, model):
+        return self.using
+
+    def write(self, instances):
+        model = type(instances[0])
+        queryset = model.objects.using(self.get_using(model)) if self.get_using(model) else model.objects
+        queryset.bulk_create(instances, batch_size=getattr(settings, "API_LOG_BATCH_SIZE", 200))
+
+
+class LogDatabaseLogSink(DatabaseLogSink):
+    """
+    独立日志数据库输出: 写入 settings.LOG_DATABASE 配置的数据库, 与业务表分离
+    """
+
+    def get_using(self, model):
+        alias = get_log_database_alias()
+        if alias is None:
+            raise ImproperlyConfigured("使用 logs_database 日志输出时须配置 settings.LOG_DATABASE")
+        return alias
+
+
+class FileLogSink(LogSink):
+    """
+    NDJSON 文件输出: 每个进程、每个模型一个文件 <LOG_FILE_SINK_DIR>/<租户schema>/<表名>.<进程id>.ndjson, 每行一条日志;
+    文件超过 LOG_FILE_SINK_MAX_BYTES 或跨越 LOG_FILE_SINK_INTERVAL 秒的时间段时滚动为 <表名>.<进程id>.<时间>.ndjson;
+    多进程部署(如 gunicorn/uvicorn 多 worker)时各进程写入、滚动各自的文件, 互不影响
+    """
+
+    def __init__(self, directory=None, max_bytes=None, interval=None):
+        self.directory = directory or getattr(
+            settings, "LOG_FILE_SINK_DIR", os.path.join(settings.BASE_DIR, "logs", "sink"))
+        self.max_bytes = max_bytes or getattr(settings, "LOG_FILE_SINK_MAX_BYTES", 100 * 1024 * 1024)
+        self.interval = interval or getattr(settings, "LOG_FILE_SINK_INTERVAL", 24 * 60 * 60)
+        self._lock = threading.Lock()
+
+    def get_path(self, model):
+        schema_name = connection.tenant.schema_name if dispatch.is_tenants_mode() else "public"
+        return os.path.join(self.directory, schema_name, f"{model._meta.db_table}.{os.getpid()}.ndjson")
+
+    def get_period(self, timestamp):
+        # 按本地时间划分时间段, 如按天滚动时在零点滚动
+        return int((timestamp - time.mktime(time.localtime(0))) // self.interval)
+
+    def should_rollover(self, path, size):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size == 0:
+            return False
+        return stat.st_size + size > self.max_bytes or self.get_period(stat.st_mtime) != self.get_period(time.time())
+
+    @staticmethod
+    def rollover(path):
+        # 文件已被移走(如外部日志轮转)时无需滚动
+        try:
+            suffix = datetime.datetime.fromtimestamp(os.stat(path).st_mtime).strftime("%Y%m%d-%H%M%S")
+            base = path[:-len(".ndjson")]
+            target, index = f"{base}.{suffix}.ndjson", 1
+            while os.path.exists(target):
+                target, index = f"{base}.{suffix}.{index}.ndjson", index + 1
+            os.rename(path, target)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def to_dict(instance):
+        # 与 bulk_create 一致, 写入前补充 auto_now/auto_now_add 时间字段
+        return {field.attname: field.pre_save(instance, add=True) for field in instance._meta.concrete_fields}
+
+    def write(self, instances):
+        model = type(instances[0])
+        path = self.get_path(model)
+        content = "".join(json.dumps(self.to_dict(instance), cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+                          for instance in instances).encode("utf-8")
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.should_rollover(path, len(content)):
+                self.rollover(path)
+            with open(path, "ab") as file:
+                file.write(content)
+
+
+LOG_SINKS = {
+    "database": DatabaseLogSink,
+    "logs_database": LogDatabaseLogSink,
+    "file": FileLogSink,
+}
+
+_sinks = {}
+
+
+def get_log_sinks():
+    """
+    获取日志输出目标(进程内单例)
+    :return: [LogSink]
+    """
+    names = tuple(getattr(settings, "LOG_SINKS", None) or ["database"])
+    if names not in _sinks:
+        _sinks[names] = [(LOG_SINKS.get(name) or import_string(name))() if isinstance(name, str) else name()
+                         for name in names]
+    return _sinks[names]
+
+
+def write_to_sinks(instances):
+    """
+    将一批日志写入全部输出目标, 某个目标失败不影响其他目标(记录异常日志);
+    全部目标均失败时抛出第一个异常, 即至少写入一个目标(如数据库)时视为写入成功
+    :param instances: 同一模型的未保存日志实例
+    :return: 写入失败的输出目标
+    """
+    errors, failed = [], []
+    sinks = get_log_sinks()
+    for sink in sinks:
+        try:
+            sink.write(instances)
+        except Exception as e:
+            logger.exception(f"日志写入 {type(sink).__name__} 失败")
+            errors.append(e)
+            failed.append(sink)
+    if errors and len(failed) == len(sinks):
+        raise errors[0]
+    return failed
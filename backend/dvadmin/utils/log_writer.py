@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 日志异步批量写入: 请求中构建日志对象放入有界队列, 后台线程按批写入日志输出目标(见 log_sinks)
+"""
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import connection, close_old_connections
+
+from application import dispatch
+from dvadmin.utils.ip_geolocation import GEOLOCATION_FIELDS, get_ip_geolocation, get_ip_geolocation_provider, \
+    is_ip_geolocation_required
+from dvadmin.utils.log_sinks import write_to_sinks
+
+logger = logging.getLogger(__name__)
+
+
+class LogWriter:
+    """
+    日志批量写入器
+    (1)settings.API_LOG_ASYNC = False 时同步写入(如测试环境)
+    (2)队列满时最多等待 API_LOG_QUEUE_TIMEOUT 秒(背压), 仍无法放入则丢弃并计数
+    (3)后台线程每 API_LOG_FLUSH_INTERVAL 秒或攒够 API_LOG_BATCH_SIZE 条写入一次
+    """
+
+    def __init__(self, name="log_writer"):
+        self.name = name
+        self.queue = None
+        self.stats = {"queued": 0, "written": 0, "dropped": 0, "failed": 0}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def is_async():
+        return getattr(settings, "API_LOG_ASYNC", True)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+            return self.stats[name]
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                if self.queue is None:
+                    self.queue = queue.Queue(maxsize=getattr(settings, "API_LOG_QUEUE_SIZE", 10000))
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, instance):
+        """
+        提交一条待写入的日志(未保存的模型实例)
+        :param instance: 模型实例
+        :return: 是否已写入或放入队列
+        """
+        schema_name = connection.tenant.schema_name if dispatch.is_tenants_mode() else None
+        if not self.is_async():
+            self.write([(schema_name, instance)])
+            return True
+        self._ensure_started()
+        try:
+            self.queue.put((schema_name, instance), timeout=getattr(settings, "API_LOG_QUEUE_TIMEOUT", 0.01))
+        except queue.Full:
+            dropped = self._count("dropped")
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.warning(f"{self.name} 队列已满, 已丢弃 {dropped} 条日志")
+            return False
+        self._count("queued")
+        return True
+
+    def _drain(self, block=True):
+        batch_size = getattr(settings, "API_LOG_BATCH_SIZE", 200)
+        items = []
+        try:
+            if block:
+                items.append(self.queue.get(timeout=getattr(settings, "API_LOG_FLUSH_INTERVAL", 1.0)))
+            while len(items) < batch_size:
+                items.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return items
+
+    def _run(self):
+        while True:
+            items = self._drain()
+            if items:
+                self.write(items)
+            close_old_connections()
+
+    def write(self, items):
+        """
+        按租户分组批量写入
+        :param items: [(schema_name, instance)]
+        :return:
+        """
+        groups = {}
+        for schema_name, instance in items:
+            groups.setdefault(schema_name, []).append(instance)
+        for schema_name, instances in groups.items():
+            try:
+                if schema_name is not None:
+                    from django_tenants.utils import schema_context
+                    with schema_context(schema_name):
+                        self.bulk_create(instances)
+                else:
+                    self.bulk_create(instances)
+                self._count("written", len(instances))
+            except Exception:
+                self._count("failed", len(instances))
+                logger.exception(f"{self.name} 写入 {len(instances)} 条日志失败")
+
+    def bulk_create(self, instances):
+        # 写入 settings.LOG_SINKS 配置的输出目标(默认数据库)
+        write_to_sinks(instances)
+
+    def flush(self):
+        """
+        在当前线程写入队列中的全部日志(如进程退出、测试时)
+        :return:
+        """
+        if self.queue is None:
+            return
+        while True:
+            items = self._drain(block=False)
+            if not items:
+                break
+            self.write(items)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats["pending"] = self.queue.qsize() if self.queue is not None else 0
+        return stats
+
+
+class LoginLogWriter(LogWriter):
+    """
+    登录日志写入器: 本地离线库等不阻塞的解析方式在写入前解析IP地理位置;
+    远程接口等可能阻塞的解析方式先写入登录日志(地理位置为空), 再交由 login_log_geolocation_writer 补充
+    """
+
+    def bulk_create(self, instances):
+        inline = not get_ip_geolocation_provider().blocking
+        pending = {}
+        for instance in instances:
+            if not inline and is_ip_geolocation_required(instance.ip):
+                pending.setdefault(instance.ip, []).append(instance)
+                continue
+            geolocation = get_ip_geolocation(instance.ip)
+            for field in GEOLOCATION_FIELDS:
+                setattr(instance, field, geolocation.get(field))
+        super().bulk_create(instances)
+        for ip, items in pending.items():
+            # 数据库支持 bulk_create 返回主键(SQLite、PostgreSQL)时按主键更新, 否则(MySQL)按IP更新
+            pk_list = [instance.pk for instance in items]
+            login_log_geolocation_writer.submit((ip, None if None in pk_list else pk_list))
+
+
+class LoginLogGeolocationWriter(LogWriter):
+    """
+    登录日志地理位置补充: 后台线程解析IP地理位置, 按主键(或按IP, 使用 (ip, continent) 索引)更新
+    尚未补充地理位置(continent为空)的登录日志; 登录请求及登录日志写入不等待解析, 输出到文件(file)的登录日志不补充
+    """
+
+    @staticmethod
+    def is_async():
+        return True
+
+    def bulk_create(self, items):
+        """
+        :param items: [(ip, 主键列表)], 主键列表为None时按IP更新
+        """
+        from dvadmin.system.models import LoginLog
+        groups = {}
+        for ip, pk_list in items:
+            if pk_list is None or groups.get(ip, []) is None:
+                groups[ip] = None
+            else:
+                groups.setdefault(ip, []).extend(pk_list)
+        for ip, pk_list in groups.items():
+            queryset = LoginLog.objects.filter(ip=ip, continent__isnull=True)
+            if pk_list is not None:
+                queryset = queryset.filter(pk__in=pk_list)
+            queryset.update(**get_ip_geolocation(ip))
+
+
+operation_log_writer = LogWriter("operation_log_writer")
+atexit.register(operation_log_writer.flush)
+# 进程退出时先写入登录日志, 再补充地理位置(atexit 按注册的相反顺序执行)
+login_log_geolocation_writer = LoginLogGeolocationWriter("login_log_geolocation_writer")
+atexit.register(login_log_geolocation_writer.flush)
+login_log_writer = LoginLogWriter("login_log_writer")
+atexit.register(login_log_writer.flush)
@@ -64,6 +64,19 @@ class SoftDeleteModel(models.Model):
         self.save(using=using)
 
 
+class CreateDateTimeField(models.DateTimeField):
+    """
+    创建时间字段(auto_now_add): 新增时已设置值则保留, 未设置时取当前时间;
+    用于异步批量写入的日志, 保留请求发生的时间而非写入数据库的时间
+    """
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.attname)
+        if add and value is not None:
+            return value
+        return super().pre_save(model_instance, add)
+
+
 class CoreModel(models.Model):
     """
     核心标准抽象模型模型,可直接继承使用
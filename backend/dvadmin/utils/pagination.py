@@ -7,32 +7,104 @@
 
 @Created on: 2020/4/16 23:35
 """
+import datetime
+import json
 from collections import OrderedDict
 
-from django.core import paginator
+from django.conf import settings
+from django.core import paginator, signing
 from django.core.paginator import Paginator as DjangoPaginator, InvalidPage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.functional import cached_property
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from dvadmin.utils.count_strategies import get_count_strategy
+
+
+class CursorJSONEncoder(DjangoJSONEncoder):
+    """
+    游标值编码: 时间保留微秒, 避免游标定位不准
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CountStrategyPaginator(DjangoPaginator):
+    """
+    按总数统计策略获取总数的分页器, 总数非精确值时不校验页码上限
+    """
+
+    def __init__(self, object_list, per_page, count_strategy=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_strategy = count_strategy
+        self.count_exact = True
+
+    @cached_property
+    def count(self):
+        if self.count_strategy is None:
+            return super().count
+        total, self.count_exact = self.count_strategy.count(self.object_list)
+        return total
+
+    def validate_number(self, number):
+        # 先获取总数, 以确定总数是否为精确值
+        if self.count is not None and self.count_exact:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise paginator.PageNotAnInteger("That page number is not an integer")
+        if number < 1:
+            raise paginator.EmptyPage("That page number is less than 1")
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_exact:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
 
 
 class CustomPagination(PageNumberPagination):
+    """
+    自定义分页
+    (1)默认: 页码分页(COUNT + LIMIT/OFFSET)
+    (2)视图集设置 keyset_pagination = True 时使用游标(keyset)分页, 按 keyset_ordering 排序,
+       不执行COUNT, 前端需按响应中的 next/previous 传 cursor 参数翻页; 未携带 cursor 时按页码 LIMIT/OFFSET;
+       请求携带 ordering 参数(OrderingFilter)时游标无法按其排序定位, 改用页码分页
+    (3)视图集设置 count_strategy 指定总数统计策略: exact(默认)|cached|estimated, 响应中 total_exact 表示总数是否为精确值
+    """
     page_size = 10
     page_size_query_param = "limit"
     max_page_size = 999
-    django_paginator_class = DjangoPaginator
+    django_paginator_class = CountStrategyPaginator
+    cursor_query_param = "cursor"
+    cursor_salt = "dvadmin.utils.pagination.cursor"
+    default_keyset_ordering = ("-create_datetime", "-id")
+    keyset = False
 
     def paginate_queryset(self, queryset, request, view=None):
         """
         Paginate a queryset if required, either returning a
         page object, or `None` if pagination is not configured for this view.
         """
+        if getattr(view, "keyset_pagination", False) and not request.query_params.get(api_settings.ORDERING_PARAM):
+            return self.paginate_keyset_queryset(queryset, request, view)
         empty = True
 
         page_size = self.get_page_size(request)
         if not page_size:
             return None
 
-        paginator = self.django_paginator_class(queryset, page_size)
+        paginator = self.django_paginator_class(
+            queryset, page_size, count_strategy=self.get_count_strategy(request, view))
         page_number = request.query_params.get(self.page_query_param, 1)
         if page_number in self.last_page_strings:
             page_number = paginator.num_pages
@@ -57,27 +129,168 @@ class CustomPagination(PageNumberPagination):
 
         return list(self.page)
 
+    def get_count_strategy(self, request, view, default=None):
+        """
+        获取总数统计策略: 视图集 count_strategy, 未设置时使用 settings.PAGINATION_COUNT_STRATEGY
+        :param request:
+        :param view:
+        :param default:
+        :return: CountStrategy
+        """
+        strategy = getattr(view, "count_strategy", None) or default or getattr(
+            settings, "PAGINATION_COUNT_STRATEGY", "exact")
+        return get_count_strategy(strategy, request=request, view=view)
+
+    # ================================================= #
+    # ************** 游标(keyset)分页 ************** #
+    # ================================================= #
+
+    def get_keyset_ordering(self, queryset, view):
+        """
+        获取游标分页的排序字段,排序字段需为非空且有索引的本表字段,末尾自动补充主键保证排序唯一
+        :param queryset:
+        :param view:
+        :return: ["-create_datetime", "-id"]
+        """
+        ordering = list(getattr(view, "keyset_ordering", None) or self.default_keyset_ordering)
+        pk_name = queryset.model._meta.pk.name
+        if not any(field.lstrip("-") in ("pk", pk_name) for field in ordering):
+            ordering.append(f"-{pk_name}" if ordering[-1].startswith("-") else pk_name)
+        return ordering
+
+    @staticmethod
+    def get_keyset_values(row, ordering):
+        values = []
+        for field in ordering:
+            name = field.lstrip("-")
+            # values_queryset 形式时 row 为 dict
+            values.append(row.get(name) if isinstance(row, dict) else row.serializable_value(name))
+        return json.loads(json.dumps(values, cls=CursorJSONEncoder))
+
+    @staticmethod
+    def get_keyset_filter(ordering, values):
+        """
+        生成游标之后数据的过滤条件: (a < x) or (a = x and b < y) ...
+        :param ordering: 排序字段
+        :param values: 游标处各排序字段的值
+        :return: Q
+        """
+        condition = Q()
+        for index, field in enumerate(ordering):
+            lookup = "lt" if field.startswith("-") else "gt"
+            item = Q(**{f"{field.lstrip('-')}__{lookup}": values[index]})
+            for prev_field, value in zip(ordering[:index], values):
+                item &= Q(**{prev_field.lstrip("-"): value})
+            condition |= item
+        return condition
+
+    def encode_cursor(self, page, values, reverse):
+        return signing.dumps({"p": page, "v": values, "r": reverse}, salt=self.cursor_salt, compress=True)
+
+    def decode_cursor(self, request, ordering):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            cursor = signing.loads(cursor, salt=self.cursor_salt)
+        except signing.BadSignature:
+            return None
+        if not isinstance(cursor, dict) or len(cursor.get("v") or []) != len(ordering):
+            return None
+        return cursor
+
+    def paginate_keyset_queryset(self, queryset, request, view=None):
+        """
+        游标分页: 携带cursor时按排序字段定位(WHERE ... LIMIT n+1),否则按页码 LIMIT/OFFSET,均不执行COUNT
+        :param queryset:
+        :param request:
+        :param view:
+        :return:
+        """
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        self.request = request
+        self.keyset = True
+        self.keyset_total = None
+        if getattr(view, "count_strategy", None):
+            # 视图集指定了总数统计策略时返回其统计的总数
+            self.keyset_total, self.keyset_total_exact = self.get_count_strategy(request, view).count(queryset)
+        ordering = self.get_keyset_ordering(queryset, view)
+        cursor = self.decode_cursor(request, ordering)
+        if cursor is None:
+            page_number = request.query_params.get(self.page_query_param, 1)
+            page_number = int(page_number) if str(page_number).isdigit() and int(page_number) > 0 else 1
+            offset = (page_number - 1) * page_size
+            rows = list(queryset.order_by(*ordering)[offset:offset + page_size + 1])
+            has_more = len(rows) > page_size
+            rows = rows[:page_size]
+            is_next, is_previous = has_more, page_number > 1 and bool(rows)
+        else:
+            page_number, reverse = max(int(cursor.get("p") or 1), 1), bool(cursor.get("r"))
+            if reverse:
+                ordering = [field[1:] if field.startswith("-") else f"-{field}" for field in ordering]
+            rows = list(queryset.order_by(*ordering).filter(
+                self.get_keyset_filter(ordering, cursor["v"]))[:page_size + 1])
+            has_more = len(rows) > page_size
+            rows = rows[:page_size]
+            if reverse:
+                rows.reverse()
+                ordering = self.get_keyset_ordering(queryset, view)
+                is_next, is_previous = True, has_more
+                if not has_more:
+                    page_number = 1
+            else:
+                is_next, is_previous = has_more, True
+        self.page = rows
+        self.page_number = page_number
+        self.is_next = is_next and bool(rows)
+        self.is_previous = is_previous
+        self.next_cursor = self.encode_cursor(
+            page_number + 1, self.get_keyset_values(rows[-1], ordering), False) if self.is_next else None
+        self.previous_cursor = self.encode_cursor(
+            page_number - 1, self.get_keyset_values(rows[0], ordering), True) if is_previous and rows else None
+        return rows
+
     def get_paginated_response(self, data):
         code = 2000
         msg = 'success'
-        page = int(self.get_page_number(self.request, paginator)) or 1
-        total = self.page.paginator.count if self.page else 0
         limit = int(self.get_page_size(self.request)) or 10
-        is_next = self.page.has_next() if self.page else False
-        is_previous = self.page.has_previous() if self.page else False
+        if self.keyset:
+            page = self.page_number
+            if self.keyset_total is not None:
+                total, total_exact = self.keyset_total, self.keyset_total_exact
+            elif self.is_next:
+                # 游标分页不统计总数, 未到最后一页时总数未知, 前端根据 is_next 显示下一页
+                total, total_exact = None, False
+            else:
+                total, total_exact = (page - 1) * limit + len(self.page), True
+            is_next = self.is_next
+            is_previous = self.is_previous
+        else:
+            page = int(self.get_page_number(self.request, paginator)) or 1
+            total = self.page.paginator.count if self.page else 0
+            total_exact = getattr(self.page.paginator, "count_exact", True) if self.page else True
+            is_next = self.page.has_next() if self.page else False
+            is_previous = self.page.has_previous() if self.page else False
 
         if not data:
             code = 2000
             msg = "暂无数据"
             data = []
 
-        return Response(OrderedDict([
+        response = OrderedDict([
             ('code', code),
             ('msg', msg),
             ('page', page),
             ('limit', limit),
             ('total', total),
+            ('total_exact', total_exact),
             ('is_next', is_next),
             ('is_previous', is_previous),
             ('data', data)
-        ]))
+        ])
+        if self.keyset:
+            response['next'] = self.next_cursor
+            response['previous'] = self.previous_cursor
+        return Response(response)
@@ -6,13 +6,25 @@
 @Created on: 2021/6/6 006 10:30
 @Remark: 自定义权限
 """
+import logging
 import re
+import threading
 
 from django.contrib.auth.models import AnonymousUser
-from django.db.models import F
+from django.core import checks
+from django.db import connection, DatabaseError
+from django.urls import resolve, Resolver404
 from rest_framework.permissions import BasePermission
 
-from dvadmin.system.models import ApiWhiteList, RoleMenuButtonPermission
+from application import dispatch
+from dvadmin.system.models import ApiWhiteList, RoleMenuButtonPermission, MenuButton
+from dvadmin.utils.authentication import get_user_role_ids
+from dvadmin.utils.request_util import get_canonical_path
+
+logger = logging.getLogger(__name__)
+
+# 原正则匹配中 {id} 的取值范围
+API_ID_RE = re.compile(r'[a-zA-Z0-9-]+')
 
 
 def ValidationApi(reqApi, validApi):
@@ -59,6 +71,222 @@ def ReUUID(api):
         return None
 
 
+def compile_api_matcher(api_list):
+    """
+    将(接口, 请求方法)列表编译为一个合并的正则匹配器
+    :param api_list: [(api, method), ...]
+    :return: 编译后的正则列表,正常情况下只有一个
+    """
+    patterns = [
+        str(api).replace('{id}', '([a-zA-Z0-9-]+)') + ":" + str(method) + '$'
+        for api, method in api_list if api
+    ]
+    if not patterns:
+        return ()
+    try:
+        return (re.compile("|".join(f"(?:{item})" for item in patterns), re.M | re.I),)
+    except re.error:
+        # 存在非法正则时逐个编译,跳过非法的接口地址
+        matchers = []
+        for item in patterns:
+            try:
+                matchers.append(re.compile(item, re.M | re.I))
+            except re.error:
+                logger.warning(f"接口权限地址不是合法的正则,已忽略: {item}")
+        return tuple(matchers)
+
+
+def get_api_route_template(api):
+    """
+    将接口地址映射为路由模板,映射后的模板与 get_api_route 计算结果一致;
+    与正则匹配(re.I)一致不区分大小写, 返回小写的路由模板
+    :param api: 接口地址,如 /api/system/user/{id}/
+    :return: 路由模板,无法映射到路由时返回None
+    """
+    if not api or not api.startswith('/'):
+        return None
+    path = re.sub(r'\{[^/{}]+\}', '1', api)
+    for candidate in dict.fromkeys([path, path.lower()]):
+        try:
+            resolver_match = resolve(candidate)
+        except (Resolver404, ValueError):
+            continue
+        if get_canonical_path(candidate, resolver_match).lower() == api.lower():
+            return api.lower()
+    return None
+
+
+class ApiPermissionIndex:
+    """
+    接口权限索引:
+    (1)以 (路由模板, 请求方法) 为key的哈希索引,值为拥有该接口的角色id集合,白名单单独存放
+    (2)无法映射到路由的接口地址,按角色编译为正则匹配器回退匹配
+    """
+    WHITE_LIST_KEY = "__white_list__"
+
+    def __init__(self):
+        self.white_routes = set()
+        self.role_routes = {}
+        self.matchers = {}
+        self.unmapped = set()
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        fallback = {}
+        for url, method in ApiWhiteList.objects.values_list('url', 'method'):
+            if not url:
+                continue
+            route = get_api_route_template(url)
+            if route is None:
+                index.unmapped.add(url)
+                fallback.setdefault(cls.WHITE_LIST_KEY, []).append((url, method))
+            else:
+                index.white_routes.add((route, method))
+        button_map = {}
+        for button_id, api, method in MenuButton.objects.values_list('id', 'api', 'method'):
+            if not api:
+                continue
+            route = get_api_route_template(api)
+            if route is None:
+                index.unmapped.add(api)
+            button_map[button_id] = (route, api, method)
+        role_button_list = RoleMenuButtonPermission.objects.filter(menu_button__isnull=False).values_list(
+            'role_id', 'menu_button_id')
+        for role_id, button_id in role_button_list:
+            if button_id not in button_map:
+                continue
+            route, api, method = button_map[button_id]
+            if route is None:
+                fallback.setdefault(role_id, []).append((api, method))
+            else:
+                index.role_routes.setdefault((route, method), set()).add(role_id)
+        index.matchers = {key: compile_api_matcher(items) for key, items in fallback.items()}
+        return index
+
+    def match(self, api, method, role_id_list, route=None):
+        """
+        判断接口是否在白名单或角色拥有的接口权限中
+        :param api: 当前请求的接口
+        :param method: 当前请求方法的序号
+        :param role_id_list: 角色id列表
+        :param route: 当前请求的路由模板
+        :return: True或者False
+        """
+        if route is not None:
+            key = (route.lower(), method)
+            if key in self.white_routes:
+                return True
+            if not self.role_routes.get(key, set()).isdisjoint(role_id_list):
+                return True
+        new_api = api + ":" + str(method)
+        for key in [self.WHITE_LIST_KEY, *role_id_list]:
+            for matcher in self.matchers.get(key, ()):
+                if matcher.match(new_api):
+                    return True
+        return False
+
+
+# 接口权限索引的进程内缓存: 租户schema -> (权限版本号, ApiPermissionIndex)
+_api_permission_index_cache = {}
+_api_permission_index_lock = threading.Lock()
+
+
+def get_api_permission_index():
+    """
+    获取接口权限索引(进程内缓存,租户模式下各租户单独缓存)
+    接口白名单、菜单按钮、角色按钮权限变化时通过权限版本号失效;
+    未启用进程内缓存时每次重新构建, 请求中判断权限时使用 match_api_permission_by_roles
+    :return: ApiPermissionIndex
+    """
+    if not dispatch.is_process_cache_enabled():
+        return ApiPermissionIndex.build()
+    schema_name = connection.tenant.schema_name if dispatch.is_tenants_mode() else None
+    version = dispatch.get_cache_version("permission")
+    cached = _api_permission_index_cache.get(schema_name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _api_permission_index_lock:
+        cached = _api_permission_index_cache.get(schema_name)
+        if cached is None or cached[0] != version:
+            cached = (version, ApiPermissionIndex.build())
+            _api_permission_index_cache[schema_name] = cached
+    return cached[1]
+
+
+def check_api_permission_index(app_configs=None, **kwargs):
+    """
+    系统检查(runserver、check 等命令执行时): 列出无法映射到路由、需要正则匹配的接口地址
+    :return: [checks.Warning]
+    """
+    try:
+        index = ApiPermissionIndex.build()
+    except DatabaseError as e:
+        logger.warning(f"接口权限索引检查跳过, 请先进行数据库迁移: {e}")
+        return []
+    return [
+        checks.Warning(
+            f"接口地址无法映射到路由,将使用正则匹配: {api}",
+            hint="请检查菜单按钮或接口白名单的接口地址是否与路由一致(如 /api/system/user/{id}/)",
+            id="dvadmin.W001",
+        )
+        for api in sorted(index.unmapped)
+    ]
+
+
+def get_api_route(api, resolver_match=None):
+    """
+    获取接口的路由模板, 用于查找接口权限索引
+    :param api: 当前请求的接口
+    :param resolver_match: 路由匹配结果,不传时根据接口地址解析
+    :return: 路由模板; 无法解析, 或路由参数超出原正则中 {id} 的取值范围时返回None
+    """
+    if resolver_match is None:
+        try:
+            resolver_match = resolve(api)
+        except Resolver404:
+            return None
+    values = [*resolver_match.args, *resolver_match.kwargs.values()]
+    if not all(API_ID_RE.fullmatch(str(value)) for value in values):
+        return None
+    return get_canonical_path(api, resolver_match)
+
+
+def match_api_permission_by_roles(api, method, role_id_list):
+    """
+    未启用进程内缓存时判断接口权限: 只查询接口白名单及当前角色的接口, 编译为一个正则匹配,
+    避免每次请求构建全部角色的接口权限索引
+    :param api: 当前请求的接口
+    :param method: 当前请求方法的序号
+    :param role_id_list: 角色id列表
+    :return: True或者False
+    """
+    api_list = list(ApiWhiteList.objects.values_list('url', 'method'))
+    api_list += RoleMenuButtonPermission.objects.filter(
+        role__in=role_id_list, menu_button__isnull=False).values_list('menu_button__api', 'menu_button__method')
+    new_api = api + ":" + str(method)
+    return any(matcher.match(new_api) for matcher in compile_api_matcher(api_list))
+
+
+def match_api_permission(api, method, role_id_list, route=None):
+    """
+    判断接口是否在白名单或角色拥有的接口权限中
+    :param api: 当前请求的接口
+    :param method: 当前请求方法的序号
+    :param role_id_list: 角色id列表
+    :param route: 当前请求的路由模板,不传时根据接口地址解析
+    :return: True或者False
+    """
+    if not dispatch.is_process_cache_enabled():
+        return match_api_permission_by_roles(api, method, role_id_list)
+    if route is None:
+        route = get_api_route(api)
+    if route is None:
+        # 无法使用路由索引时与原实现一致, 按正则匹配白名单及当前角色的全部接口
+        return match_api_permission_by_roles(api, method, role_id_list)
+    return get_api_permission_index().match(api, method, role_id_list, route)
+
+
 class CustomPermission(BasePermission):
     """自定义权限"""
 
@@ -73,26 +301,9 @@ class CustomPermission(BasePermission):
             method = request.method  # 当前请求方法
             methodList = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH']
             method = methodList.index(method)
-            # ***接口白名单***
-            api_white_list = ApiWhiteList.objects.values(permission__api=F('url'), permission__method=F('method'))
-            api_white_list = [
-                str(item.get('permission__api').replace('{id}', '([a-zA-Z0-9-]+)')) + ":" + str(
-                    item.get('permission__method')) + '$' for item in api_white_list if item.get('permission__api')]
-            # ********#
             if not hasattr(request.user, "role"):
                 return False
-            role_id_list = request.user.role.values_list('id',flat=True)
-            userApiList = RoleMenuButtonPermission.objects.filter(role__in=role_id_list).values(permission__api=F('menu_button__api'), permission__method=F('menu_button__method'))  # 获取当前用户的角色拥有的所有接口
-            ApiList = [
-                str(item.get('permission__api').replace('{id}', '([a-zA-Z0-9-]+)')) + ":" + str(
-                    item.get('permission__method')) + '$' for item in userApiList if item.get('permission__api')]
-            new_api_ist = api_white_list + ApiList
-            new_api = api + ":" + str(method)
-            for item in new_api_ist:
-                matchObj = re.match(item, new_api, re.M | re.I)
-                if matchObj is None:
-                    continue
-                else:
-                    return True
-            else:
-                return False
+            role_id_list = get_user_role_ids(request.user)
+            # ***接口白名单及角色接口权限,优先按路由模板查找索引***
+            route = get_api_route(api, request.resolver_match)
+            return match_api_permission(api, method, role_id_list, route)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 查询计划: 根据序列化器字段自动生成 select_related / prefetch_related / only
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db import router
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, RelatedField, PrimaryKeyRelatedField, HyperlinkedRelatedField
+
+from django_restql.mixins import DynamicFieldsMixin
+
+
+class QueryPlan:
+    """
+    查询计划
+    (1)select_related: 正向外键/一对一关联路径
+    (2)prefetch_related: 多对多/反向外键关联路径
+    (3)only: 主模型需要加载的字段,存在无法推断的字段(如未声明依赖的SerializerMethodField)时不使用only
+    """
+
+    def __init__(self):
+        self.select_related = set()
+        self.prefetch_related = set()
+        self.only = set()
+        self.only_safe = True
+
+    def apply(self, queryset):
+        """
+        将查询计划应用到queryset
+        :param queryset:
+        :return:
+        """
+        if self.select_related:
+            queryset = queryset.select_related(*sorted(self.select_related))
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*sorted(self.prefetch_related))
+        if self.only_safe and self.only:
+            queryset = queryset.only(*sorted(self.only))
+        return queryset
+
+    def __str__(self):
+        items = [
+            ("select_related", self.select_related),
+            ("prefetch_related", self.prefetch_related),
+            ("only", self.only if self.only_safe else None),
+        ]
+        return "; ".join(f"{name}={','.join(sorted(value))}" for name, value in items if value)
+
+
+def get_serializer_fields(serializer):
+    """
+    获取序列化器实际输出的字段,继承DynamicFieldsMixin时以restql query参数选择的字段为准
+    :param serializer: 序列化器实例
+    :return:
+    """
+    if isinstance(serializer, DynamicFieldsMixin) and not serializer.dynamic_fields_mixin_kwargs[
+            "disable_dynamic_fields"]:
+        return serializer.dynamic_fields
+    return serializer.fields
+
+
+def get_query_plan_hints(serializer):
+    """
+    获取序列化器声明的字段依赖(query_plan_hints),子类声明的依赖与父类合并
+    :param serializer: 序列化器实例
+    :return: {字段名: [source路径]}
+    """
+    hints = {}
+    for klass in reversed(type(serializer).__mro__):
+        hints.update(klass.__dict__.get("query_plan_hints", None) or {})
+    return hints
+
+
+def _resolve_path(model, path, plan, prefix, prefetch, only):
+    """
+    解析字段source路径,记录途经的关联关系
+    :param model: 路径起点模型
+    :param path: 以.分隔的source路径,如 dept.name
+    :param plan: 查询计划
+    :param prefix: 当前模型在主模型中的关联路径
+    :param prefetch: 当前路径是否已处于prefetch_related中
+    :param only: 是否需要记录到主模型的only字段中
+    :return: (最终模型, 完整关联路径, 是否处于prefetch_related中),路径中断(如属性、方法、注解字段)时最终模型为None
+    """
+    for index, name in enumerate(path.split(".")):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            if only and index == 0:
+                plan.only_safe = False
+            return None, prefix, prefetch
+        if not field.is_relation or getattr(field, "attname", None) == name and name != field.name:
+            # 普通字段或外键的id字段,不需要关联查询
+            if only and index == 0:
+                plan.only.add(field.name)
+            return None, prefix, prefetch
+        if only and index == 0 and field.concrete and not field.many_to_many:
+            # select_related的外键必须加载
+            plan.only.add(field.name)
+        prefix = f"{prefix}__{field.name}" if prefix else field.name
+        if field.many_to_many or field.one_to_many or router.db_for_read(field.related_model) != router.db_for_read(model):
+            # 跨数据库的关联(如独立日志数据库中日志的创建人)无法 JOIN, 使用 prefetch_related
+            prefetch = True
+        if prefetch:
+            plan.prefetch_related.add(prefix)
+        else:
+            plan.select_related.add(prefix)
+        only = False
+        model = field.related_model
+    return model, prefix, prefetch
+
+
+def _walk_serializer(serializer, model, plan, prefix="", prefetch=False):
+    """
+    遍历序列化器字段,生成查询计划
+    :param serializer: 序列化器实例
+    :param model: 序列化器对应的模型
+    :param plan: 查询计划
+    :param prefix: 当前模型在主模型中的关联路径
+    :param prefetch: 当前路径是否已处于prefetch_related中
+    :return:
+    """
+    only = not prefix
+    hints = get_query_plan_hints(serializer)
+    for field_name, field in get_serializer_fields(serializer).items():
+        if field.write_only:
+            continue
+        if field_name in hints:
+            # 序列化器声明的字段依赖,如 {"role_info": ["role"]}
+            for path in hints[field_name]:
+                _resolve_path(model, path, plan, prefix, prefetch, only)
+            continue
+        if isinstance(field, serializers.SerializerMethodField):
+            if only:
+                plan.only_safe = False
+            continue
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        if field.source == "*":
+            if isinstance(nested, serializers.ModelSerializer):
+                _walk_serializer(nested, model, plan, prefix, prefetch)
+            elif only:
+                plan.only_safe = False
+            continue
+        if isinstance(field, (PrimaryKeyRelatedField, HyperlinkedRelatedField)) and "." not in field.source:
+            # 单个外键只使用外键id,不需要关联查询
+            if only:
+                _resolve_path(model, f"{field.source}_id", plan, prefix, prefetch, only)
+            continue
+        related_model, path, path_prefetch = _resolve_path(model, field.source, plan, prefix, prefetch, only)
+        if related_model is not None and isinstance(nested, serializers.ModelSerializer):
+            _walk_serializer(nested, related_model, plan, path, path_prefetch)
+        elif related_model is not None and not isinstance(nested, (RelatedField, ManyRelatedField)) and only:
+            # 关联对象交给普通字段输出(如字符串化),无法推断所需字段
+            plan.only_safe = False
+
+
+def build_query_plan(serializer):
+    """
+    根据序列化器生成查询计划
+    :param serializer: 序列化器实例(非many)
+    :return: QueryPlan
+    """
+    plan = QueryPlan()
+    model = serializer.Meta.model
+    _walk_serializer(serializer, model, plan)
+    if plan.only:
+        plan.only.add(model._meta.pk.name)
+    return plan
@@ -2,16 +2,20 @@
 Request工具类
 """
 import json
+from collections import namedtuple
+from functools import lru_cache
 
-import requests
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import AnonymousUser
 from django.urls.resolvers import ResolverMatch
+from django.utils import timezone
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from user_agents import parse
 
 from dvadmin.system.models import LoginLog
+from dvadmin.utils.ip_geolocation import get_ip_geolocation
+from dvadmin.utils.log_writer import login_log_writer
 
 
 def get_request_user(request):
@@ -107,8 +111,16 @@ def get_request_canonical_path(request, ):
     request_path = getattr(request, 'request_canonical_path', None)
     if request_path:
         return request_path
-    path: str = request.path
-    resolver_match: ResolverMatch = request.resolver_match
+    return get_canonical_path(request.path, request.resolver_match)
+
+
+def get_canonical_path(path: str, resolver_match: ResolverMatch):
+    """
+    根据路由匹配结果,将路径中的参数替换为模板,如 /api/system/user/1/ => /api/system/user/{id}/
+    :param path: 请求路径
+    :param resolver_match: 路由匹配结果
+    :return:
+    """
     for value in resolver_match.args:
         path = path.replace(f"/{value}", "/{id}")
     for key, value in resolver_match.kwargs.items():
@@ -120,6 +132,62 @@ def get_request_canonical_path(request, ):
     return path
 
 
+# 解析后的 UA 信息: 浏览器、操作系统、设备、UA 摘要(如 "PC / Windows 10 / Chrome 120.0.0")
+UserAgentInfo = namedtuple("UserAgentInfo", ["browser", "os", "device", "agent"])
+
+
+@lru_cache(maxsize=getattr(settings, "USER_AGENT_CACHE_SIZE", 1000))
+def parse_user_agent(ua_string):
+    """
+    解析 UA 字符串, 结果按 UA 字符串 LRU 缓存(命中情况见 parse_user_agent.cache_info())
+    :param ua_string: 原始 UA 字符串
+    :return: UserAgentInfo
+    """
+    user_agent = parse(ua_string)
+    return UserAgentInfo(user_agent.get_browser(), user_agent.get_os(), user_agent.get_device(), str(user_agent))
+
+
+def get_user_agent(request):
+    """
+    获取请求的 UA 解析结果,同一请求只解析一次
+    :param request:
+    :return: UserAgentInfo
+    """
+    # DRF Request 与中间件中的 HttpRequest 共用结果
+    request = getattr(request, '_request', request)
+    user_agent = getattr(request, 'user_agent_info', None)
+    if user_agent is None:
+        user_agent = parse_user_agent(request.META.get('HTTP_USER_AGENT', ''))
+        request.user_agent_info = user_agent
+    return user_agent
+
+
+def get_request_cache(request, name, func):
+    """
+    请求内缓存: 同一请求内只调用一次 func, 用于未启用进程内缓存(dispatch.is_process_cache_enabled)时,
+    避免同一请求(如列表逐行序列化)重复查询; DRF Request 与 HttpRequest 共用结果
+    :param request: 请求, 为None时直接调用 func
+    :param name: 缓存名称
+    :param func: 生成数据的函数
+    :return:
+    """
+    if request is None:
+        return func()
+    request = getattr(request, '_request', request)
+    store = request.__dict__.setdefault('_request_cache', {})
+    if name not in store:
+        store[name] = func()
+    return store[name]
+
+
+def get_user_agent_cache_info():
+    """
+    获取 UA 解析缓存的命中情况
+    :return: CacheInfo(hits, misses, maxsize, currsize)
+    """
+    return parse_user_agent.cache_info()
+
+
 def get_browser(request, ):
     """
     获取浏览器名
@@ -128,9 +196,7 @@ def get_browser(request, ):
     :param kwargs:
     :return:
     """
-    ua_string = request.META['HTTP_USER_AGENT']
-    user_agent = parse(ua_string)
-    return user_agent.get_browser()
+    return get_user_agent(request).browser
 
 
 def get_os(request, ):
@@ -141,9 +207,7 @@ def get_os(request, ):
     :param kwargs:
     :return:
     """
-    ua_string = request.META['HTTP_USER_AGENT']
-    user_agent = parse(ua_string)
-    return user_agent.get_os()
+    return get_user_agent(request).os
 
 
 def get_verbose_name(queryset=None, view=None, model=None):
@@ -171,49 +235,27 @@ def get_verbose_name(queryset=None, view=None, model=None):
 
 def get_ip_analysis(ip):
     """
-    获取ip详细概略
+    获取ip详细概略, 解析方式见 settings.IP_GEOLOCATION_PROVIDER
     :param ip: ip地址
     :return:
     """
-    data = {
-        "continent": "",
-        "country": "",
-        "province": "",
-        "city": "",
-        "district": "",
-        "isp": "",
-        "area_code": "",
-        "country_english": "",
-        "country_code": "",
-        "longitude": "",
-        "latitude": ""
-    }
-    if ip != 'unknown' and ip:
-        if getattr(settings, 'ENABLE_LOGIN_ANALYSIS_LOG', True):
-            try:
-                res = requests.get(url='https://ip.django-vue-admin.com/ip/analysis', params={"ip": ip}, timeout=5)
-                if res.status_code == 200:
-                    res_data = res.json()
-                    if res_data.get('code') == 0:
-                        data = res_data.get('data')
-                return data
-            except Exception as e:
-                print(e)
-    return data
+    return get_ip_geolocation(ip)
 
 
 def save_login_log(request):
     """
-    保存登录日志
+    保存登录日志: 异步写入时不阻塞登录请求, 远程接口解析IP地理位置时先写入再由后台线程补充(见 LoginLogWriter)
     :return:
     """
-    ip = get_request_ip(request=request)
-    analysis_data = get_ip_analysis(ip)
-    analysis_data['username'] = request.user.username
-    analysis_data['ip'] = ip
-    analysis_data['agent'] = str(parse(request.META['HTTP_USER_AGENT']))
-    analysis_data['browser'] = get_browser(request)
-    analysis_data['os'] = get_os(request)
-    analysis_data['creator_id'] = request.user.id
-    analysis_data['dept_belong_id'] = getattr(request.user, 'dept_id', '')
-    LoginLog.objects.create(**analysis_data)
+    user_agent = get_user_agent(request)
+    login_log_writer.submit(LoginLog(
+        username=request.user.username,
+        ip=get_request_ip(request=request),
+        agent=user_agent.agent,
+        browser=user_agent.browser,
+        os=user_agent.os,
+        creator_id=request.user.id,
+        dept_belong_id=getattr(request.user, 'dept_id', ''),
+        # 异步写入时以登录时间为准
+        create_datetime=timezone.now(),
+    ))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 按角色缓存接口数据(如前端路由、按钮权限),支持 ETag 协商缓存
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.utils.cache import get_conditional_response, quote_etag, patch_cache_control
+from django.utils.http import urlencode
+
+from application import dispatch
+from dvadmin.utils.authentication import get_user_role_ids
+
+# 影响按角色缓存数据的缓存版本号
+ROLE_CACHE_VERSIONS = ("menu", "permission")
+
+
+def get_role_cache_key(request, name):
+    """
+    获取按角色缓存的key: 超级管理员共用一份,其他用户按角色id集合区分,并带上菜单、权限版本号;
+    查询参数(如 restql 的 query/exclude)会影响返回数据, 按参数名排序后的查询字符串摘要区分
+    :param request: 请求
+    :param name: 缓存名称
+    :return:
+    """
+    user = request.user
+    if user.is_superuser:
+        role_key = "superuser"
+    else:
+        role_key = ",".join(str(role_id) for role_id in sorted(get_user_role_ids(user)))
+    version = ".".join(str(dispatch.get_cache_version(item)) for item in ROLE_CACHE_VERSIONS)
+    schema_name = connection.tenant.schema_name if dispatch.is_tenants_mode() else ""
+    query_string = urlencode(sorted(request.GET.lists()), doseq=True)
+    query_key = hashlib.md5(query_string.encode("utf-8")).hexdigest() if query_string else ""
+    return f"dvadmin:role_cache:{schema_name}:{name}:{role_key}:{version}:{query_key}"
+
+
+def get_role_cache_data(request, name, func):
+    """
+    获取按角色缓存的数据,未命中时调用 func 生成并缓存
+    :param request: 请求
+    :param name: 缓存名称
+    :param func: 生成数据的函数,返回值需可被json序列化
+    :return: (data, etag)
+    """
+    key = get_role_cache_key(request, name)
+    # 非共享缓存时其他进程的数据变化无法使缓存失效, 每次重新生成(ETag 仍可用于协商缓存)
+    enabled = dispatch.is_process_cache_enabled()
+    value = cache.get(key) if enabled else None
+    if value is None:
+        data = func()
+        content = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True, ensure_ascii=False)
+        etag = quote_etag(hashlib.md5(f"{key}:{content}".encode("utf-8")).hexdigest())
+        value = (data, etag)
+        if enabled:
+            cache.set(key, value, getattr(settings, "ROLE_CACHE_TIMEOUT", 60 * 60))
+    return value
+
+
+def role_cache_response(request, name, func, response_func):
+    """
+    返回按角色缓存的接口数据,请求头 If-None-Match 与 ETag 一致时返回304
+    :param request: 请求
+    :param name: 缓存名称
+    :param func: 生成数据的函数
+    :param response_func: 根据数据生成响应的函数
+    :return: Response
+    """
+    data, etag = get_role_cache_data(request, name, func)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = response_func(data)
+    response["ETag"] = etag
+    # 浏览器每次都需携带 If-None-Match 重新验证,且不允许共享缓存
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+"""
+@Remark: 全文搜索索引: 每个注册模型维护一张搜索影子表(MySQL FULLTEXT ngram 索引 / SQLite FTS5 trigram 虚拟表),
+搜索时以 pk IN (影子表匹配结果) 代替跨表 icontains; 影子表不存在或数据库不支持时回退为 icontains
+"""
+import operator
+import time
+from functools import partial, reduce
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+
+from application import dispatch
+
+# 已注册的搜索索引: 模型 -> SearchIndex
+search_index_registry = {}
+# 影子表是否存在的缓存: (schema, 搜索索引版本号, 表名) -> (bool, 过期时间)
+_table_exists_cache = {}
+
+
+class SearchIndex:
+    """
+    模型搜索索引
+    (1)fields: 参与搜索的字段, 支持跨表字段, 如 ["username", "name", "dept__name", "role__name"]
+    (2)影子表: <模型表名>_search, 每个字段一列, object_id 为模型主键
+    """
+    # 各数据库支持的最短搜索词长度(MySQL ngram_token_size 默认2, SQLite trigram 为3), 更短时回退为 icontains
+    min_term_length = {"mysql": 2, "sqlite": 3}
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = list(fields)
+        self.table = f"{model._meta.db_table}_search"
+
+    # ================================================= #
+    # ************** 影子表 ************** #
+    # ================================================= #
+
+    def is_supported(self):
+        return connection.vendor in self.min_term_length
+
+    def table_exists(self):
+        if not self.is_supported():
+            return False
+        schema_name = connection.tenant.schema_name if dispatch.is_tenants_mode() else ""
+        key = (schema_name, dispatch.get_cache_version("search_index"), self.table)
+        now = time.monotonic()
+        exists, expires = _table_exists_cache.get(key, (None, None))
+        if exists is None or (expires is not None and expires <= now):
+            exists = self.table in connection.introspection.table_names()
+            # 未启用进程内缓存时版本号不能跨进程同步, 按时间间隔重新检查
+            interval = getattr(settings, "SEARCH_INDEX_TABLE_CHECK_INTERVAL", 60)
+            expires = None if dispatch.is_process_cache_enabled() else now + interval
+            _table_exists_cache[key] = (exists, expires)
+        return exists
+
+    def create_table(self):
+        """
+        删除并重新创建影子表
+        :return:
+        """
+        quote_name = connection.ops.quote_name
+        columns = [quote_name(field) for field in self.fields]
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {quote_name(self.table)}")
+            if connection.vendor == "mysql":
+                indexes = [f"FULLTEXT INDEX {quote_name('ft_all')} ({', '.join(columns)}) WITH PARSER ngram"] + [
+                    f"FULLTEXT INDEX {quote_name(f'ft_{index}')} ({column}) WITH PARSER ngram"
+                    for index, column in enumerate(columns)
+                ]
+                cursor.execute(
+                    f"CREATE TABLE {quote_name(self.table)} (object_id BIGINT NOT NULL PRIMARY KEY, "
+                    f"{', '.join(f'{column} LONGTEXT' for column in columns)}, {', '.join(indexes)}"
+                    f") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+                )
+            else:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE {quote_name(self.table)} USING fts5("
+                    f"object_id UNINDEXED, {', '.join(columns)}, tokenize='trigram')"
+                )
+
+    def get_documents(self, pk_list=None):
+        """
+        获取模型数据的搜索文本, 多值字段(如多对多)以空格拼接
+        :param pk_list: 主键列表, 为None时获取全部
+        :return: {pk: [字段文本]}
+        """
+        queryset = self.model._base_manager.all()
+        if pk_list is not None:
+            queryset = queryset.filter(pk__in=pk_list)
+        documents = {pk: [[] for _ in self.fields] for pk in queryset.values_list("pk", flat=True)}
+        for index, field in enumerate(self.fields):
+            for pk, value in queryset.values_list("pk", field).order_by():
+                if value not in (None, "") and pk in documents:
+                    documents[pk][index].append(str(value))
+        return {pk: [" ".join(values) for values in document] for pk, document in documents.items()}
+
+    def update(self, pk_list):
+        """
+        更新影子表中指定数据的搜索文本, 数据已删除时从影子表删除
+        :param pk_list: 主键列表
+        :return:
+        """
+        pk_list = list(pk_list)
+        if not pk_list or not self.table_exists():
+            return
+        documents = self.get_documents(pk_list)
+        self.delete(pk_list)
+        self.insert(documents)
+
+    def delete(self, pk_list):
+        pk_list = list(pk_list)
+        if not pk_list or not self.table_exists():
+            return
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {quote_name(self.table)} WHERE object_id IN ({', '.join(['%s'] * len(pk_list))})",
+                pk_list)
+
+    def insert(self, documents, batch_size=500):
+        quote_name = connection.ops.quote_name
+        sql = (f"INSERT INTO {quote_name(self.table)} (object_id, {', '.join(quote_name(f) for f in self.fields)}) "
+               f"VALUES ({', '.join(['%s'] * (len(self.fields) + 1))})")
+        rows = [[pk] + values for pk, values in documents.items()]
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                cursor.executemany(sql, rows[start:start + batch_size])
+
+    def rebuild(self):
+        """
+        重建影子表
+        :return: 写入的数据条数
+        """
+        self.create_table()
+        documents = self.get_documents()
+        self.insert(documents)
+        # 使各进程重新检查影子表是否存在
+        dispatch.refresh_cache_version("search_index")
+        return len(documents)
+
+    # ================================================= #
+    # ************** 搜索 ************** #
+    # ================================================= #
+
+    def can_search(self, fields, term):
+        """
+        是否可以使用影子表搜索
+        :param fields: 搜索字段
+        :param term: 搜索词
+        :return:
+        """
+        return (
+            getattr(settings, "SEARCH_INDEX_ENABLED", True)
+            and set(fields) <= set(self.fields)
+            and len(term) >= self.min_term_length.get(connection.vendor, 0)
+            and self.table_exists()
+        )
+
+    def get_match_sql(self, fields, term):
+        quote_name = connection.ops.quote_name
+        table = quote_name(self.table)
+        phrase = self.quote_phrase(term)
+        if connection.vendor == "mysql":
+            # MATCH 的字段须与某个 FULLTEXT 索引一致: 全部字段或单个字段, 部分字段时逐个匹配后合并
+            column_groups = [self.fields] if set(fields) == set(self.fields) else [[field] for field in fields]
+            sql = " UNION ".join(
+                f"SELECT object_id FROM {table} WHERE MATCH ({', '.join(quote_name(c) for c in columns)}) "
+                f"AGAINST (%s IN BOOLEAN MODE)"
+                for columns in column_groups
+            )
+            return sql, [phrase] * len(column_groups)
+        return f"SELECT object_id FROM {table} WHERE {table} MATCH %s", [f"{{{' '.join(fields)}}} : {phrase}"]
+
+    @staticmethod
+    def quote_phrase(term):
+        return '"' + term.replace('"', '""' if connection.vendor == "sqlite" else "") + '"'
+
+    def filter(self, queryset, fields, term):
+        sql, params = self.get_match_sql(list(fields), term)
+        return queryset.filter(pk__in=RawSQL(sql, params))
+
+    # ================================================= #
+    # ************** 索引维护 ************** #
+    # ================================================= #
+
+    def update_on_commit(self, pk_list):
+        transaction.on_commit(partial(self.update, list(pk_list)))
+
+    def handle_save(self, sender, instance, update_fields=None, **kwargs):
+        # 只更新了与搜索无关的字段(如登录时的 last_login)时跳过
+        if update_fields is not None and not set(update_fields) & {f.split(LOOKUP_SEP)[0] for f in self.fields}:
+            return
+        self.update_on_commit([instance.pk])
+
+    def handle_delete(self, sender, instance, **kwargs):
+        transaction.on_commit(partial(self.delete, [instance.pk]))
+
+    def get_related_fields(self, relation):
+        """
+        获取关联模型中参与搜索的字段, 如 relation 为 dept 时返回 ["name"]
+        :param relation: 关联路径
+        :return:
+        """
+        prefix = relation + LOOKUP_SEP
+        return [field[len(prefix):] for field in self.fields
+                if field.startswith(prefix) and LOOKUP_SEP not in field[len(prefix):]]
+
+    def handle_related_pre_save(self, sender, instance, relation, raw=False, **kwargs):
+        # 记录关联数据修改前参与搜索的字段值, 用于判断是否需要更新引用它的数据
+        if raw or instance.pk is None or not self.table_exists():
+            return
+        instance.__dict__[f"_search_index:{self.table}:{relation}"] = sender._base_manager.filter(
+            pk=instance.pk).values_list(*self.get_related_fields(relation)).first()
+
+    def handle_related_save(self, sender, instance, created, relation, update_fields=None, **kwargs):
+        # 新增的关联数据尚未被引用; 参与搜索的字段(如部门名称)未变化时跳过
+        old = instance.__dict__.pop(f"_search_index:{self.table}:{relation}", None)
+        fields = self.get_related_fields(relation)
+        if created or (update_fields is not None and not set(update_fields) & set(fields)):
+            return
+        if old is not None and old == tuple(instance.serializable_value(field) for field in fields):
+            return
+        self.handle_related_change(sender, instance, relation)
+
+    def handle_related_change(self, sender, instance, relation, **kwargs):
+        # 关联数据(如部门名称)修改或删除前, 找出引用它的数据在事务提交后更新
+        if not self.table_exists():
+            return
+        pk_list = list(self.model._base_manager.filter(**{relation: instance.pk}).values_list("pk", flat=True))
+        self.update_on_commit(pk_list)
+
+    def handle_m2m_changed(self, sender, instance, action, reverse, pk_set, relation, **kwargs):
+        if action in ("post_add", "post_remove", "post_clear"):
+            if not reverse:
+                self.update_on_commit([instance.pk])
+            elif pk_set:
+                self.update_on_commit(pk_set)
+        elif action == "pre_clear" and reverse:
+            self.handle_related_change(sender, instance, relation)
+
+    def connect(self):
+        """
+        注册索引维护信号: 模型保存/删除, 跨表字段关联模型的搜索字段修改或删除, 多对多关系变化
+        :return:
+        """
+        uid = f"search_index:{self.table}"
+        post_save.connect(self.handle_save, sender=self.model, weak=False, dispatch_uid=uid)
+        post_delete.connect(self.handle_delete, sender=self.model, weak=False, dispatch_uid=uid)
+        for field in self.fields:
+            parts = field.split(LOOKUP_SEP)
+            if len(parts) == 1:
+                continue
+            model_field = self.model._meta.get_field(parts[0])
+            if model_field.many_to_many:
+                m2m_changed.connect(partial(self.handle_m2m_changed, relation=parts[0]),
+                                    sender=getattr(self.model, parts[0]).through, weak=False,
+                                    dispatch_uid=f"{uid}:{parts[0]}")
+            model = self.model
+            for name in parts[:-1]:
+                model = model._meta.get_field(name).related_model
+            relation = LOOKUP_SEP.join(parts[:-1])
+            dispatch_uid = f"{uid}:{relation}"
+            pre_save.connect(partial(self.handle_related_pre_save, relation=relation), sender=model, weak=False,
+                             dispatch_uid=dispatch_uid)
+            post_save.connect(partial(self.handle_related_save, relation=relation), sender=model, weak=False,
+                              dispatch_uid=dispatch_uid)
+            pre_delete.connect(partial(self.handle_related_change, relation=relation), sender=model, weak=False,
+                               dispatch_uid=dispatch_uid)
+
+
+def register_search_index(model, fields):
+    """
+    注册模型搜索索引
+    :param model: 模型
+    :param fields: 搜索字段
+    :return: SearchIndex
+    """
+    search_index = SearchIndex(model, fields)
+    search_index.connect()
+    search_index_registry[model] = search_index
+    return search_index
+
+
+def get_search_index(model):
+    return search_index_registry.get(model)
+
+
+def search_queryset(queryset, fields, term):
+    """
+    按搜索词过滤, 已注册搜索索引且影子表可用时使用影子表, 否则为各字段 icontains(或)
+    :param queryset:
+    :param fields: 搜索字段
+    :param term: 搜索词
+    :return:
+    """
+    fields = list(fields)
+    search_index = get_search_index(queryset.model)
+    if search_index is not None and search_index.can_search(fields, term):
+        return search_index.filter(queryset, fields, term)
+    queryset = queryset.filter(reduce(operator.or_, [Q(**{f"{field}__icontains": term}) for field in fields]))
+    if any(LOOKUP_SEP in field for field in fields):
+        queryset = queryset.distinct()
+    return queryset
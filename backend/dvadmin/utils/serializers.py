@@ -10,13 +10,29 @@ from rest_framework import serializers
 from rest_framework.fields import empty
 from rest_framework.request import Request
 from rest_framework.serializers import ModelSerializer
+from django.db import models
 from django.utils.functional import cached_property
 from rest_framework.utils.serializer_helpers import BindingDict
 
 from dvadmin.system.models import Users
+from dvadmin.utils.query_planner import get_serializer_fields
 from django_restql.mixins import DynamicFieldsMixin
 
 
+class CustomListSerializer(serializers.ListSerializer):
+    """
+    列表序列化器: 序列化前一次性查询本页所有修改人的名称,避免逐行查询
+    """
+
+    def to_representation(self, data):
+        iterable = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if hasattr(self.child, "get_modifier_name_map") and "modifier_name" in get_serializer_fields(self.child):
+            self.child.get_modifier_name_map(
+                [self.child.get_modifier_id(instance) for instance in iterable]
+            )
+        return super().to_representation(iterable)
+
+
 class CustomModelSerializer(DynamicFieldsMixin, ModelSerializer):
     """
     增强DRF的ModelSerializer,可自动更新模型的审计字段记录
@@ -26,19 +42,39 @@ class CustomModelSerializer(DynamicFieldsMixin, ModelSerializer):
     # 修改人的审计字段名称, 默认modifier, 继承使用时可自定义覆盖
     modifier_field_id = "modifier"
     modifier_name = serializers.SerializerMethodField(read_only=True)
+    # SerializerMethodField等无法自动推断的字段依赖, 供视图集生成查询计划, 如 {"role_info": ["role"]}
+    query_plan_hints = {"modifier_name": ["modifier"]}
     dept_belong_id = serializers.IntegerField(required=False, allow_null=True)
 
+    def get_modifier_id(self, instance):
+        # values_queryset 形式时 instance 为 dict
+        if isinstance(instance, dict):
+            return instance.get(self.modifier_field_id, None)
+        return getattr(instance, self.modifier_field_id, None)
+
+    def get_modifier_name_map(self, modifier_ids):
+        """
+        批量获取修改人名称,同一请求内缓存
+        :param modifier_ids: 修改人id列表
+        :return: {修改人id(字符串): 名称}
+        """
+        owner = self.request if self.request is not None else self
+        name_map = getattr(owner, "_modifier_name_map", None)
+        if name_map is None:
+            name_map = {}
+            setattr(owner, "_modifier_name_map", name_map)
+        missing = {str(modifier_id) for modifier_id in modifier_ids if str(modifier_id).isdigit()} - set(name_map)
+        if missing:
+            names = dict(Users.objects.filter(id__in=missing).values_list("id", "name"))
+            for modifier_id in missing:
+                name_map[modifier_id] = names.get(int(modifier_id), None)
+        return name_map
+
     def get_modifier_name(self, instance):
-        if not hasattr(instance, "modifier"):
+        modifier_id = self.get_modifier_id(instance)
+        if modifier_id is None:
             return None
-        queryset = (
-            Users.objects.filter(id=instance.modifier)
-            .values_list("name", flat=True)
-            .first()
-        )
-        if queryset:
-            return queryset
-        return None
+        return self.get_modifier_name_map([modifier_id]).get(str(modifier_id), None) or None
 
     # 创建人的审计字段名称, 默认creator, 继承使用时可自定义覆盖
     creator_field_id = "creator"
@@ -59,6 +95,13 @@ class CustomModelSerializer(DynamicFieldsMixin, ModelSerializer):
         super().__init__(instance, data, **kwargs)
         self.request: Request = request or self.context.get("request", None)
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # 未自定义 Meta.list_serializer_class 时默认使用批量获取修改人名称的列表序列化器
+        meta = cls.__dict__.get("Meta")
+        if meta is not None and not hasattr(meta, "list_serializer_class"):
+            meta.list_serializer_class = CustomListSerializer
+
     def save(self, **kwargs):
         return super().save(**kwargs)
 
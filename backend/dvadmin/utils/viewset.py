@@ -6,6 +6,7 @@
 @Created on: 2021/6/1 001 22:57
 @Remark: 自定义视图集
 """
+from django.conf import settings
 from django.db import transaction
 from django_filters import DateTimeFromToRangeFilter
 from django_filters.rest_framework import FilterSet
@@ -18,6 +19,7 @@ from dvadmin.utils.filters import DataLevelPermissionsFilter, CoreModelFilterBan
 from dvadmin.utils.import_export_mixin import ExportSerializerMixin, ImportSerializerMixin
 from dvadmin.utils.json_response import SuccessResponse, ErrorResponse, DetailResponse
 from dvadmin.utils.permission import CustomPermission
+from dvadmin.utils.query_planner import build_query_plan
 from dvadmin.utils.models import get_custom_app_models, CoreModel
 from dvadmin.system.models import FieldPermission, MenuField
 from django_restql.mixins import QueryArgumentsMixin
@@ -32,6 +34,10 @@ class CustomModelViewSet(ModelViewSet, ImportSerializerMixin, ExportSerializerMi
     (3)filter_fields = '__all__' 默认支持全部model中的字段查询(除json字段外)
     (4)import_field_dict={} 导入时的字段字典 {model值: model的label}
     (5)export_field_label = [] 导出时的字段
+    (6)auto_query_plan = True 列表、详情根据序列化器字段自动select_related/prefetch_related/only, 设为False关闭
+    (7)keyset_pagination = True 列表使用游标分页(需前端按响应中的 next/previous 传 cursor 参数翻页), keyset_ordering 为排序字段,
+       默认("-create_datetime", "-id"); 请求携带 ordering 参数时改用页码分页, 按其排序
+    (8)count_strategy = None 分页总数统计策略 exact|cached|estimated, 默认使用 settings.PAGINATION_COUNT_STRATEGY
     """
     values_queryset = None
     ordering_fields = '__all__'
@@ -43,6 +49,10 @@ class CustomModelViewSet(ModelViewSet, ImportSerializerMixin, ExportSerializerMi
     permission_classes = [CustomPermission]
     import_field_dict = {}
     export_field_label = {}
+    auto_query_plan = True
+    keyset_pagination = False
+    keyset_ordering = None
+    count_strategy = None
 
     def filter_queryset(self, queryset):
         for backend in set(set(self.filter_backends) | set(self.extra_filter_class or [])):
@@ -52,7 +62,33 @@ class CustomModelViewSet(ModelViewSet, ImportSerializerMixin, ExportSerializerMi
     def get_queryset(self):
         if getattr(self, 'values_queryset', None):
             return self.values_queryset
-        return super().get_queryset()
+        queryset = super().get_queryset()
+        query_plan = self.get_query_plan()
+        if query_plan is not None:
+            queryset = query_plan.apply(queryset)
+        return queryset
+
+    def get_query_plan(self):
+        """
+        根据序列化器字段(含restql选择的字段)生成查询计划,仅用于列表、详情
+        :return: QueryPlan 或 None
+        """
+        if not self.auto_query_plan or self.action not in ('list', 'retrieve'):
+            return None
+        if not hasattr(self, '_query_plan'):
+            serializer_class = self.get_serializer_class()
+            self._query_plan = None
+            if hasattr(getattr(serializer_class, 'Meta', None), 'model'):
+                self._query_plan = build_query_plan(serializer_class(context=self.get_serializer_context()))
+        return self._query_plan
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        # 调试时通过响应头查看自动生成的查询计划
+        query_plan = getattr(self, '_query_plan', None)
+        if query_plan is not None and getattr(settings, 'QUERY_PLAN_DEBUG_HEADER', settings.DEBUG):
+            response['X-Query-Plan'] = str(query_plan) or 'none'
+        return response
 
     def get_serializer_class(self):
         action_serializer_name = f"{self.action}_serializer_class"